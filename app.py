@@ -1,13 +1,40 @@
 import os
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, send_file
+import atexit
+import queue
+import threading
+import click
+import logging
+import bisect
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, send_file, send_from_directory, Response, stream_with_context, make_response, has_request_context
+from markupsafe import escape
 from werkzeug.security import generate_password_hash, check_password_hash
 import time
-from functools import wraps
+from functools import wraps, partial
 import math
+import random
 import re
-import pandas as pd
-from io import BytesIO
+import json
+import hashlib
+import hmac
+import secrets
+import gzip
+import zlib
+import csv
+from html.parser import HTMLParser
+from itertools import islice
+import tempfile
+import shutil
+import mimetypes
+import posixpath
+from urllib.parse import quote, urlsplit, urljoin
+import http.client
+import socket
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from collections import OrderedDict
+from io import StringIO, TextIOWrapper
 
 app = Flask(__name__, instance_relative_config=True)
 app.config.from_mapping(
@@ -18,7 +45,105 @@ app.config.from_mapping(
     LOGIN_TIMEOUT=300,  # 5分钟
     BLACKLIST_THRESHOLD=10,  # 10次失败尝试后加入黑名单
     BLACKLIST_DURATION=3600,  # 黑名单持续时间（秒）
+    LOGIN_THROTTLE_FLUSH_INTERVAL=2,  # 登录限流状态批量写入数据库的间隔（秒）
+    AUTH_MAINTENANCE_INTERVAL=600,  # 认证数据库维护间隔（秒），0表示不自动维护
+    LOGIN_ATTEMPTS_RETENTION=86400,  # 登录记录原始数据保留时间（秒），之后汇总为计数
+    LOGIN_ROLLUP_WINDOW=3600,  # 登录记录汇总的时间窗口（秒）
+    LOGIN_ROLLUP_RETENTION=30 * 86400,  # 登录汇总计数保留时间（秒）
+    MAINTENANCE_BATCH_SIZE=5000,  # 维护任务每批删除的行数
+    USER_DATABASE_DIR=os.path.join(app.instance_path, 'users'),  # 每个用户的书签数据库所在的目录（升级前的第一个用户仍使用 DATABASE）
+    USER_DATABASE_CACHE_SIZE=32,  # 每个进程最多为多少个用户数据库保持连接池，超出时关闭最久未使用的
+    REGISTRATION_OPEN=False,  # 是否允许在注册页面自行注册；第一个账户总是可以注册，其他账户可以用 flask create-user 创建
+    LINK_CHECK_INTERVAL=0,  # 后台检查死链的间隔（秒），0表示不在后台检查
+    LINK_CHECK_BATCH_SIZE=200,  # 每批领取的待检查书签数
+    LINK_CHECK_CONCURRENCY=16,  # 同时检查的链接数
+    LINK_CHECK_PER_HOST=2,  # 同一主机最多同时发出的请求数
+    LINK_CHECK_HOST_INTERVAL=1.0,  # 同一主机两次请求之间的最短间隔（秒）
+    LINK_CHECK_TIMEOUT=10,  # 每个请求的超时时间（秒）
+    LINK_CHECK_MAX_REDIRECTS=5,  # 最多跟随的重定向次数
+    LINK_CHECK_RECHECK_INTERVAL=7 * 86400,  # 正常链接的复查间隔（秒）
+    LINK_CHECK_RETRY_INTERVAL=3600,  # 检查失败后首次复查的间隔（秒），之后每次加倍
+    LINK_CHECK_BROKEN_AFTER=2,  # 连续出错（超时、5xx等）多少次后视为死链，4xx立即视为死链
+    LINK_CHECK_LEASE=600,  # 领取的书签在该时间（秒）内没有写回结果时可以被重新领取
+    LINK_CHECK_USER_AGENT='Mozilla/5.0 (compatible; BookmarkManager link checker)',
+    LINK_CHECK_BLOCK_PRIVATE_ADDRESSES=True,  # 死链检查和网页信息抓取不访问本机、内网、链路本地等非公网地址
+    METADATA_FETCH_INTERVAL=0,  # 后台抓取网页标题、描述和网站图标的间隔（秒），0表示不在后台抓取；同一主机的限速与死链检查相同
+    METADATA_BATCH_SIZE=100,  # 每批领取的待抓取书签数
+    METADATA_PAGE_LIMIT=256 * 1024,  # 每个网页最多读取的字节数，标题和描述都在开头
+    METADATA_RETRY_INTERVAL=3600,  # 抓取失败后首次重试的间隔（秒），之后每次加倍
+    METADATA_MAX_FAILURES=3,  # 连续失败多少次后不再重试，修改网址后重新抓取
+    ICON_CACHE_DIR=os.path.join(app.instance_path, 'icons'),  # 网站图标缓存目录，文件以内容哈希命名
+    ICON_CACHE_MAX_BYTES=64 * 1024 * 1024,  # 图标缓存的总大小上限，超出时淘汰最久未使用的图标
+    ICON_MAX_BYTES=100 * 1024,  # 单个图标的大小上限
+    ICON_REFRESH_INTERVAL=30 * 86400,  # 网站图标的刷新间隔（秒）
+    ICON_RETRY_INTERVAL=86400,  # 没有取到图标的网站过多久再试（秒）
+    SESSION_CACHE_TTL=60,  # 已验证用户的缓存时间（秒）
+    BATCH_MAX_ITEMS=10000,  # 批量排序、移动接口一次最多处理的条目数
+    CHANGES_PAGE_SIZE=1000,  # 变更记录接口每次最多返回的记录数
+    DUPLICATES_PAGE_SIZE=200,  # 重复书签报告每页最多返回的分组数
+    CHANGE_LOG_RETENTION=30 * 86400,  # 删除记录在变更日志中的保留时间（秒）
+    SEARCH_DEFAULT_LIMIT=50,  # 搜索默认返回条数
+    SEARCH_MAX_LIMIT=200,  # 搜索最多返回条数
+    BOOKMARKS_MAX_PAGE_SIZE=1000,  # 书签分页每页最多条数
+    TREE_MAX_EMBEDDED_BOOKMARKS=100,  # 分类树中每个分类最多附带的书签数
+    STREAM_CHUNK_SIZE=500,  # 流式输出时每次从游标读取的行数
+    COMPRESS_MIN_SIZE=1024,  # 响应体达到该大小（字节）且客户端支持时使用gzip压缩
+    STATIC_ASSET_MAX_AGE=365 * 86400,  # 带内容哈希的静态资源的浏览器缓存时间（秒）
+    COMPRESS_LEVEL=4,  # gzip压缩级别（1-9），越高越省流量但越耗CPU
+    IMPORT_BATCH_SIZE=5000,  # 导入书签时每个事务写入的行数
+    AUTO_MIGRATE=True,  # 启动时自动升级数据库结构
+    DB_POOL_SIZE=8,  # 每个进程中每个数据库最多保持的连接数
+    DB_POOL_TIMEOUT=10,  # 连接池耗尽时等待空闲连接的最长时间（秒）
+    DB_BUSY_TIMEOUT=5000,  # 数据库被锁时的等待时间（毫秒）
+    DB_MMAP_SIZE=256 * 1024 * 1024,  # 内存映射读取的大小（字节）
+    DB_CACHE_SIZE=16 * 1024,  # 每个连接的页缓存大小（KiB）
+    DB_CACHED_STATEMENTS=256,  # 每个连接缓存的预编译语句数
+    LOG_LEVEL='INFO',  # 日志级别：DEBUG / INFO / WARNING / ERROR
+    LOG_FORMAT='json',  # 日志格式：json 为每行一个JSON对象，text 为 key=value 文本
+    METRICS_ENABLED=True,  # 是否记录请求和SQL指标
+    METRICS_DIR=os.path.join(app.instance_path, 'metrics'),  # 各工作进程指标快照的目录，/metrics 合并后输出
+    METRICS_FLUSH_INTERVAL=5,  # 工作进程写入指标快照的最短间隔（秒）
+    METRICS_TOKEN='',  # 设置后访问 /metrics 需要 Authorization: Bearer <token>，未设置时只允许本机访问
 )
+# 允许通过 FLASK_ 前缀的环境变量覆盖配置，例如 FLASK_AUTO_MIGRATE=false
+app.config.from_prefixed_env()
+
+# 日志
+# 每条日志是一个事件名加若干字段，默认每行输出一个JSON对象。
+# 级别未开启时 log_event 直接返回，不会格式化消息，调用方也不必先计算字段。
+logger = logging.getLogger('bookmarks')
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, json_format=True):
+        super().__init__()
+        self.json_format = json_format
+    
+    def format(self, record):
+        fields = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+            'pid': record.process,
+        }
+        fields.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            fields['exception'] = self.formatException(record.exc_info)
+        if self.json_format:
+            return json.dumps(fields, ensure_ascii=False, default=str)
+        return ' '.join(f'{key}={value}' for key, value in fields.items())
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_format=str(app.config['LOG_FORMAT']).lower() != 'text'))
+    logger.handlers = [handler]
+    logger.setLevel(str(app.config['LOG_LEVEL']).upper())
+    logger.propagate = False
+
+configure_logging()
+
+def log_event(level, event, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
 
 # 确保实例文件夹存在并设置正确的权限
 try:
@@ -26,44 +151,536 @@ try:
 except OSError:
     pass
 
+# 数据库连接池
+# 每个进程为每个数据库文件保持一组长连接，请求结束后归还而不是关闭。
+# 数据库文件被删除或替换（例如删除 auth.sqlite 重置账户）后，旧连接会在下次取用时被丢弃。
+class PoolTimeout(Exception):
+    pass
+
+# 统计每个请求在每个数据库上执行的SQL语句数和耗时（只计执行，不含逐行读取结果的时间）
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_sql(self.connection, time.perf_counter() - started)
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_sql(self.connection, time.perf_counter() - started)
+    
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            record_sql(self.connection, time.perf_counter() - started)
+
+def record_sql(conn, elapsed):
+    if not has_request_context():
+        return
+    stats = g.setdefault('sql_stats', {})
+    entry = stats.get(conn.database_name)
+    if entry is None:
+        entry = stats[conn.database_name] = [0, 0.0]
+    entry[0] += 1
+    entry[1] += elapsed
+
+class PooledConnection(sqlite3.Connection):
+    generation = 0
+    database_name = 'unknown'
+    
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+    
+    # 与 sqlite3.Connection 的同名方法相同，但使用带统计的游标
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+class ConnectionPool:
+    def __init__(self, path, size, timeout, name=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        # 指标中的数据库名，所有用户的书签数据库共用一个名字
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.closed = False
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._generation = 0
+        self._identity = self._file_identity()
+        self.schema_generation = None  # 已完成结构初始化的数据库文件版本
+        self.schema_lock = threading.Lock()
+        self.stats = {
+            'acquired': 0,
+            'reused': 0,
+            'created': 0,
+            'discarded': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'timeouts': 0
+        }
+    
+    def _file_identity(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+    
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), mode=0o777, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            cached_statements=app.config['DB_CACHED_STATEMENTS'],
+            factory=PooledConnection
+        )
+        conn.database_name = self.name
+        conn.row_factory = sqlite3.Row
+        # WAL模式下读写互不阻塞，多个进程共享数据库文件也是安全的
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f"PRAGMA busy_timeout = {int(app.config['DB_BUSY_TIMEOUT'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(app.config['DB_MMAP_SIZE'])}")
+        conn.execute(f"PRAGMA cache_size = {-int(app.config['DB_CACHE_SIZE'])}")
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+    
+    def _discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._open -= 1
+                self.stats['discarded'] += 1
+    
+    def acquire(self):
+        # 数据库文件变化后，让已有连接全部失效
+        identity = self._file_identity()
+        if identity != self._identity:
+            with self._lock:
+                self._identity = identity
+                self._generation += 1
+        
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+            
+            if conn is None:
+                with self._lock:
+                    can_create = self._open < self.size
+                    if can_create:
+                        self._open += 1
+                
+                if can_create:
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                    with self._lock:
+                        self._identity = self._file_identity()
+                        conn.generation = self._generation
+                        self.stats['created'] += 1
+                        self.stats['acquired'] += 1
+                    return conn
+                
+                # 连接数已达上限，等待其他请求归还连接
+                started = time.monotonic()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.stats['timeouts'] += 1
+                    raise PoolTimeout(f'等待数据库连接超时: {os.path.basename(self.path)}')
+                waited = time.monotonic() - started
+                with self._lock:
+                    self.stats['waits'] += 1
+                    self.stats['wait_time'] += waited
+                    self.stats['max_wait_time'] = max(self.stats['max_wait_time'], waited)
+            
+            if conn.generation != self._generation:
+                self._discard(conn)
+                continue
+            
+            with self._lock:
+                self.stats['reused'] += 1
+                self.stats['acquired'] += 1
+            return conn
+    
+    def release(self, conn):
+        # 连接池已被关闭（用户数据库被移出缓存），归还的连接直接关闭
+        if self.closed:
+            self._discard(conn)
+            return
+        try:
+            # 回滚未提交的事务，保证下一个请求拿到干净的连接
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+    
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+    
+    def close(self):
+        self.closed = True
+        self.close_all()
+    
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['open'] = self._open
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        stats['size'] = self.size
+        stats['hit_rate'] = stats['reused'] / stats['acquired'] if stats['acquired'] else 0.0
+        stats['avg_wait_time'] = stats['wait_time'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
+
+db_pools = {}
+user_db_pools = OrderedDict()  # 用户数据库的连接池，按最近使用排序
+db_pools_lock = threading.Lock()
+db_pools_pid = os.getpid()
+
+def reset_pools_after_fork():
+    global db_pools_pid
+    # fork出的子进程不能继续使用父进程的连接，直接丢弃（不关闭，避免影响父进程的文件锁）
+    if db_pools_pid != os.getpid():
+        with db_pools_lock:
+            if db_pools_pid != os.getpid():
+                db_pools.clear()
+                user_db_pools.clear()
+                db_pools_pid = os.getpid()
+
+def get_pool(db_path):
+    reset_pools_after_fork()
+    pool = db_pools.get(db_path)
+    if pool is None:
+        with db_pools_lock:
+            pool = db_pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path, app.config['DB_POOL_SIZE'], app.config['DB_POOL_TIMEOUT'])
+                db_pools[db_path] = pool
+    return pool
+
+# 用户很多时不能为每个数据库都保持连接，最多缓存 USER_DATABASE_CACHE_SIZE 个连接池，
+# 超出时关闭最久未使用的；正在使用的连接归还时关闭。再次访问时重新打开并检查结构（很快）。
+def get_user_pool(db_path):
+    reset_pools_after_fork()
+    with db_pools_lock:
+        pool = user_db_pools.get(db_path)
+        if pool is not None:
+            user_db_pools.move_to_end(db_path)
+            return pool
+        pool = ConnectionPool(db_path, app.config['DB_POOL_SIZE'], app.config['DB_POOL_TIMEOUT'], name='bookmarks')
+        user_db_pools[db_path] = pool
+        while len(user_db_pools) > app.config['USER_DATABASE_CACHE_SIZE']:
+            _, evicted = user_db_pools.popitem(last=False)
+            evicted.close()
+    return pool
+
+# 进程退出时关闭所有连接，让SQLite完成检查点并清理WAL文件
+@atexit.register
+def close_db_pools():
+    if db_pools_pid != os.getpid():
+        return
+    for pool in list(db_pools.values()) + list(user_db_pools.values()):
+        pool.close_all()
+
+# 数据库结构初始化
+# 每个进程对每个数据库文件只在第一次取得连接时建表并执行迁移，之后不再检查。
+# 数据库文件被删除或替换后连接池的版本号会变化，下次取用时重新初始化。
+# 设置 FLASK_AUTO_MIGRATE=false 可跳过，以便用 flask migrate --dry-run 预览迁移。
+# 多个进程同时迁移同一个数据库时，每一步都在 BEGIN IMMEDIATE 写锁下的一个事务中执行，后到的进程取得锁后发现版本已更新就跳过
+def ensure_schema(pool, conn, init_schema):
+    if pool.schema_generation == conn.generation or not app.config['AUTO_MIGRATE']:
+        return
+    with pool.schema_lock:
+        if pool.schema_generation != conn.generation:
+            init_schema(conn)
+            pool.schema_generation = conn.generation
+
 # 数据库连接
+# 每个用户的书签和分类保存在各自的数据库文件中，不同用户的写入互不阻塞。
+# users.db_file 是创建账户时分配的随机文件名（在 USER_DATABASE_DIR 中），不会复用已存在的文件，
+# 所以删除 auth.sqlite 后用户ID重新编号也不会打开其他人的数据库。
+# db_file 为空的是升级前的第一个用户（单用户时期的管理员），继续使用 DATABASE，原有数据不需要迁移。
+def user_database_path(db_file):
+    if db_file is None:
+        return app.config['DATABASE']
+    return os.path.join(app.config['USER_DATABASE_DIR'], db_file)
+
+# 用户数据库在备份目录和命令行输出中的名字
+def user_database_name(db_file):
+    if db_file is None:
+        return os.path.basename(app.config['DATABASE'])
+    return f'users/{db_file}'
+
+# 为新用户分配数据库文件：以独占方式创建空文件占位，文件名已存在时换一个
+def reserve_user_database_file():
+    os.makedirs(app.config['USER_DATABASE_DIR'], exist_ok=True)
+    while True:
+        db_file = f'{secrets.token_hex(16)}.sqlite'
+        try:
+            with open(user_database_path(db_file), 'x'):
+                return db_file
+        except FileExistsError:
+            continue
+
+def current_db_user():
+    # 命令行和后台任务用 use_user_db 指定用户，请求中使用已登录的用户；都没有时（如生成测试数据）使用 DATABASE
+    if 'db_user_id' in g:
+        return g.db_user_id
+    if has_request_context():
+        if 'user_id' not in session:
+            raise RuntimeError('未登录时不能访问书签数据库')
+        return session['user_id']
+    return None
+
 def get_db():
     if 'db' not in g:
-        db_path = app.config['DATABASE']
-        # 确保数据库目录存在并有正确的权限
-        os.makedirs(os.path.dirname(db_path), mode=0o777, exist_ok=True)
-        g.db = sqlite3.connect(
-            db_path,
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        db_file = user_database_file(current_db_user())
+        path = user_database_path(db_file)
+        g.db_pool = get_pool(path) if db_file is None else get_user_pool(path)
+        g.db = g.db_pool.acquire()
+        ensure_schema(g.db_pool, g.db, init_bookmarks_db)
     return g.db
 
+# 在请求之外（命令行、后台任务）访问指定用户的书签数据库
+@contextmanager
+def use_user_db(user_id):
+    with app.app_context():
+        g.db_user_id = user_id
+        yield get_db()
+
+def all_user_ids():
+    return [row['id'] for row in get_auth_db().execute('SELECT id FROM users ORDER BY id')]
+
 def get_auth_db():
     if 'auth_db' not in g:
-        db_path = app.config['AUTH_DATABASE']
-        # 确保数据库目录存在并有正确的权限
-        os.makedirs(os.path.dirname(db_path), mode=0o777, exist_ok=True)
-        g.auth_db = sqlite3.connect(
-            db_path,
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.auth_db.row_factory = sqlite3.Row
+        g.auth_db_pool = get_pool(app.config['AUTH_DATABASE'])
+        g.auth_db = g.auth_db_pool.acquire()
+        ensure_schema(g.auth_db_pool, g.auth_db, init_auth_db)
     return g.auth_db
 
 @app.teardown_appcontext
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        g.pop('db_pool').release(db)
     
     auth_db = g.pop('auth_db', None)
     if auth_db is not None:
-        auth_db.close()
+        g.pop('auth_db_pool').release(auth_db)
 
-def init_db():
-    db = get_db()
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({'error': '服务器繁忙，请稍后再试'}), 503
+
+# 请求指标
+# 按端点记录请求数、处理时间直方图，以及每个请求执行的SQL语句数和耗时，在 /metrics 以Prometheus文本格式输出。
+# 每个工作进程在内存中累计，并定期把快照写入 METRICS_DIR；/metrics 合并所有进程的快照，
+# 所以无论请求落到哪个工作进程，看到的都是整个服务的计数。
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+# 指标名: (类型, 说明, 标签名, 直方图分桶)
+METRIC_DEFINITIONS = {
+    'http_requests_total': ('counter', 'HTTP请求数', ('endpoint', 'method', 'status'), None),
+    'http_request_duration_seconds': ('histogram', 'HTTP请求处理时间（秒）', ('endpoint',), LATENCY_BUCKETS),
+    'sql_statements_total': ('counter', '执行的SQL语句数', ('endpoint', 'database'), None),
+    'sql_duration_seconds_total': ('counter', '执行SQL语句的总时间（秒）', ('endpoint', 'database'), None),
+    'sql_statements_per_request': ('histogram', '每个请求执行的SQL语句数', ('endpoint',), SQL_COUNT_BUCKETS),
+}
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {name: {} for name in METRIC_DEFINITIONS}
+        self._dirty = False
+        self._last_write = 0
+    
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            series = self._values[name]
+            series[labels] = series.get(labels, 0) + value
+            self._dirty = True
     
+    # 直方图保存每个分桶（最后一个为+Inf）的计数和总和
+    def observe(self, name, labels, value):
+        buckets = METRIC_DEFINITIONS[name][3]
+        with self._lock:
+            series = self._values[name]
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [0] * (len(buckets) + 1) + [0.0]
+            state[bisect.bisect_left(buckets, value)] += 1
+            state[-1] += value
+            self._dirty = True
+    
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: [[list(labels), list(value) if isinstance(value, list) else value]
+                       for labels, value in series.items()]
+                for name, series in self._values.items()
+            }
+    
+    def write_snapshot(self, force=False):
+        metrics_dir = app.config['METRICS_DIR']
+        now = time.monotonic()
+        if not metrics_dir or not self._dirty:
+            return
+        if not force and now - self._last_write < app.config['METRICS_FLUSH_INTERVAL']:
+            return
+        with self._lock:
+            self._dirty = False
+            self._last_write = now
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            path = os.path.join(metrics_dir, f'{os.getpid()}.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            log_event(logging.WARNING, 'metrics_write_failed', error=str(e))
+
+metrics_registry = MetricsRegistry()
+
+@atexit.register
+def write_final_metrics():
+    metrics_registry.write_snapshot(force=True)
+
+# 合并本进程的实时数据、其他工作进程的快照，以及 gunicorn 主进程汇总的已退出进程的计数（exited.json）
+def collect_metrics():
+    snapshots = [metrics_registry.snapshot()]
+    metrics_dir = app.config['METRICS_DIR']
+    own_file = f'{os.getpid()}.json'
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for filename in os.listdir(metrics_dir):
+            if not filename.endswith('.json') or filename == own_file:
+                continue
+            try:
+                with open(os.path.join(metrics_dir, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    
+    merged = {name: {} for name in METRIC_DEFINITIONS}
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            if name not in merged:
+                continue
+            for labels, value in series:
+                labels = tuple(labels)
+                current = merged[name].get(labels)
+                if current is None:
+                    merged[name][labels] = value
+                elif isinstance(value, list):
+                    merged[name][labels] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[name][labels] = current + value
+    return merged
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+def render_metrics(merged):
+    lines = []
+    for name, (metric_type, help_text, label_names, buckets) in METRIC_DEFINITIONS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in sorted(merged[name].items()):
+            if metric_type == 'counter':
+                lines.append(f'{name}{format_labels(label_names, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(label_names, labels, [('le', bound)])} {cumulative}")
+            lines.append(f'{name}_sum{format_labels(label_names, labels)} {value[-1]}')
+            lines.append(f'{name}_count{format_labels(label_names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+# 必须是第一个注册的 before_request，计时才包含会话验证等其他钩子
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'none'
+    sql_stats = g.get('sql_stats', {})
+    sql_count = sum(count for count, _ in sql_stats.values())
+    
+    if app.config['METRICS_ENABLED']:
+        metrics_registry.inc('http_requests_total', (endpoint, request.method, str(response.status_code)))
+        metrics_registry.observe('http_request_duration_seconds', (endpoint,), elapsed)
+        for database, (count, duration) in sql_stats.items():
+            metrics_registry.inc('sql_statements_total', (endpoint, database), count)
+            metrics_registry.inc('sql_duration_seconds_total', (endpoint, database), duration)
+        metrics_registry.observe('sql_statements_per_request', (endpoint,), sql_count)
+        metrics_registry.write_snapshot()
+    
+    log_event(
+        logging.DEBUG, 'request',
+        method=request.method, path=request.path, endpoint=endpoint, status=response.status_code,
+        duration_ms=round(elapsed * 1000, 2), sql_statements=sql_count,
+        sql_ms=round(sum(duration for _, duration in sql_stats.values()) * 1000, 2)
+    )
+    return response
+
+# 指标包含各接口的访问量和SQL耗时：设置 METRICS_TOKEN 时凭令牌访问，未设置时只允许本机访问
+def is_loopback_client():
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': '未授权'}), 401
+    elif not is_loopback_client():
+        return jsonify({'error': '未设置 METRICS_TOKEN 时只允许从本机访问'}), 403
+    return Response(render_metrics(collect_metrics()), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def init_bookmarks_db(db):
     # 创建书签数据表
     db.executescript('''
     CREATE TABLE IF NOT EXISTS categories (
@@ -86,8 +703,11 @@ def init_db():
     ''')
     db.commit()
     
+    # 升级书签数据库结构
+    migrate_db(db, BOOKMARKS_MIGRATIONS)
+
+def init_auth_db(auth_db):
     # 创建认证数据表
-    auth_db = get_auth_db()
     auth_db.executescript('''
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -110,11 +730,723 @@ def init_db():
     );
     ''')
     auth_db.commit()
+    
+    # 升级认证数据库结构
+    migrate_db(auth_db, AUTH_MIGRATIONS)
+
+# 排序键
+# 书签和分类的 position 是稀疏的整数键，相邻项之间默认间隔 POSITION_GAP。
+# 移动一项只需把它的键改为前后两项的中间值；只有间隔用尽时才重新编号该组（很少发生）。
+POSITION_GAP = 1024
+
+# 可排序的表及其分组列：书签按分类分组，分类按父分类分组
+ORDERED_TABLES = {
+    'bookmarks': 'category_id',
+    'categories': 'parent_id',
+}
+
+# 按当前顺序重新编号一个分组，或者所有分组
+def rebalance_positions(db, table, group_value=None, all_groups=False):
+    group_column = ORDERED_TABLES[table]
+    if all_groups:
+        rows = db.execute(
+            f'SELECT id, {group_column} AS group_value FROM {table} ORDER BY {group_column}, position, id'
+        )
+    else:
+        rows = db.execute(
+            f'SELECT id, {group_column} AS group_value FROM {table} '
+            f'WHERE {group_column} IS ? ORDER BY position, id',
+            (group_value,)
+        )
+    
+    updates = []
+    current_group = object()
+    rank = 0
+    for row in rows:
+        if row['group_value'] != current_group:
+            current_group = row['group_value']
+            rank = 0
+        rank += 1
+        updates.append((rank * POSITION_GAP, row['id']))
+    
+    db.executemany(f'UPDATE {table} SET position = ? WHERE id = ?', updates)
+
+# 计算插入到 before_id 之前（before_id 为 None 时为末尾）的排序键
+def position_before(db, table, group_value, item_id, before_id):
+    group_column = ORDERED_TABLES[table]
+    
+    if before_id is None:
+        last = db.execute(
+            f'SELECT MAX(position) FROM {table} WHERE {group_column} IS ? AND id != ?',
+            (group_value, item_id)
+        ).fetchone()[0]
+        return (last or 0) + POSITION_GAP
+    
+    next_position = db.execute(
+        f'SELECT position FROM {table} WHERE id = ?', (before_id,)
+    ).fetchone()[0]
+    prev_position = db.execute(
+        f'SELECT position FROM {table} WHERE {group_column} IS ? AND id != ? '
+        f'AND (position < ? OR (position = ? AND id < ?)) '
+        f'ORDER BY position DESC, id DESC LIMIT 1',
+        (group_value, item_id, next_position, next_position, before_id)
+    ).fetchone()
+    
+    if prev_position is None:
+        return next_position - POSITION_GAP
+    if next_position - prev_position[0] > 1:
+        return (prev_position[0] + next_position) // 2
+    return None
+
+# 把一项移动到同组 before_id 之前，只写这一行；间隔用尽时先重新编号该组
+def move_item_before(db, table, item_id, group_value, before_id):
+    group_column = ORDERED_TABLES[table]
+    
+    position = position_before(db, table, group_value, item_id, before_id)
+    if position is None:
+        rebalance_positions(db, table, group_value)
+        position = position_before(db, table, group_value, item_id, before_id)
+    
+    db.execute(
+        f'UPDATE {table} SET position = ?, {group_column} = ? WHERE id = ?',
+        (position, group_value, item_id)
+    )
+    return position
+
+# 找到同组中紧跟在 after_id 之后的一项
+def item_after(db, table, group_value, item_id, after_id):
+    group_column = ORDERED_TABLES[table]
+    after_position = db.execute(
+        f'SELECT position FROM {table} WHERE id = ?', (after_id,)
+    ).fetchone()[0]
+    row = db.execute(
+        f'SELECT id FROM {table} WHERE {group_column} IS ? AND id != ? '
+        f'AND (position > ? OR (position = ? AND id > ?)) ORDER BY position, id LIMIT 1',
+        (group_value, item_id, after_position, after_position, after_id)
+    ).fetchone()
+    return row['id'] if row else None
+
+# 找到排序键不小于 position 的第一项，兼容按位置值指定目标的旧接口
+def item_at_position(db, table, group_value, item_id, position):
+    group_column = ORDERED_TABLES[table]
+    row = db.execute(
+        f'SELECT id FROM {table} WHERE {group_column} IS ? AND id != ? AND position >= ? '
+        f'ORDER BY position, id LIMIT 1',
+        (group_value, item_id, position)
+    ).fetchone()
+    return row['id'] if row else None
+
+# 数据库迁移
+# 每个迁移是一个接收连接的函数，按列表顺序执行，已执行到的版本号记录在 PRAGMA user_version 中。
+# 迁移只能追加，不能修改或删除已发布的迁移。
+# 迁移步骤不能提交事务（executescript 会隐式提交），否则步骤不再是原子的，写锁也已经释放
+def check_migration_transaction(db, migration):
+    if not db.in_transaction:
+        raise RuntimeError(f'迁移 {migration.__name__} 提前提交了事务')
+
+def run_migrations(db, migrations):
+    for version in range(1, len(migrations) + 1):
+        # 加写锁后再检查版本，避免多个进程同时执行同一个迁移
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            current_version = db.execute('PRAGMA user_version').fetchone()[0]
+            if current_version >= version:
+                db.rollback()
+                continue
+            migrations[version - 1](db)
+            check_migration_transaction(db, migrations[version - 1])
+            db.execute(f'PRAGMA user_version = {version}')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+def migrate_db(db, migrations):
+    current_version = db.execute('PRAGMA user_version').fetchone()[0]
+    if current_version < len(migrations):
+        run_migrations(db, migrations)
+
+# 获取查询计划，用于对比迁移前后的效果
+def explain_query(db, sql):
+    try:
+        plan = db.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+        return '; '.join(row['detail'] for row in plan)
+    except sqlite3.OperationalError as e:
+        return f'(无法执行: {e})'
+
+# 演练迁移：把数据库备份到临时文件，在副本上执行所有待执行的迁移，输出热点查询前后的查询计划。
+# 不依赖回滚，原数据库不会被修改
+def dry_run_migrations(db, migrations, hot_queries):
+    current_version = db.execute('PRAGMA user_version').fetchone()[0]
+    report = {
+        'current_version': current_version,
+        'target_version': len(migrations),
+        'pending': [migration.__name__ for migration in migrations[current_version:]],
+        'plans': []
+    }
+    
+    before = {name: explain_query(db, sql) for name, sql in hot_queries.items()}
+    
+    with tempfile.TemporaryDirectory() as directory:
+        copy = sqlite3.connect(os.path.join(directory, 'dry-run.sqlite'))
+        try:
+            db.backup(copy)
+            copy.row_factory = sqlite3.Row
+            copy.execute('BEGIN IMMEDIATE')
+            for migration in migrations[current_version:]:
+                migration(copy)
+                check_migration_transaction(copy, migration)
+            after = {name: explain_query(copy, sql) for name, sql in hot_queries.items()}
+            copy.rollback()
+        finally:
+            copy.close()
+    
+    for name in hot_queries:
+        report['plans'].append({'query': name, 'before': before[name], 'after': after[name]})
+    return report
+
+# 书签数据库迁移
+# 创建分类层级闭包表，记录每个分类的所有祖先（含自身，depth=0）
+# 由触发器维护，任意深度的子树查询都只需一次索引连接
+def create_category_tree(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS category_tree (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_category_tree_descendant
+            ON category_tree (descendant_id, ancestor_id)
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_tree_insert AFTER INSERT ON categories BEGIN
+            INSERT INTO category_tree (ancestor_id, descendant_id, depth)
+            VALUES (new.id, new.id, 0);
+            INSERT INTO category_tree (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, new.id, depth + 1 FROM category_tree
+            WHERE descendant_id = new.parent_id;
+        END
+    ''')
+    # 禁止把分类移动到自己的子树下
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_tree_check_cycle BEFORE UPDATE OF parent_id ON categories
+        WHEN new.parent_id IS NOT NULL AND EXISTS (
+            SELECT 1 FROM category_tree WHERE ancestor_id = new.id AND descendant_id = new.parent_id
+        )
+        BEGIN
+            SELECT RAISE(ABORT, '不能将分类移动到其子分类下');
+        END
+    ''')
+    # 父分类变化时，整棵子树脱离旧祖先并挂到新祖先下
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_tree_move AFTER UPDATE OF parent_id ON categories
+        WHEN old.parent_id IS NOT new.parent_id
+        BEGIN
+            DELETE FROM category_tree
+            WHERE descendant_id IN (SELECT descendant_id FROM category_tree WHERE ancestor_id = new.id)
+              AND ancestor_id NOT IN (SELECT descendant_id FROM category_tree WHERE ancestor_id = new.id);
+            INSERT INTO category_tree (ancestor_id, descendant_id, depth)
+            SELECT supertree.ancestor_id, subtree.descendant_id, supertree.depth + subtree.depth + 1
+            FROM category_tree AS supertree, category_tree AS subtree
+            WHERE supertree.descendant_id = new.parent_id AND subtree.ancestor_id = new.id;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_tree_delete AFTER DELETE ON categories BEGIN
+            DELETE FROM category_tree WHERE descendant_id = old.id OR ancestor_id = old.id;
+        END
+    ''')
+    
+    # 根据已有分类生成层级关系
+    db.execute('''
+        INSERT OR IGNORE INTO category_tree (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM categories
+            UNION ALL
+            SELECT tree.ancestor_id, categories.id, tree.depth + 1
+            FROM tree JOIN categories ON categories.parent_id = tree.descendant_id
+            WHERE tree.depth < 64
+        )
+        SELECT ancestor_id, descendant_id, depth FROM tree
+    ''')
+
+# 创建书签全文搜索索引（FTS5外部内容表，由触发器保持同步）
+# 使用trigram分词器，支持中文等无空格文本的子串匹配
+def create_search_index(db):
+    db.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS bookmarks_fts USING fts5(
+            title, url, description,
+            content='bookmarks',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookmarks_fts_insert AFTER INSERT ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts (rowid, title, url, description)
+            VALUES (new.id, new.title, new.url, new.description);
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookmarks_fts_delete AFTER DELETE ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts (bookmarks_fts, rowid, title, url, description)
+            VALUES ('delete', old.id, old.title, old.url, old.description);
+        END
+    ''')
+    # 只在可搜索字段变化时更新索引，拖拽排序不会触发
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookmarks_fts_update AFTER UPDATE OF title, url, description ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts (bookmarks_fts, rowid, title, url, description)
+            VALUES ('delete', old.id, old.title, old.url, old.description);
+            INSERT INTO bookmarks_fts (rowid, title, url, description)
+            VALUES (new.id, new.title, new.url, new.description);
+        END
+    ''')
+    
+    # 为已有书签建立索引
+    db.execute("INSERT INTO bookmarks_fts (bookmarks_fts) VALUES ('rebuild')")
+
+# 热点查询索引：按分类取书签/计算最大位置、按父分类取子分类
+def create_bookmark_indexes(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookmarks_category_position ON bookmarks (category_id, position, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_categories_parent_position ON categories (parent_id, position)')
+
+# 把连续的整数位置改为稀疏排序键，保持原有顺序
+def spread_positions(db):
+    rebalance_positions(db, 'bookmarks', all_groups=True)
+    rebalance_positions(db, 'categories', all_groups=True)
+
+# 按URL查找书签，用于导入时去重
+def create_bookmark_url_index(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookmarks_url ON bookmarks (url)')
+
+# 数据版本号：书签或分类的任何增删改都会使其加一，用于生成ETag
+# 迁移中逐条 execute：executescript 会先提交当前事务，迁移就不再是原子的，写锁也会提前释放
+def create_data_version(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    db.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 1)')
+    for table in ('bookmarks', 'categories'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table}
+            BEGIN
+                UPDATE data_version SET version = version + 1 WHERE id = 1;
+            END
+            ''')
+
+# 变更日志：由触发器记录书签和分类的每次增删改，revision 单调递增且不会重复使用
+# change_log_state.horizon 是压缩时丢弃的删除记录中最大的 revision，早于它的客户端需要全量同步
+def create_change_log(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            revision INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            changed_at INTEGER NOT NULL
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_changes_entity ON changes (entity, entity_id, revision)')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS change_log_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            horizon INTEGER NOT NULL
+        )
+    ''')
+    db.execute('INSERT OR IGNORE INTO change_log_state (id, horizon) VALUES (1, 0)')
+    for table, entity in (('bookmarks', 'bookmark'), ('categories', 'category')):
+        for event, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old')):
+            db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_change AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO changes (entity, entity_id, action, changed_at)
+                VALUES ('{entity}', {row}.id, '{event.lower()}', CAST(strftime('%s', 'now') AS INTEGER));
+            END
+            ''')
+
+# URL规范化
+# 只在协议、主机大小写、www.、默认端口、末尾斜杠、跟踪参数、参数顺序或锚点上不同的网址得到相同的规范形式，
+# 例如 https://www.Example.com/a/?utm_source=x&b=2#top 和 http://example.com/a?b=2 都是 example.com/a?b=2。
+# 非 http(s) 的网址（javascript:、file: 等）只去掉首尾空白。
+TRACKING_PARAMETERS = frozenset({
+    'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', 'spm',
+})
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+# 协议、主机、路径、查询参数，锚点不参与匹配
+HTTP_URL_PATTERN = re.compile(r'(https?)://([^/?#]+)([^?#]*)(?:\?([^#]*))?', re.IGNORECASE)
+
+def is_tracking_parameter(parameter):
+    name = parameter.partition('=')[0].lower()
+    return name.startswith('utm_') or name in TRACKING_PARAMETERS
+
+def normalize_url(url):
+    url = url.strip()
+    match = HTTP_URL_PATTERN.match(url)
+    if match is None:
+        return url
+    scheme, host, path, query = match.groups()
+    
+    host = host.rpartition('@')[2].lower()
+    default_port = DEFAULT_PORTS[scheme.lower()]
+    if host.endswith(default_port):
+        host = host[:-len(default_port)]
+    host = host.rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    
+    canonical = host + path.rstrip('/')
+    if query:
+        parameters = sorted(p for p in query.split('&') if p and not is_tracking_parameter(p))
+        if parameters:
+            canonical += '?' + '&'.join(parameters)
+    return canonical
+
+# 规范化URL列，新建和修改书签时写入，查重只需一次索引查找。导入去重也改用此列，按原始URL的索引不再需要。
+# 回填期间临时去掉书签的更新触发器，回填不算作书签的变化
+def has_column(db, table, column):
+    return any(row['name'] == column for row in db.execute(f'PRAGMA table_info({table})'))
+
+def add_canonical_url(db):
+    # 整个步骤在迁移的事务中执行；列已经存在时（例如曾被中断的旧版本迁移留下）不再添加
+    if not has_column(db, 'bookmarks', 'canonical_url'):
+        db.execute('ALTER TABLE bookmarks ADD COLUMN canonical_url TEXT')
+    db.execute('DROP TRIGGER IF EXISTS bookmarks_update_version')
+    db.execute('DROP TRIGGER IF EXISTS bookmarks_update_change')
+    
+    last_id = 0
+    while True:
+        rows = db.execute(
+            'SELECT id, url FROM bookmarks WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, app.config['MAINTENANCE_BATCH_SIZE'])
+        ).fetchall()
+        if not rows:
+            break
+        db.executemany(
+            'UPDATE bookmarks SET canonical_url = ? WHERE id = ?',
+            [(normalize_url(row['url']), row['id']) for row in rows]
+        )
+        last_id = rows[-1]['id']
+    
+    create_data_version(db)
+    create_change_log(db)
+    db.execute('CREATE INDEX IF NOT EXISTS idx_bookmarks_canonical_url ON bookmarks (canonical_url)')
+    db.execute('DROP INDEX IF EXISTS idx_bookmarks_url')
+
+# 死链检查结果表，每个书签一行，由触发器随书签的新增、删除和网址修改维护。
+# 检查结果不写入 bookmarks 表，不会产生变更记录，也不会改变数据版本号。
+# status: pending（未检查）/ ok / broken（4xx）/ error（超时、连接失败、5xx等）/ skipped（非http链接）
+def create_link_checks(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS link_checks (
+            bookmark_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            http_status INTEGER,
+            final_url TEXT,
+            error TEXT,
+            failures INTEGER NOT NULL DEFAULT 0,
+            checked_at INTEGER,
+            next_check_at INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_link_checks_next_check ON link_checks (next_check_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_link_checks_status ON link_checks (status, bookmark_id)')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS link_checks_insert AFTER INSERT ON bookmarks BEGIN
+            INSERT OR IGNORE INTO link_checks (bookmark_id) VALUES (new.id);
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS link_checks_url_update AFTER UPDATE OF url ON bookmarks
+        WHEN old.url IS NOT new.url
+        BEGIN
+            UPDATE link_checks SET status = 'pending', http_status = NULL, final_url = NULL, error = NULL,
+                failures = 0, checked_at = NULL, next_check_at = 0
+            WHERE bookmark_id = new.id;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS link_checks_delete AFTER DELETE ON bookmarks BEGIN
+            DELETE FROM link_checks WHERE bookmark_id = old.id;
+        END
+    ''')
+    db.execute('INSERT OR IGNORE INTO link_checks (bookmark_id) SELECT id FROM bookmarks')
+
+# 网页信息表，每个书签一行，新增书签或修改网址后由触发器标记为待抓取（next_fetch_at = 0），抓取完成后置为 NULL。
+# 网站图标按主机保存在 site_icons 中，同一主机的书签共用一个图标。
+def create_page_metadata(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS page_metadata (
+            bookmark_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            title TEXT,
+            description TEXT,
+            error TEXT,
+            failures INTEGER NOT NULL DEFAULT 0,
+            fetched_at INTEGER,
+            next_fetch_at INTEGER DEFAULT 0
+        )
+    ''')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_page_metadata_next_fetch ON page_metadata (next_fetch_at)
+        WHERE next_fetch_at IS NOT NULL
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS site_icons (
+            host TEXT PRIMARY KEY,
+            icon_hash TEXT,
+            icon_url TEXT,
+            fetched_at INTEGER,
+            next_fetch_at INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_site_icons_next_fetch ON site_icons (next_fetch_at)')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS page_metadata_insert AFTER INSERT ON bookmarks BEGIN
+            INSERT OR IGNORE INTO page_metadata (bookmark_id) VALUES (new.id);
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS page_metadata_url_update AFTER UPDATE OF url ON bookmarks
+        WHEN old.url IS NOT new.url
+        BEGIN
+            UPDATE page_metadata SET status = 'pending', title = NULL, description = NULL, error = NULL,
+                failures = 0, fetched_at = NULL, next_fetch_at = 0
+            WHERE bookmark_id = new.id;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS page_metadata_delete AFTER DELETE ON bookmarks BEGIN
+            DELETE FROM page_metadata WHERE bookmark_id = old.id;
+        END
+    ''')
+    db.execute('INSERT OR IGNORE INTO page_metadata (bookmark_id) SELECT id FROM bookmarks')
+
+# 每个分类直接包含的书签数，由触发器随书签的增删和移动更新。
+# 分类树的计数只需汇总这张表（与分类数成正比），不必每次对全部书签分组计数
+def create_category_counts(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS category_counts (
+            category_id INTEGER PRIMARY KEY,
+            bookmark_count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_counts_insert AFTER INSERT ON bookmarks BEGIN
+            INSERT INTO category_counts (category_id, bookmark_count) VALUES (new.category_id, 1)
+            ON CONFLICT (category_id) DO UPDATE SET bookmark_count = bookmark_count + 1;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_counts_move AFTER UPDATE OF category_id ON bookmarks
+        WHEN old.category_id IS NOT new.category_id
+        BEGIN
+            UPDATE category_counts SET bookmark_count = bookmark_count - 1 WHERE category_id = old.category_id;
+            INSERT INTO category_counts (category_id, bookmark_count) VALUES (new.category_id, 1)
+            ON CONFLICT (category_id) DO UPDATE SET bookmark_count = bookmark_count + 1;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_counts_delete AFTER DELETE ON bookmarks BEGIN
+            UPDATE category_counts SET bookmark_count = bookmark_count - 1 WHERE category_id = old.category_id;
+        END
+    ''')
+    db.execute('''
+        INSERT OR REPLACE INTO category_counts (category_id, bookmark_count)
+        SELECT category_id, COUNT(*) FROM bookmarks GROUP BY category_id
+    ''')
+
+BOOKMARKS_MIGRATIONS = [
+    create_category_tree,
+    create_search_index,
+    create_bookmark_indexes,
+    spread_positions,
+    create_bookmark_url_index,
+    create_data_version,
+    create_change_log,
+    add_canonical_url,
+    create_link_checks,
+    create_page_metadata,
+    create_category_counts,
+]
+
+# 认证数据库迁移
+# 热点查询索引：按IP统计登录失败次数、检查黑名单
+def create_auth_indexes(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_login_attempts_ip_timestamp ON login_attempts (ip_address, timestamp)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_ip_blacklist_ip_expiration ON ip_blacklist (ip_address, expiration)')
+
+# 登录限流状态表，每个IP一行；已有的有效黑名单记录迁移为限流状态
+def create_login_throttle(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS login_throttle (
+            ip_address TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            strikes INTEGER NOT NULL,
+            window_start REAL NOT NULL,
+            next_allowed_at REAL NOT NULL,
+            blocked_until REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    now = time.time()
+    db.execute('''
+        INSERT OR IGNORE INTO login_throttle
+            (ip_address, tokens, updated_at, strikes, window_start, next_allowed_at, blocked_until)
+        SELECT ip_address, ?, ?, 0, ?, 0, MAX(expiration)
+        FROM ip_blacklist WHERE expiration > ? GROUP BY ip_address
+    ''', (app.config['MAX_LOGIN_ATTEMPTS'], now, now, now))
+
+# 登录记录汇总表和维护任务执行记录表
+def create_auth_maintenance(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS login_attempt_rollups (
+            ip_address TEXT NOT NULL,
+            window_start INTEGER NOT NULL,
+            failures INTEGER NOT NULL,
+            successes INTEGER NOT NULL,
+            PRIMARY KEY (ip_address, window_start)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_login_attempt_rollups_window ON login_attempt_rollups (window_start)')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            task TEXT PRIMARY KEY,
+            last_run REAL NOT NULL
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_ip_blacklist_expiration ON ip_blacklist (expiration)')
+
+# 记录每个用户的数据库文件名，之后不再按用户ID推算。升级前的用户按原来的规则填写：
+# 第一个用户为空（使用 DATABASE），其他用户为 <用户ID>.sqlite
+def add_user_database_files(db):
+    db.execute('ALTER TABLE users ADD COLUMN db_file TEXT')
+    db.execute("UPDATE users SET db_file = id || '.sqlite' WHERE id != 1")
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_db_file ON users (db_file)')
+
+AUTH_MIGRATIONS = [
+    create_auth_indexes,
+    create_login_throttle,
+    create_auth_maintenance,
+    add_user_database_files,
+]
 
-# 初始化应用时自动创建数据库表
-# Flask 2.0+ 不再支持 before_first_request
-with app.app_context():
-    init_db()
+# 演练迁移时用于对比查询计划的热点查询
+BOOKMARKS_HOT_QUERIES = {
+    'bookmarks_by_category': 'SELECT * FROM bookmarks WHERE category_id = 1 ORDER BY position',
+    'bookmarks_page': (
+        'SELECT * FROM bookmarks WHERE (category_id, position, id) > (1, 1, 1) '
+        'ORDER BY category_id, position, id LIMIT 100'
+    ),
+    'bookmarks_max_position': 'SELECT MAX(position) FROM bookmarks WHERE category_id = 1',
+    'bookmarks_subtree': (
+        'SELECT bookmarks.* FROM bookmarks '
+        'JOIN category_tree ON category_tree.descendant_id = bookmarks.category_id '
+        'WHERE category_tree.ancestor_id = 1 ORDER BY bookmarks.category_id, bookmarks.position'
+    ),
+    'categories_by_parent': 'SELECT id FROM categories WHERE parent_id = 1 ORDER BY position',
+    'bookmarks_by_canonical_url': (
+        "SELECT canonical_url FROM bookmarks WHERE canonical_url IN (SELECT value FROM json_each('[]'))"
+    ),
+    'link_checks_due': 'SELECT bookmark_id FROM link_checks WHERE next_check_at <= 0 ORDER BY next_check_at LIMIT 200',
+    'page_metadata_due': 'SELECT bookmark_id FROM page_metadata WHERE next_fetch_at <= 0 ORDER BY next_fetch_at LIMIT 100',
+    'bookmark_duplicate_groups': (
+        "SELECT canonical_url, COUNT(*) FROM bookmarks WHERE canonical_url > '' "
+        'GROUP BY canonical_url HAVING COUNT(*) > 1 ORDER BY canonical_url LIMIT 100'
+    ),
+}
+
+AUTH_HOT_QUERIES = {
+    'login_attempts_by_ip': (
+        "SELECT COUNT(*) FROM login_attempts WHERE ip_address = '127.0.0.1' "
+        'AND timestamp > 0 AND successful = 0'
+    ),
+    'ip_blacklist_by_ip': (
+        "SELECT COUNT(*) FROM ip_blacklist WHERE ip_address = '127.0.0.1' AND expiration > 0"
+    ),
+    'login_throttle_by_ip': "SELECT * FROM login_throttle WHERE ip_address = '127.0.0.1'",
+}
+
+@app.cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help='只输出待执行的迁移和查询计划对比，不修改数据库')
+def migrate_command(dry_run):
+    """升级认证数据库和所有用户的书签数据库的结构"""
+    databases = [('auth.sqlite', app.app_context, get_auth_db, init_auth_db, AUTH_MIGRATIONS, AUTH_HOT_QUERIES)]
+    try:
+        users = [(user_id, user_database_file(user_id)) for user_id in all_user_ids()]
+    except sqlite3.OperationalError:
+        # 认证数据库尚未初始化
+        users = []
+    for user_id, db_file in users:
+        databases.append((
+            user_database_name(db_file), partial(use_user_db, user_id),
+            get_db, init_bookmarks_db, BOOKMARKS_MIGRATIONS, BOOKMARKS_HOT_QUERIES
+        ))
+    
+    if not dry_run:
+        for name, context, get_connection, init_schema, _, _ in databases:
+            with context():
+                db = get_connection()
+                init_schema(db)
+                version = db.execute('PRAGMA user_version').fetchone()[0]
+            click.echo(f'{name}: 当前版本 {version}')
+        return
+    
+    for name, context, get_connection, _, migrations, hot_queries in databases:
+        try:
+            with context():
+                report = dry_run_migrations(get_connection(), migrations, hot_queries)
+        except sqlite3.OperationalError as e:
+            # 数据库尚未初始化时无法演练
+            click.echo(f'{name}: 无法演练迁移: {e}')
+            continue
+        click.echo(f"{name}: 当前版本 {report['current_version']}，目标版本 {report['target_version']}")
+        for migration_name in report['pending']:
+            click.echo(f'  待执行: {migration_name}')
+        for plan in report['plans']:
+            click.echo(f"  {plan['query']}")
+            click.echo(f"    迁移前: {plan['before']}")
+            click.echo(f"    迁移后: {plan['after']}")
+
+# 在线备份：用SQLite的备份接口逐个复制认证数据库和每个用户的书签数据库，备份期间可以正常读写。
+# 备份目录的结构与实例目录相同，恢复时停止服务，把文件复制回实例目录即可。
+def backup_database(conn, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    destination = sqlite3.connect(target)
+    try:
+        conn.backup(destination)
+    finally:
+        destination.close()
+
+@app.cli.command('backup')
+@click.option('--output', type=click.Path(file_okay=False), help='备份目录，默认为实例目录下的 backups/<时间>')
+@click.option('--user', 'username', help='只备份指定用户的书签数据库')
+def backup_command(output, username):
+    """备份认证数据库和每个用户的书签数据库"""
+    output = output or os.path.join(app.instance_path, 'backups', time.strftime('%Y%m%d-%H%M%S'))
+    if os.path.isdir(output) and os.listdir(output):
+        raise click.UsageError(f'{output} 不是空目录')
+    
+    databases = []
+    if username is None:
+        databases.append(('auth.sqlite', app.app_context, get_auth_db))
+    for user_id, _ in resolve_users(username):
+        databases.append((user_database_name(user_database_file(user_id)), partial(use_user_db, user_id), get_db))
+    
+    for name, context, get_connection in databases:
+        target = os.path.join(output, name)
+        start = time.time()
+        with context():
+            backup_database(get_connection(), target)
+        click.echo(f'{name}: {os.path.getsize(target)} 字节，用时 {time.time() - start:.2f} 秒')
+    click.echo(f'已备份到 {output}')
 
 # 登录需求装饰器
 def login_required(f):
@@ -125,106 +1457,544 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# 检查是否存在管理员账户
-def has_admin():
-    db = get_auth_db()
+# 条件请求
+# ETag 由数据版本号、当前用户的数据库文件和请求的路径、参数生成；客户端带 If-None-Match 且数据未变化时，
+# 只读取版本号一行就返回304，不查询也不序列化书签和分类。
+def get_data_version(db):
+    return db.execute('SELECT version FROM data_version WHERE id = 1').fetchone()[0]
+
+# 同一浏览器先后登录的两个用户的数据版本号可能相同，ETag 中加入数据库文件，不会把一个用户的缓存当作另一个用户的
+def etag_variant(*parts):
+    get_db()
+    return hashlib.sha1('\0'.join((g.db_pool.path,) + parts).encode()).hexdigest()[:16]
+
+def conditional_get(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        version = get_data_version(get_db())
+        etag = f'{version}-{etag_variant(request.full_path)}'
+        
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        # 压缩和未压缩的响应共用同一个版本号，因此使用弱ETag
+        response.set_etag(etag, weak=True)
+        # 数据属于已登录用户，只允许浏览器缓存，且每次使用前都要重新验证
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
+    return decorated_function
+
+# 响应压缩：客户端声明支持gzip时压缩较大的文本响应。
+# 流式响应的大小未知，总是边生成边压缩；导入进度等需要实时送达的 NDJSON 流不压缩。
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/csv')
+
+def gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
     try:
-        user_count = db.execute('SELECT COUNT(id) FROM users').fetchone()[0]
-        return user_count > 0
-    except sqlite3.OperationalError:
-        # 如果表不存在，自动初始化数据库
-        init_db()
-        return False
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # 提前断开时也要关闭原来的生成器，释放其中的数据库事务和请求上下文
+        if hasattr(chunks, 'close'):
+            chunks.close()
 
-# 检查IP是否在黑名单中
-def is_ip_blacklisted(ip_address):
-    db = get_auth_db()
-    current_time = int(time.time())
+@app.after_request
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers or not request.accept_encodings['gzip']:
+        return response
     
-    try:
-        blacklisted = db.execute(
-            'SELECT COUNT(*) FROM ip_blacklist WHERE ip_address = ? AND expiration > ?',
-            (ip_address, current_time)
-        ).fetchone()[0]
-        return blacklisted > 0
-    except sqlite3.OperationalError:
-        # 如果表不存在，初始化数据库
-        init_db()
-        return False
+    level = app.config['COMPRESS_LEVEL']
+    if response.is_streamed:
+        response.response = gzip_stream(response.response, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(gzip.compress(data, level, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
 
-# 将IP添加到黑名单
-def blacklist_ip(ip_address):
+# 检查是否存在管理员账户
+def has_admin():
     db = get_auth_db()
-    current_time = int(time.time())
-    expiration = current_time + app.config['BLACKLIST_DURATION']
-    
+    user_count = db.execute('SELECT COUNT(id) FROM users').fetchone()[0]
+    return user_count > 0
+
+# 创建账户，成功时返回 None，否则返回错误信息。新用户的书签数据库文件在这里分配，第一次访问时建表
+def create_user(db, username, password):
+    if not username:
+        return '需要用户名'
+    if not password:
+        return '需要密码'
+    # 验证密码强度
+    is_valid, password_error = validate_password(password)
+    if not is_valid:
+        return password_error
+    db_file = reserve_user_database_file()
     try:
         db.execute(
-            'INSERT INTO ip_blacklist (ip_address, timestamp, expiration) VALUES (?, ?, ?)',
-            (ip_address, current_time, expiration)
-        )
-        db.commit()
-    except sqlite3.OperationalError:
-        # 如果表不存在，初始化数据库
-        init_db()
-        db.execute(
-            'INSERT INTO ip_blacklist (ip_address, timestamp, expiration) VALUES (?, ?, ?)',
-            (ip_address, current_time, expiration)
+            'INSERT INTO users (username, password, db_file) VALUES (?, ?, ?)',
+            (username, generate_password_hash(password), db_file)
         )
         db.commit()
+    except db.IntegrityError:
+        os.remove(user_database_path(db_file))
+        return f"用户 {username} 已经注册"
+    return None
 
-# 防止暴力破解
-def check_login_attempts(ip_address):
-    if is_ip_blacklisted(ip_address):
-        return False
-        
+# 命令行的 --user 选项：返回 [(用户ID, 用户名)]，不指定时返回所有用户
+def resolve_users(username=None):
     db = get_auth_db()
-    current_time = int(time.time())
-    timeout = current_time - app.config['LOGIN_TIMEOUT']
+    if username is None:
+        return [(row['id'], row['username']) for row in db.execute('SELECT id, username FROM users ORDER BY id')]
+    row = db.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+    if row is None:
+        raise click.UsageError(f'用户 {username} 不存在')
+    return [(row['id'], username)]
+
+# 登录限流
+# 每个IP一个令牌桶：容量为 MAX_LOGIN_ATTEMPTS，在 LOGIN_TIMEOUT 内匀速回满，每次登录失败消耗一个令牌。
+# 失败后按 2^(n-1) 秒（最多10秒）的间隔退避；LOGIN_TIMEOUT 内登录失败（密码错误）的次数达到 BLACKLIST_THRESHOLD 时，
+# 该IP被拉黑 BLACKLIST_DURATION 秒。被限流的请求立即返回429和Retry-After，而不是在请求内等待。
+# 状态保存在进程内存中，每次只按IP查一次；变化定期批量写入 auth.sqlite，其他工作进程在缓存过期后重新读取。
+LOGIN_THROTTLE_FIELDS = ('tokens', 'updated_at', 'strikes', 'window_start', 'next_allowed_at', 'blocked_until')
+
+class LoginLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = set()
+        self._attempts = []
+        self._blacklist = []
+        self._flusher_pid = None
     
-    # 获取指定时间内的登录尝试次数
-    try:
-        attempts = db.execute(
-            'SELECT COUNT(*) FROM login_attempts WHERE ip_address = ? AND timestamp > ? AND successful = 0',
-            (ip_address, timeout)
-        ).fetchone()[0]
-        
-        # 如果失败次数达到阈值，加入黑名单
-        if attempts >= app.config['BLACKLIST_THRESHOLD']:
-            blacklist_ip(ip_address)
-            return False
+    def _capacity(self):
+        return app.config['MAX_LOGIN_ATTEMPTS']
+    
+    def _refill_rate(self):
+        return app.config['MAX_LOGIN_ATTEMPTS'] / app.config['LOGIN_TIMEOUT']
+    
+    # 在 with 块内持有锁并得到该IP的状态。内存中没有或已过期时先在锁外读取数据库，
+    # 慢查询（例如正在做WAL检查点）只影响这一次登录，不会阻塞其他请求；读取期间其他线程已加载的状态优先
+    @contextmanager
+    def _locked_entry(self, ip_address, now):
+        fetched = False
+        row = None
+        while True:
+            with self._lock:
+                entry = self._entries.get(ip_address)
+                if entry is None or (
+                    ip_address not in self._dirty
+                    and now - entry['loaded_at'] >= app.config['LOGIN_THROTTLE_FLUSH_INTERVAL']
+                ):
+                    entry = None
+                    if fetched:
+                        entry = dict(row) if row is not None else {
+                            'tokens': self._capacity(),
+                            'updated_at': now,
+                            'strikes': 0,
+                            'window_start': now,
+                            'next_allowed_at': 0,
+                            'blocked_until': 0
+                        }
+                        entry['loaded_at'] = now
+                        self._entries[ip_address] = entry
+                if entry is not None:
+                    yield entry
+                    return
             
-        return attempts < app.config['MAX_LOGIN_ATTEMPTS']
-    except sqlite3.OperationalError:
-        # 如果表不存在，自动初始化数据库
-        init_db()
-        return True
-
-# 增加指数级延迟
-def get_login_delay(ip_address):
-    db = get_auth_db()
-    current_time = int(time.time())
-    timeout = current_time - app.config['LOGIN_TIMEOUT']
+            row = get_auth_db().execute(
+                'SELECT tokens, updated_at, strikes, window_start, next_allowed_at, blocked_until '
+                'FROM login_throttle WHERE ip_address = ?',
+                (ip_address,)
+            ).fetchone()
+            fetched = True
     
-    try:
-        attempts = db.execute(
-            'SELECT COUNT(*) FROM login_attempts WHERE ip_address = ? AND timestamp > ? AND successful = 0',
-            (ip_address, timeout)
-        ).fetchone()[0]
+    # 令牌回填，失败计数窗口过期后重新计数
+    def _refill(self, entry, now):
+        entry['tokens'] = min(
+            self._capacity(),
+            entry['tokens'] + max(now - entry['updated_at'], 0) * self._refill_rate()
+        )
+        entry['updated_at'] = now
+        if now - entry['window_start'] >= app.config['LOGIN_TIMEOUT']:
+            entry['strikes'] = 0
+            entry['window_start'] = now
+    
+    def _strike(self, ip_address, entry, now):
+        entry['strikes'] += 1
+        if entry['strikes'] >= app.config['BLACKLIST_THRESHOLD']:
+            entry['blocked_until'] = now + app.config['BLACKLIST_DURATION']
+            entry['strikes'] = 0
+            entry['window_start'] = now
+            self._blacklist.append((ip_address, int(now), int(entry['blocked_until'])))
+        self._dirty.add(ip_address)
+    
+    # 返回需要等待的秒数，0表示允许本次登录尝试
+    def check(self, ip_address):
+        now = time.time()
+        with self._locked_entry(ip_address, now) as entry:
+            self._refill(entry, now)
+            
+            if entry['blocked_until'] > now:
+                return entry['blocked_until'] - now
+            
+            wait = entry['next_allowed_at'] - now
+            if entry['tokens'] < 1:
+                wait = max(wait, (1 - entry['tokens']) / self._refill_rate())
+            # 被限流的尝试不校验密码，也不计入拉黑阈值，只有密码错误才计入
+            return max(wait, 0)
+    
+    def record(self, ip_address, successful):
+        now = time.time()
+        with self._locked_entry(ip_address, now) as entry:
+            self._refill(entry, now)
+            
+            if not successful:
+                entry['tokens'] = max(entry['tokens'] - 1, 0)
+                self._strike(ip_address, entry, now)
+                # 指数级退避: 2^(n-1) 秒，最多10秒
+                entry['next_allowed_at'] = now + min(math.pow(2, entry['strikes'] - 1), 10)
+            
+            self._attempts.append((ip_address, int(now), successful))
         
-        if attempts > 0:
-            # 指数级增长延迟: 2^(attempts-1) 秒，最多10秒
-            return min(math.pow(2, attempts-1), 10)
-        return 0
-    except sqlite3.OperationalError:
-        return 0
+        self._start_flusher()
+    
+    # 后台线程定期批量写入，每个进程启动一个
+    def _start_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='login-limiter-flush', daemon=True).start()
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(app.config['LOGIN_THROTTLE_FLUSH_INTERVAL'])
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                log_event(logging.ERROR, 'login_throttle_flush_failed', error=str(e))
+    
+    def flush(self):
+        now = time.time()
+        with self._lock:
+            rows = []
+            for ip_address in self._dirty:
+                entry = self._entries[ip_address]
+                row = {field: entry[field] for field in LOGIN_THROTTLE_FIELDS}
+                row['ip_address'] = ip_address
+                rows.append(row)
+            attempts, blacklist = self._attempts, self._blacklist
+            self._dirty, self._attempts, self._blacklist = set(), [], []
+        
+        if rows or attempts or blacklist:
+            self._write(rows, attempts, blacklist)
+        
+        # 清理已落盘且过期的缓存，需要时会重新从数据库读取
+        with self._lock:
+            stale = [
+                ip_address for ip_address, entry in self._entries.items()
+                if ip_address not in self._dirty
+                and now - entry['loaded_at'] >= app.config['LOGIN_THROTTLE_FLUSH_INTERVAL']
+            ]
+            for ip_address in stale:
+                del self._entries[ip_address]
+    
+    def _write(self, rows, attempts, blacklist):        
+        for row in rows:
+            row['capacity'] = self._capacity()
+            row['rate'] = self._refill_rate()
+        
+        db = get_auth_db()
+        try:
+            # 与其他工作进程写入的状态合并，取更严格的一方
+            db.executemany('''
+                INSERT INTO login_throttle (ip_address, tokens, updated_at, strikes, window_start, next_allowed_at, blocked_until)
+                VALUES (:ip_address, :tokens, :updated_at, :strikes, :window_start, :next_allowed_at, :blocked_until)
+                ON CONFLICT (ip_address) DO UPDATE SET
+                    tokens = MIN(
+                        :capacity,
+                        login_throttle.tokens + MAX(excluded.updated_at - login_throttle.updated_at, 0) * :rate,
+                        excluded.tokens
+                    ),
+                    updated_at = MAX(login_throttle.updated_at, excluded.updated_at),
+                    strikes = CASE
+                        WHEN excluded.window_start > login_throttle.window_start THEN excluded.strikes
+                        ELSE MAX(login_throttle.strikes, excluded.strikes)
+                    END,
+                    window_start = MAX(login_throttle.window_start, excluded.window_start),
+                    next_allowed_at = MAX(login_throttle.next_allowed_at, excluded.next_allowed_at),
+                    blocked_until = MAX(login_throttle.blocked_until, excluded.blocked_until)
+            ''', rows)
+            db.executemany(
+                'INSERT INTO login_attempts (ip_address, timestamp, successful) VALUES (?, ?, ?)',
+                attempts
+            )
+            db.executemany(
+                'INSERT INTO ip_blacklist (ip_address, timestamp, expiration) VALUES (?, ?, ?)',
+                blacklist
+            )
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            # 写入失败时保留数据，下次重试
+            with self._lock:
+                self._dirty.update(row['ip_address'] for row in rows)
+                self._attempts = attempts + self._attempts
+                self._blacklist = blacklist + self._blacklist
+            raise
+
+login_limiter = LoginLimiter()
+
+# 进程退出前写入尚未落盘的登录限流状态（在关闭连接池之前执行）
+@atexit.register
+def flush_login_limiter():
+    if login_limiter._flusher_pid != os.getpid():
+        return
+    try:
+        with app.app_context():
+            login_limiter.flush()
+    except Exception as e:
+        log_event(logging.ERROR, 'login_throttle_flush_failed', error=str(e))
+
+# 认证数据库维护
+# 定期分批删除过期的登录记录和黑名单，把较早的登录记录汇总为按IP、按时间窗口的计数，
+# 并执行增量清理，使 auth.sqlite 的大小不随运行时间增长。多个工作进程中同一时间只有一个会执行。
+def claim_maintenance_run(db, task, interval):
+    now = time.time()
+    db.execute('INSERT OR IGNORE INTO maintenance_runs (task, last_run) VALUES (?, 0)', (task,))
+    claimed = db.execute(
+        'UPDATE maintenance_runs SET last_run = ? WHERE task = ? AND last_run <= ?',
+        (now, task, now - interval)
+    ).rowcount == 1
+    db.commit()
+    return claimed
+
+def compact_login_attempts(db, cutoff):
+    window = app.config['LOGIN_ROLLUP_WINDOW']
+    batch_size = app.config['MAINTENANCE_BATCH_SIZE']
+    compacted = 0
+    
+    while True:
+        # 按主键顺序取一批过期记录，每批单独提交，避免长时间占用写锁
+        max_id = db.execute(
+            'SELECT MAX(id) FROM (SELECT id FROM login_attempts WHERE timestamp < ? ORDER BY id LIMIT ?)',
+            (cutoff, batch_size)
+        ).fetchone()[0]
+        if max_id is None:
+            break
+        
+        db.execute('''
+            INSERT INTO login_attempt_rollups (ip_address, window_start, failures, successes)
+            SELECT ip_address, timestamp - timestamp % ?, SUM(successful = 0), SUM(successful != 0)
+            FROM login_attempts WHERE id <= ? AND timestamp < ?
+            GROUP BY ip_address, timestamp - timestamp % ?
+            ON CONFLICT (ip_address, window_start) DO UPDATE SET
+                failures = failures + excluded.failures,
+                successes = successes + excluded.successes
+        ''', (window, max_id, cutoff, window))
+        compacted += db.execute(
+            'DELETE FROM login_attempts WHERE id <= ? AND timestamp < ?',
+            (max_id, cutoff)
+        ).rowcount
+        db.commit()
+    
+    return compacted
+
+def delete_in_batches(db, table, key, condition, params):
+    batch_size = app.config['MAINTENANCE_BATCH_SIZE']
+    deleted = 0
+    while True:
+        count = db.execute(
+            f'DELETE FROM {table} WHERE ({key}) IN (SELECT {key} FROM {table} WHERE {condition} LIMIT ?)',
+            params + (batch_size,)
+        ).rowcount
+        db.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+def maintain_auth_db(db):
+    now = int(time.time())
+    result = {}
+    
+    result['login_attempts_compacted'] = compact_login_attempts(
+        db, now - app.config['LOGIN_ATTEMPTS_RETENTION']
+    )
+    result['login_rollups_deleted'] = delete_in_batches(
+        db, 'login_attempt_rollups', 'ip_address, window_start', 'window_start < ?', (now - app.config['LOGIN_ROLLUP_RETENTION'],)
+    )
+    result['ip_blacklist_deleted'] = delete_in_batches(
+        db, 'ip_blacklist', 'id', 'expiration <= ?', (now,)
+    )
+    # 令牌已回满、退避和拉黑都已结束的限流状态与默认状态相同，可以删除
+    result['login_throttle_deleted'] = delete_in_batches(
+        db, 'login_throttle', 'ip_address', 'updated_at < ? AND blocked_until <= ? AND next_allowed_at <= ?',
+        (now - app.config['LOGIN_TIMEOUT'], now, now)
+    )
+    
+    # 开启增量清理需要执行一次完整的VACUUM，之后每次只归还空闲页
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.execute('VACUUM')
+    result['pages_freed'] = db.execute('PRAGMA freelist_count').fetchone()[0]
+    db.execute('PRAGMA incremental_vacuum')
+    
+    return result
+
+maintenance_pid = None
+maintenance_lock = threading.Lock()
+
+def auth_maintenance_loop():
+    while True:
+        try:
+            with app.app_context():
+                db = get_auth_db()
+                if claim_maintenance_run(db, 'auth', app.config['AUTH_MAINTENANCE_INTERVAL']):
+                    log_event(logging.INFO, 'auth_maintenance', **maintain_auth_db(db))
+                if claim_maintenance_run(db, 'change_log', app.config['AUTH_MAINTENANCE_INTERVAL']):
+                    for user_id in all_user_ids():
+                        with use_user_db(user_id) as user_db:
+                            log_event(logging.INFO, 'change_log_compaction', user_id=user_id, **compact_change_log(user_db))
+        except Exception as e:
+            log_event(logging.ERROR, 'maintenance_failed', error=str(e))
+        time.sleep(app.config['AUTH_MAINTENANCE_INTERVAL'])
+
+# 死链检查、网页信息抓取等定期任务：每个间隔只有一个工作进程领到任务，一轮最多持续一个间隔。
+# 依次处理每个用户的数据库，剩余时间在还没处理的用户之间平分，前面的用户用不完的时间留给后面的用户。
+def periodic_task_loop(task, interval, run):
+    while True:
+        try:
+            with app.app_context():
+                if claim_maintenance_run(get_auth_db(), task, interval):
+                    deadline = time.monotonic() + interval
+                    user_ids = all_user_ids()
+                    for index, user_id in enumerate(user_ids):
+                        share = (deadline - time.monotonic()) / (len(user_ids) - index)
+                        try:
+                            with use_user_db(user_id) as db:
+                                stats = run(db, deadline=time.monotonic() + share)
+                        except Exception as e:
+                            log_event(logging.ERROR, f'{task}_failed', user_id=user_id, error=str(e))
+                            continue
+                        if any(stats.values()):
+                            log_event(logging.INFO, task, user_id=user_id, **stats)
+        except Exception as e:
+            log_event(logging.ERROR, f'{task}_failed', error=str(e))
+        time.sleep(interval)
+
+# 每个工作进程在处理第一个请求时启动后台维护线程
+@app.before_request
+def start_background_tasks():
+    global maintenance_pid
+    if maintenance_pid == os.getpid():
+        return
+    with maintenance_lock:
+        if maintenance_pid == os.getpid():
+            return
+        maintenance_pid = os.getpid()
+    if app.config['AUTH_MAINTENANCE_INTERVAL']:
+        threading.Thread(target=auth_maintenance_loop, name='auth-maintenance', daemon=True).start()
+    if app.config['LINK_CHECK_INTERVAL']:
+        threading.Thread(
+            target=periodic_task_loop, args=('link_check', app.config['LINK_CHECK_INTERVAL'], check_due_links),
+            name='link-checker', daemon=True
+        ).start()
+    if app.config['METADATA_FETCH_INTERVAL']:
+        threading.Thread(
+            target=periodic_task_loop, args=('metadata_fetch', app.config['METADATA_FETCH_INTERVAL'], fetch_due_metadata),
+            name='metadata-fetcher', daemon=True
+        ).start()
+
+@app.cli.command('maintain-auth')
+def maintain_auth_command():
+    """立即清理和压缩认证数据库"""
+    result = maintain_auth_db(get_auth_db())
+    for key, value in result.items():
+        click.echo(f'{key}: {value}')
+
+# 已验证用户缓存
+# 记录最近验证过仍然存在的用户ID，在 SESSION_CACHE_TTL 内不再查询数据库。
+# 认证数据库文件（或其WAL日志）被删除、替换或写入后整个缓存失效，删除 auth.sqlite 重置账户后会立即生效。
+# 用户ID到数据库文件名的对应关系也缓存在这里，随认证数据库的变化一起失效。
+validated_users = {}
+user_database_files = {}
+auth_caches_stamp = None
+
+def auth_db_stamp():
+    db_path = app.config['AUTH_DATABASE']
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    try:
+        wal_stat = os.stat(db_path + '-wal')
+        wal_stamp = (wal_stat.st_mtime_ns, wal_stat.st_size)
+    except OSError:
+        wal_stamp = None
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns, wal_stamp
+
+def refresh_auth_caches():
+    global auth_caches_stamp
+    stamp = auth_db_stamp()
+    if stamp != auth_caches_stamp:
+        validated_users.clear()
+        user_database_files.clear()
+        auth_caches_stamp = stamp
+
+def is_user_validated(user_id):
+    refresh_auth_caches()
+    expires_at = validated_users.get(user_id)
+    return expires_at is not None and expires_at > time.monotonic()
+
+def remember_validated_user(user_id):
+    validated_users[user_id] = time.monotonic() + app.config['SESSION_CACHE_TTL']
+
+# 用户的数据库文件名，未指定用户时为 None（使用 DATABASE）
+def user_database_file(user_id):
+    if user_id is None:
+        return None
+    refresh_auth_caches()
+    if user_id not in user_database_files:
+        auth_db = get_auth_db()
+        if has_column(auth_db, 'users', 'db_file'):
+            row = auth_db.execute('SELECT db_file FROM users WHERE id = ?', (user_id,)).fetchone()
+        else:
+            # 认证数据库尚未升级（FLASK_AUTO_MIGRATE=false 时演练迁移），按升级前的规则对应，与 add_user_database_files 的回填相同
+            row = auth_db.execute(
+                "SELECT CASE WHEN id = 1 THEN NULL ELSE id || '.sqlite' END AS db_file FROM users WHERE id = ?",
+                (user_id,)
+            ).fetchone()
+        if row is None:
+            raise RuntimeError(f'用户 {user_id} 不存在')
+        user_database_files[user_id] = row['db_file']
+    return user_database_files[user_id]
 
 # 会话验证中间件
 @app.before_request
 def validate_session():
     if 'user_id' in session:
         # 排除不需要验证的路由
-        if request.endpoint in ['login', 'register', 'logout', 'static']:
+        if request.endpoint in ['login', 'register', 'logout', 'static', 'static_asset']:
+            return
+        
+        if is_user_validated(session['user_id']):
             return
             
         try:
@@ -236,28 +2006,55 @@ def validate_session():
                 # 用户不存在，清除会话
                 session.clear()
                 return redirect(url_for('login'))
+            
+            remember_validated_user(session['user_id'])
         except sqlite3.OperationalError:
             # 数据库文件可能已被删除
             session.clear()
             return redirect(url_for('login'))
 
-def record_login_attempt(ip_address, successful):
-    db = get_auth_db()
-    current_time = int(time.time())
-    try:
-        db.execute(
-            'INSERT INTO login_attempts (ip_address, timestamp, successful) VALUES (?, ?, ?)',
-            (ip_address, current_time, successful)
-        )
-        db.commit()
-    except sqlite3.OperationalError:
-        # 如果表不存在，自动初始化数据库
-        init_db()
-        db.execute(
-            'INSERT INTO login_attempts (ip_address, timestamp, successful) VALUES (?, ?, ?)',
-            (ip_address, current_time, successful)
+# 静态资源
+# flask build-assets 把 static 下的CSS、JS和字体压缩后写入 static/dist，文件名带内容哈希，
+# 并预先生成gzip副本和清单 manifest.json（原文件名 -> 构建后的文件名）。
+# 模板通过 asset_url() 引用资源：有清单时指向构建后的文件，内容不变时URL也不变，可以永久缓存；
+# 没有构建时直接使用原文件，便于开发。
+ASSET_DIST_DIR = 'dist'
+ASSET_EXTENSIONS = ('.css', '.js', '.woff2')
+asset_manifest = None
+
+def load_asset_manifest():
+    global asset_manifest
+    # 调试模式下每次重新读取，重新构建后无需重启
+    if asset_manifest is None or app.debug:
+        try:
+            with open(os.path.join(app.static_folder, ASSET_DIST_DIR, 'manifest.json'), encoding='utf-8') as f:
+                asset_manifest = json.load(f)
+        except FileNotFoundError:
+            asset_manifest = {}
+    return asset_manifest
+
+@app.template_global()
+def asset_url(filename):
+    built = load_asset_manifest().get(filename)
+    if built is None:
+        return url_for('static', filename=filename)
+    return url_for('static_asset', filename=built)
+
+@app.route('/static/dist/<path:filename>')
+def static_asset(filename):
+    directory = os.path.join(app.static_folder, ASSET_DIST_DIR)
+    max_age = app.config['STATIC_ASSET_MAX_AGE']
+    compressed = filename + '.gz'
+    if request.accept_encodings['gzip'] and os.path.isfile(os.path.join(directory, compressed)):
+        response = send_from_directory(
+            directory, compressed, mimetype=mimetypes.guess_type(filename)[0], max_age=max_age
         )
-        db.commit()
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(directory, filename, max_age=max_age)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/')
 @login_required
@@ -275,20 +2072,13 @@ def login():
         password = request.form['password']
         ip_address = request.remote_addr
         
-        # 检查IP是否在黑名单中
-        if is_ip_blacklisted(ip_address):
-            flash('登录失败，请稍后再试')
-            return render_template('login.html')
-        
-        # 检查登录尝试次数
-        if not check_login_attempts(ip_address):
+        # 检查限流和黑名单，超限时立即返回429而不是等待
+        retry_after = login_limiter.check(ip_address)
+        if retry_after > 0:
             flash('登录失败，请稍后再试')
-            return render_template('login.html')
-        
-        # 应用延迟以减缓暴力破解
-        delay = get_login_delay(ip_address)
-        if delay > 0:
-            time.sleep(delay)
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(math.ceil(retry_after))
+            return response
         
         db = get_auth_db()
         user = db.execute(
@@ -299,12 +2089,12 @@ def login():
             session.clear()
             session['user_id'] = user['id']
             session['login_time'] = int(time.time())
-            record_login_attempt(ip_address, True)
+            login_limiter.record(ip_address, True)
             return redirect(url_for('index'))
         
         # 登录失败，不显示具体错误原因
         flash('登录失败，请检查您的用户名和密码')
-        record_login_attempt(ip_address, False)
+        login_limiter.record(ip_address, False)
     
     return render_template('login.html')
 
@@ -334,44 +2124,52 @@ def validate_password(password):
 
 @app.route('/register', methods=('GET', 'POST'))
 def register():
-    # 只有在没有管理员账户的情况下才允许注册
-    if has_admin():
-        flash('已存在管理员账户，不允许注册')
+    # 第一个账户（管理员）总是可以注册，之后只有开放注册时才允许，否则由管理员用 flask create-user 创建
+    first_user = not has_admin()
+    if not first_user and not app.config['REGISTRATION_OPEN']:
+        flash('未开放注册，请联系管理员创建账户')
         return redirect(url_for('login'))
         
     if request.method == 'POST':
-        username = request.form['username']
-        password = request.form['password']
-        db = get_auth_db()
-        error = None
-        
-        if not username:
-            error = '需要用户名'
-        elif not password:
-            error = '需要密码'
-        else:
-            # 验证密码强度
-            is_valid, password_error = validate_password(password)
-            if not is_valid:
-                error = password_error
-        
+        error = create_user(get_auth_db(), request.form['username'], request.form['password'])
         if error is None:
-            try:
-                db.execute(
-                    'INSERT INTO users (username, password) VALUES (?, ?)',
-                    (username, generate_password_hash(password))
-                )
-                db.commit()
-            except db.IntegrityError:
-                error = f"用户 {username} 已经注册"
-            else:
-                # 初始化数据库
-                init_db()
-                return redirect(url_for('login'))
-        
+            return redirect(url_for('login'))
         flash(error)
     
-    return render_template('register.html')
+    return render_template('register.html', first_user=first_user)
+
+@app.cli.command('create-user')
+@click.argument('username')
+@click.password_option(help='新用户的密码')
+def create_user_command(username, password):
+    """创建用户账户，每个用户的书签保存在各自的数据库中"""
+    error = create_user(get_auth_db(), username, password)
+    if error is not None:
+        raise click.UsageError(error)
+    click.echo(f'已创建用户 {username}')
+
+@app.cli.command('set-password')
+@click.argument('username')
+@click.password_option(help='新密码')
+def set_password_command(username, password):
+    """重置用户的密码，书签数据不受影响"""
+    is_valid, password_error = validate_password(password)
+    if not is_valid:
+        raise click.UsageError(password_error)
+    db = get_auth_db()
+    cursor = db.execute(
+        'UPDATE users SET password = ? WHERE username = ?', (generate_password_hash(password), username)
+    )
+    db.commit()
+    if cursor.rowcount == 0:
+        raise click.UsageError(f'用户 {username} 不存在')
+    click.echo(f'已重置用户 {username} 的密码')
+
+@app.cli.command('list-users')
+def list_users_command():
+    """列出所有用户及其书签数据库文件"""
+    for user_id, username in resolve_users():
+        click.echo(f'{username}: {user_database_name(user_database_file(user_id))}')
 
 @app.route('/logout')
 def logout():
@@ -381,27 +2179,88 @@ def logout():
 # API路由部分 - 分类相关
 @app.route('/api/categories', methods=['GET'])
 @login_required
+@conditional_get
 def get_categories():
+    response_format, _ = get_list_format()
+    if response_format is None:
+        return jsonify({'error': '不支持的格式'}), 400
+    
     db = get_db()
-    try:
-        categories = db.execute(
-            'SELECT id, name, parent_id, position FROM categories ORDER BY position'
-        ).fetchall()
-        
-        result = []
-        for category in categories:
-            result.append({
-                'id': category['id'],
-                'name': category['name'],
-                'parent_id': category['parent_id'],
-                'position': category['position']
-            })
-        
-        return jsonify(result)
-    except sqlite3.OperationalError:
-        # 如果表不存在，自动初始化数据库并返回空列表
-        init_db()
-        return jsonify([])
+    categories = db.execute(
+        'SELECT id, name, parent_id, position FROM categories ORDER BY position'
+    ).fetchall()
+    
+    if response_format == 'columnar':
+        return jsonify(to_columnar(categories, CATEGORY_FIELDS))
+    
+    result = []
+    for category in categories:
+        result.append({
+            'id': category['id'],
+            'name': category['name'],
+            'parent_id': category['parent_id'],
+            'position': category['position']
+        })
+    
+    return jsonify(result)
+
+# 完整的分类树，每个节点带本分类和整个子树的书签数
+# 计数由一条分组查询得到：触发器维护的各分类书签数通过闭包表汇总到每个祖先
+# bookmarks=N 时每个分类附带排在最前面的N个书签
+@app.route('/api/tree', methods=['GET'])
+@login_required
+@conditional_get
+def get_tree():
+    embed = request.args.get('bookmarks', 0, type=int)
+    embed = max(0, min(embed, app.config['TREE_MAX_EMBEDDED_BOOKMARKS']))
+    
+    db = get_db()
+    counts = {
+        row['id']: row for row in db.execute('''
+            SELECT category_tree.ancestor_id AS id,
+                   SUM(CASE WHEN category_tree.depth = 0 THEN category_counts.bookmark_count ELSE 0 END) AS bookmark_count,
+                   SUM(category_counts.bookmark_count) AS total_count
+            FROM category_counts
+            JOIN category_tree ON category_tree.descendant_id = category_counts.category_id
+            GROUP BY category_tree.ancestor_id
+        ''')
+    }
+    
+    nodes = {}
+    for category in db.execute('SELECT id, name, parent_id, position FROM categories ORDER BY position, id'):
+        count = counts.get(category['id'])
+        node = dict(category)
+        node['bookmark_count'] = count['bookmark_count'] if count else 0
+        node['total_count'] = count['total_count'] if count else 0
+        node['children'] = []
+        if embed:
+            node['bookmarks'] = []
+        nodes[category['id']] = node
+    
+    if embed:
+        # 每个分类各取前N个，走 (category_id, position, id) 索引
+        bookmarks = db.execute('''
+            SELECT bookmarks.id, bookmarks.title, bookmarks.url, bookmarks.description,
+                   bookmarks.category_id, bookmarks.position
+            FROM categories
+            JOIN bookmarks ON bookmarks.id IN (
+                SELECT id FROM bookmarks WHERE category_id = categories.id ORDER BY position, id LIMIT ?
+            )
+            ORDER BY bookmarks.category_id, bookmarks.position, bookmarks.id
+        ''', (embed,))
+        for bookmark in bookmarks:
+            nodes[bookmark['category_id']]['bookmarks'].append(dict(bookmark))
+    
+    tree = []
+    for node in nodes.values():
+        parent = nodes.get(node['parent_id'])
+        if parent is not None:
+            parent['children'].append(node)
+        else:
+            tree.append(node)
+    
+    total = sum(node['total_count'] for node in tree)
+    return jsonify({'tree': tree, 'total': total})
 
 @app.route('/api/categories', methods=['POST'])
 @login_required
@@ -416,47 +2275,23 @@ def create_category():
     db = get_db()
     cursor = db.cursor()
     
-    try:
-        # 获取最大位置值
-        if parent_id:
-            max_position = cursor.execute(
-                'SELECT MAX(position) FROM categories WHERE parent_id = ?', 
-                (parent_id,)
-            ).fetchone()[0] or 0
-        else:
-            max_position = cursor.execute(
-                'SELECT MAX(position) FROM categories WHERE parent_id IS NULL'
-            ).fetchone()[0] or 0
-        
-        cursor.execute(
-            'INSERT INTO categories (name, parent_id, position) VALUES (?, ?, ?)',
-            (name, parent_id, max_position + 1)
-        )
-        db.commit()
-        
-        return jsonify({
-            'id': cursor.lastrowid,
-            'name': name,
-            'parent_id': parent_id,
-            'position': max_position + 1
-        }), 201
-    except sqlite3.OperationalError:
-        # 如果表不存在，自动初始化数据库
-        init_db()
-        # 再次尝试创建分类
-        cursor = db.cursor()
-        cursor.execute(
-            'INSERT INTO categories (name, parent_id, position) VALUES (?, ?, ?)',
-            (name, parent_id, 1)
-        )
-        db.commit()
-        
-        return jsonify({
-            'id': cursor.lastrowid,
-            'name': name,
-            'parent_id': parent_id,
-            'position': 1
-        }), 201
+    # 在同一条语句中计算位置并插入，避免并发创建时位置重复
+    cursor.execute(
+        'INSERT INTO categories (name, parent_id, position) '
+        'SELECT ?, ?, COALESCE(MAX(position), 0) + ? FROM categories WHERE parent_id IS ?',
+        (name, parent_id, POSITION_GAP, parent_id)
+    )
+    position = cursor.execute(
+        'SELECT position FROM categories WHERE id = ?', (cursor.lastrowid,)
+    ).fetchone()[0]
+    db.commit()
+    
+    return jsonify({
+        'id': cursor.lastrowid,
+        'name': name,
+        'parent_id': parent_id,
+        'position': position
+    }), 201
 
 @app.route('/api/categories/<int:category_id>', methods=['PUT'])
 @login_required
@@ -537,37 +2372,14 @@ def move_category(category_id):
         if category['parent_id'] != parent_id:
             return jsonify({'error': '只能在同级目录之间调整顺序'}), 400
         
-        # 获取同级分类列表
-        siblings = db.execute(
-            'SELECT id, position FROM categories WHERE parent_id IS ? ORDER BY position',
-            (parent_id,)
-        ).fetchall()
-        
-        # 计算新的位置
-        old_pos = category['position']
-        new_pos = position
-        
-        # 更新位置
-        if old_pos < new_pos:
-            # 向后移动：将中间的项目位置减1
-            db.execute(
-                'UPDATE categories SET position = position - 1 '
-                'WHERE parent_id IS ? AND position > ? AND position <= ?',
-                (parent_id, old_pos, new_pos)
-            )
+        # 向后移动时放到目标之后，向前移动时放到目标之前
+        if (category['position'], category['id']) < (target_category['position'], target_category['id']):
+            before_id = item_after(db, 'categories', parent_id, category_id, target_category['id'])
         else:
-            # 向前移动：将中间的项目位置加1
-            db.execute(
-                'UPDATE categories SET position = position + 1 '
-                'WHERE parent_id IS ? AND position >= ? AND position < ?',
-                (parent_id, new_pos, old_pos)
-            )
+            before_id = target_category['id']
         
-        # 更新移动项的位置
-        db.execute(
-            'UPDATE categories SET position = ? WHERE id = ?',
-            (new_pos, category_id)
-        )
+        # 只更新被移动的分类
+        move_item_before(db, 'categories', category_id, parent_id, before_id)
         
         db.commit()
         return jsonify({'success': True})
@@ -576,61 +2388,260 @@ def move_category(category_id):
         db.rollback()
         return jsonify({'error': str(e)}), 500
 
+# 批量操作
+# 先校验整个请求，再在一个事务中用 executemany 写入，任何一项无效都不会留下部分修改。
+# ID列表通过 json_each 传给SQLite，不受绑定变量数量的限制。
+def parse_batch_items(items, required_fields, optional_fields=()):
+    if not isinstance(items, list) or not items:
+        return None, '请求数据不能为空'
+    if len(items) > app.config['BATCH_MAX_ITEMS']:
+        return None, f"一次最多处理 {app.config['BATCH_MAX_ITEMS']} 项"
+    
+    parsed = []
+    seen_ids = set()
+    for index, item in enumerate(items):
+        try:
+            values = {field: int(item[field]) for field in required_fields}
+            for field in optional_fields:
+                values[field] = int(item[field]) if item.get(field) is not None else None
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None, f'第 {index + 1} 项缺少字段或字段无效'
+        
+        if values['id'] in seen_ids:
+            return None, f"ID {values['id']} 重复"
+        seen_ids.add(values['id'])
+        parsed.append(values)
+    
+    return parsed, None
+
+def find_missing_ids(db, table, ids):
+    rows = db.execute(
+        f'SELECT value FROM json_each(?) WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE id = value)',
+        (json.dumps(sorted(set(ids))),)
+    ).fetchall()
+    return [row[0] for row in rows]
+
 @app.route('/api/categories/reorder', methods=['POST'])
 @login_required
 def reorder_categories():
-    data = request.json
-    categories = data.get('categories', [])
+    data = request.get_json(silent=True) or {}
+    categories, error = parse_batch_items(data.get('categories'), ('id', 'position'), ('parent_id',))
+    if error:
+        return jsonify({'error': error}), 400
     
     db = get_db()
-    for category in categories:
-        db.execute(
-            'UPDATE categories SET position = ?, parent_id = ? WHERE id = ?',
-            (category['position'], category.get('parent_id'), category['id'])
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        missing = find_missing_ids(
+            db, 'categories',
+            [c['id'] for c in categories] + [c['parent_id'] for c in categories if c['parent_id'] is not None]
         )
+        if missing:
+            db.rollback()
+            return jsonify({'error': f'分类不存在: {missing}'}), 400
+        
+        db.executemany(
+            'UPDATE categories SET position = :position, parent_id = :parent_id WHERE id = :id',
+            categories
+        )
+        
+        # 返回受影响分组的最新顺序
+        parent_ids = {c['parent_id'] for c in categories}
+        result = db.execute(
+            'SELECT id, parent_id, position FROM categories '
+            'WHERE parent_id IN (SELECT value FROM json_each(?)) OR (? AND parent_id IS NULL) '
+            'ORDER BY parent_id, position, id',
+            (json.dumps([p for p in parent_ids if p is not None]), None in parent_ids)
+        ).fetchall()
+        db.commit()
+    except sqlite3.IntegrityError as e:
+        # 闭包表触发器拒绝了循环的父子关系
+        db.rollback()
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.Error as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 500
     
-    db.commit()
-    
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'categories': [dict(row) for row in result]})
 
 # API路由部分 - 书签相关
+# 游标格式: "category_id,position,id"，与排序键一致
+def encode_bookmark_cursor(bookmark):
+    return f"{bookmark['category_id']},{bookmark['position']},{bookmark['id']}"
+
+def decode_bookmark_cursor(cursor):
+    category_id, position, bookmark_id = cursor.split(',')
+    return int(category_id), int(position), int(bookmark_id)
+
+# 逐块读取游标，增量输出JSON数组，内存占用与总行数无关
+# 列式JSON（format=columnar）：{"columns": {字段: [每行的值, ...]}}，省去每行重复的键名。
+# hosts=true 时URL按 "协议://主机" 前缀做字典编码：url 列只保留其余部分，
+# url_host 列是前缀在 "hosts" 数组中的下标，无法拆分的URL为 null。
+URL_HOST_PATTERN = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*://[^/?#]*')
+BOOKMARK_FIELDS = ('id', 'title', 'url', 'description', 'category_id', 'position')
+BOOKMARK_COLUMNS = ', '.join(f'bookmarks.{field}' for field in BOOKMARK_FIELDS)
+CATEGORY_FIELDS = ('id', 'name', 'parent_id', 'position')
+
+class UrlHostEncoder:
+    def __init__(self):
+        self.hosts = {}
+    
+    def host(self, url):
+        match = URL_HOST_PATTERN.match(url)
+        return self.hosts.setdefault(match.group(), len(self.hosts)) if match else None
+    
+    def rest(self, url):
+        match = URL_HOST_PATTERN.match(url)
+        return url[match.end():] if match else url
+
+def get_list_format():
+    response_format = request.args.get('format', 'objects')
+    if response_format not in ('objects', 'columnar'):
+        return None, None
+    encoder = UrlHostEncoder() if request.args.get('hosts', 'false').lower() == 'true' else None
+    return response_format, encoder
+
+def columnar_columns(fields, encoder):
+    # (输出的列名, 查询的字段, 值的转换)
+    columns = []
+    for field in fields:
+        if field == 'url' and encoder is not None:
+            columns.append(('url_host', field, encoder.host))
+            columns.append(('url', field, encoder.rest))
+        else:
+            columns.append((field, field, None))
+    return columns
+
+def to_columnar(rows, fields, encoder=None):
+    result = {'columns': {}}
+    for name, field, convert in columnar_columns(fields, encoder):
+        values = [row[field] for row in rows]
+        result['columns'][name] = [convert(value) for value in values] if convert else values
+    if encoder is not None:
+        result['hosts'] = list(encoder.hosts)
+    return result
+
+def dumps_compact(value):
+    return app.json.dumps(value, separators=(',', ':'))
+
+# 流式输出列式JSON：每列单独查询一次，内存占用与总行数无关。
+# 所有查询在同一个读事务中执行，各列的行数和顺序一致。
+def stream_columnar(db, table, query, params, fields, encoder=None):
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+    db.execute('BEGIN')
+    try:
+        yield '{"columns":{'
+        for index, (name, field, convert) in enumerate(columnar_columns(fields, encoder)):
+            yield ('' if index == 0 else ',') + dumps_compact(name) + ':['
+            cursor = db.execute(f'SELECT {table}.{field}{query}', params)
+            first = True
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                values = [convert(row[0]) if convert else row[0] for row in rows]
+                chunk = dumps_compact(values)[1:-1]
+                yield chunk if first else ',' + chunk
+                first = False
+            yield ']'
+        yield '}'
+        if encoder is not None:
+            yield ',"hosts":' + dumps_compact(list(encoder.hosts))
+        yield '}'
+    finally:
+        db.rollback()
+
+def stream_json_array(cursor):
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+    yield '['
+    first = True
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = ','.join(app.json.dumps(dict(row)) for row in rows)
+        yield chunk if first else ',' + chunk
+        first = False
+    yield ']'
+
 @app.route('/api/bookmarks', methods=['GET'])
 @login_required
+@conditional_get
 def get_bookmarks():
     try:
         category_id = request.args.get('category_id')
         include_subcategories = request.args.get('include_subcategories', 'false').lower() == 'true'
+        limit = request.args.get('limit')
+        after = request.args.get('after')
+        response_format, encoder = get_list_format()
+        if response_format is None:
+            return jsonify({'error': '不支持的格式'}), 400
         
         db = get_db()
         
-        # 构建查询
-        query = 'SELECT * FROM bookmarks'
+        # 构建查询（不含 SELECT 部分）
+        query = ' FROM bookmarks'
+        conditions = []
         params = []
         
         if category_id:
             if include_subcategories:
-                # 获取所有子分类ID
-                subcategory_ids = [category_id]
-                cursor = db.execute('SELECT id FROM categories WHERE parent_id = ?', (category_id,))
-                for row in cursor:
-                    subcategory_ids.append(row['id'])
-                
-                # 构建IN查询
-                placeholders = ','.join(['?' for _ in subcategory_ids])
-                query += f' WHERE category_id IN ({placeholders})'
-                params.extend(subcategory_ids)
+                # 通过闭包表连接整棵子树（任意深度）
+                query += ' JOIN category_tree ON category_tree.descendant_id = bookmarks.category_id'
+                conditions.append('category_tree.ancestor_id = ?')
+            else:
+                conditions.append('bookmarks.category_id = ?')
+            params.append(category_id)
+        
+        # 分页模式：按 (category_id, position, id) 进行键集分页
+        if limit is not None:
+            try:
+                limit = int(limit)
+                after_key = decode_bookmark_cursor(after) if after else None
+            except ValueError:
+                return jsonify({'error': '无效的分页参数'}), 400
+            limit = max(1, min(limit, app.config['BOOKMARKS_MAX_PAGE_SIZE']))
+            
+            if after_key:
+                conditions.append('(bookmarks.category_id, bookmarks.position, bookmarks.id) > (?, ?, ?)')
+                params.extend(after_key)
+        
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY bookmarks.category_id, bookmarks.position, bookmarks.id'
+        
+        if limit is None:
+            # 不分页时流式输出，避免一次性把全部书签读入内存
+            if response_format == 'columnar':
+                chunks = stream_columnar(db, 'bookmarks', query, params, BOOKMARK_FIELDS, encoder)
             else:
-                query += ' WHERE category_id = ?'
-                params.append(category_id)
+                chunks = stream_json_array(db.execute(f'SELECT {BOOKMARK_COLUMNS}{query}', params))
+            return Response(stream_with_context(chunks), mimetype='application/json')
         
-        query += ' ORDER BY position ASC'
-        bookmarks = db.execute(query, params).fetchall()
+        # 多取一行用于判断是否还有下一页
+        bookmarks = db.execute(f'SELECT {BOOKMARK_COLUMNS}{query} LIMIT ?', params + [limit + 1]).fetchall()
+        has_more = len(bookmarks) > limit
+        bookmarks = bookmarks[:limit]
+        next_cursor = encode_bookmark_cursor(bookmarks[-1]) if has_more else None
         
-        return jsonify([dict(bookmark) for bookmark in bookmarks])
+        if response_format == 'columnar':
+            return jsonify(dict(to_columnar(bookmarks, BOOKMARK_FIELDS, encoder), next=next_cursor))
+        return jsonify({
+            'bookmarks': [dict(bookmark) for bookmark in bookmarks],
+            'next': next_cursor
+        })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# 规范化URL相同的已有书签（最早的一个），不存在时返回 None
+def find_duplicate_bookmark(db, canonical_url, exclude_id=None):
+    row = db.execute(
+        'SELECT id, title, url, category_id FROM bookmarks WHERE canonical_url = ? AND id IS NOT ? ORDER BY id LIMIT 1',
+        (canonical_url, exclude_id)
+    ).fetchone()
+    return dict(row) if row else None
+
 @app.route('/api/bookmarks', methods=['POST'])
 @login_required
 def create_bookmark():
@@ -645,47 +2656,30 @@ def create_bookmark():
     
     db = get_db()
     cursor = db.cursor()
+    canonical_url = normalize_url(url)
+    # 重复的网址仍然保存，但在响应中告知已有的书签
+    duplicate = find_duplicate_bookmark(db, canonical_url)
     
-    try:
-        # 获取最大位置值
-        max_position = cursor.execute(
-            'SELECT MAX(position) FROM bookmarks WHERE category_id = ?', 
-            (category_id,)
-        ).fetchone()[0] or 0
-        
-        cursor.execute(
-            'INSERT INTO bookmarks (title, url, description, category_id, position) VALUES (?, ?, ?, ?, ?)',
-            (title, url, description, category_id, max_position + 1)
-        )
-        db.commit()
-        
-        return jsonify({
-            'id': cursor.lastrowid,
-            'title': title,
-            'url': url,
-            'description': description,
-            'category_id': category_id,
-            'position': max_position + 1
-        }), 201
-    except sqlite3.OperationalError:
-        # 如果表不存在，自动初始化数据库
-        init_db()
-        # 再次尝试创建书签
-        cursor = db.cursor()
-        cursor.execute(
-            'INSERT INTO bookmarks (title, url, description, category_id, position) VALUES (?, ?, ?, ?, ?)',
-            (title, url, description, category_id, 1)
-        )
-        db.commit()
-        
-        return jsonify({
-            'id': cursor.lastrowid,
-            'title': title,
-            'url': url,
-            'description': description,
-            'category_id': category_id,
-            'position': 1
-        }), 201
+    # 在同一条语句中计算位置并插入，避免并发创建时位置重复
+    cursor.execute(
+        'INSERT INTO bookmarks (title, url, description, category_id, position, canonical_url) '
+        'SELECT ?, ?, ?, ?, COALESCE(MAX(position), 0) + ?, ? FROM bookmarks WHERE category_id = ?',
+        (title, url, description, category_id, POSITION_GAP, canonical_url, category_id)
+    )
+    position = cursor.execute(
+        'SELECT position FROM bookmarks WHERE id = ?', (cursor.lastrowid,)
+    ).fetchone()[0]
+    db.commit()
+    
+    return jsonify({
+        'id': cursor.lastrowid,
+        'title': title,
+        'url': url,
+        'description': description,
+        'category_id': category_id,
+        'position': position,
+        'duplicate': duplicate
+    }), 201
 
 @app.route('/api/bookmarks/<int:bookmark_id>', methods=['PUT'])
 @login_required
@@ -700,13 +2694,15 @@ def update_bookmark(bookmark_id):
         return jsonify({'error': '标题、URL和分类不能为空'}), 400
     
     db = get_db()
+    canonical_url = normalize_url(url)
+    duplicate = find_duplicate_bookmark(db, canonical_url, exclude_id=bookmark_id)
     db.execute(
-        'UPDATE bookmarks SET title = ?, url = ?, description = ?, category_id = ? WHERE id = ?',
-        (title, url, description, category_id, bookmark_id)
+        'UPDATE bookmarks SET title = ?, url = ?, description = ?, category_id = ?, canonical_url = ? WHERE id = ?',
+        (title, url, description, category_id, canonical_url, bookmark_id)
     )
     db.commit()
     
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'duplicate': duplicate})
 
 @app.route('/api/bookmarks/<int:bookmark_id>', methods=['DELETE'])
 @login_required
@@ -726,253 +2722,1883 @@ def delete_bookmark(bookmark_id):
         return jsonify({'success': True})
     except sqlite3.Error as e:
         # 数据库错误处理
-        print(f"删除书签时出错: {str(e)}")
+        log_event(logging.ERROR, 'bookmark_delete_failed', bookmark_id=bookmark_id, error=str(e))
         return jsonify({'error': f'数据库操作失败: {str(e)}'}), 500
     except Exception as e:
         # 其他异常处理
-        print(f"删除书签时出现未知错误: {str(e)}")
+        logger.exception('bookmark_delete_failed', extra={'fields': {'bookmark_id': bookmark_id}})
         return jsonify({'error': '服务器内部错误'}), 500
 
 @app.route('/api/bookmarks/reorder', methods=['POST'])
 @login_required
 def reorder_bookmarks():
-    data = request.json
-    bookmarks = data.get('bookmarks', [])
+    data = request.get_json(silent=True) or {}
+    bookmarks, error = parse_batch_items(data.get('bookmarks'), ('id', 'position', 'category_id'))
+    if error:
+        return jsonify({'error': error}), 400
     
     db = get_db()
-    for bookmark in bookmarks:
-        db.execute(
-            'UPDATE bookmarks SET position = ?, category_id = ? WHERE id = ?',
-            (bookmark['position'], bookmark['category_id'], bookmark['id'])
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        missing = find_missing_ids(db, 'bookmarks', [b['id'] for b in bookmarks])
+        if missing:
+            db.rollback()
+            return jsonify({'error': f'书签不存在: {missing}'}), 400
+        
+        category_ids = sorted({b['category_id'] for b in bookmarks})
+        missing = find_missing_ids(db, 'categories', category_ids)
+        if missing:
+            db.rollback()
+            return jsonify({'error': f'分类不存在: {missing}'}), 400
+        
+        db.executemany(
+            'UPDATE bookmarks SET position = :position, category_id = :category_id WHERE id = :id',
+            bookmarks
         )
+        
+        # 返回受影响分类的最新顺序
+        result = db.execute(
+            'SELECT id, category_id, position FROM bookmarks '
+            'WHERE category_id IN (SELECT value FROM json_each(?)) ORDER BY category_id, position, id',
+            (json.dumps(category_ids),)
+        ).fetchall()
+        db.commit()
+    except sqlite3.Error as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 500
     
-    db.commit()
-    
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'bookmarks': [dict(row) for row in result]})
 
 @app.route('/api/bookmarks/move', methods=['POST'])
 @login_required
 def move_bookmarks():
-    data = request.json
+    data = request.get_json(silent=True) or {}
     bookmark_ids = data.get('bookmark_ids', [])
     target_category_id = data.get('target_category_id')
     
     if not bookmark_ids or not target_category_id:
         return jsonify({'error': '书签ID和目标分类ID不能为空'}), 400
     
-    db = get_db()
-    
-    # 获取目标分类中最大的位置值
-    max_position = db.execute(
-        'SELECT MAX(position) FROM bookmarks WHERE category_id = ?', 
-        (target_category_id,)
-    ).fetchone()[0] or 0
-    
-    # 更新书签的分类和位置
-    for i, bookmark_id in enumerate(bookmark_ids):
-        db.execute(
-            'UPDATE bookmarks SET category_id = ?, position = ? WHERE id = ?',
-            (target_category_id, max_position + i + 1, bookmark_id)
-        )
+    bookmarks, error = parse_batch_items(
+        [{'id': bookmark_id} for bookmark_id in bookmark_ids] if isinstance(bookmark_ids, list) else None,
+        ('id',)
+    )
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        target_category_id = int(target_category_id)
+    except (TypeError, ValueError):
+        return jsonify({'error': '目标分类ID无效'}), 400
     
-    db.commit()
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        missing = find_missing_ids(db, 'bookmarks', [b['id'] for b in bookmarks])
+        if missing:
+            db.rollback()
+            return jsonify({'error': f'书签不存在: {missing}'}), 400
+        if find_missing_ids(db, 'categories', [target_category_id]):
+            db.rollback()
+            return jsonify({'error': '目标分类不存在'}), 404
+        
+        # 按请求中的顺序追加到目标分类末尾
+        max_position = db.execute(
+            'SELECT MAX(position) FROM bookmarks WHERE category_id = ?',
+            (target_category_id,)
+        ).fetchone()[0] or 0
+        
+        moved = [
+            (target_category_id, max_position + (i + 1) * POSITION_GAP, bookmark['id'])
+            for i, bookmark in enumerate(bookmarks)
+        ]
+        db.executemany('UPDATE bookmarks SET category_id = ?, position = ? WHERE id = ?', moved)
+        db.commit()
+    except sqlite3.Error as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 500
     
-    return jsonify({'success': True})
+    return jsonify({
+        'success': True,
+        'bookmarks': [
+            {'id': bookmark_id, 'category_id': category_id, 'position': position}
+            for category_id, position, bookmark_id in moved
+        ]
+    })
 
 @app.route('/api/bookmarks/<int:id>/position', methods=['PUT'])
 @login_required
 def update_bookmark_position(id):
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求数据无效'}), 400
     position = data.get('position')
+    before_id = data.get('before_id')
     category_id = data.get('category_id')
     
-    print(f"更新书签位置: id={id}, 新位置={position}, 分类={category_id}")
-    
-    if position is None or category_id is None:
+    if category_id is None or (position is None and 'before_id' not in data):
         return jsonify({'error': '位置和分类ID不能为空'}), 400
     
-    position = int(position)
-    category_id = int(category_id)
+    # 在开始写事务之前解析参数，无效时直接返回，不持有写锁
+    try:
+        category_id = int(category_id)
+        if 'before_id' not in data:
+            position = int(position)
+        elif before_id is not None:
+            before_id = int(before_id)
+    except (TypeError, ValueError):
+        return jsonify({'error': '位置或分类ID无效'}), 400
     
     db = get_db()
     
     # 开始显式事务
-    db.execute('BEGIN TRANSACTION')
+    db.execute('BEGIN IMMEDIATE')
     
     try:
-        cursor = db.cursor()
-        
-        # 获取当前书签信息
-        bookmark = cursor.execute(
-            'SELECT id, title, category_id, position FROM bookmarks WHERE id = ?',
-            (id,)
-        ).fetchone()
+        bookmark = db.execute('SELECT id FROM bookmarks WHERE id = ?', (id,)).fetchone()
         
         if not bookmark:
             db.rollback()
             return jsonify({'error': '书签不存在'}), 404
         
-        old_position = int(bookmark['position'])
-        old_category_id = int(bookmark['category_id'])
-        bookmark_title = bookmark['title']
-        
-        print(f"书签「{bookmark_title}」原位置: position={old_position}, category_id={old_category_id}")
-        
-        # 如果是同一分类内移动
-        if old_category_id == category_id:
-            if old_position < position:
-                # 向后移动，将中间的书签向前移
-                print(f"向后移动: {old_position} -> {position}")
-                cursor.execute(
-                    'UPDATE bookmarks SET position = position - 1 WHERE category_id = ? AND position > ? AND position <= ?',
-                    (category_id, old_position, position)
-                )
-            elif old_position > position:
-                # 向前移动，将中间的书签向后移
-                print(f"向前移动: {old_position} -> {position}")
-                cursor.execute(
-                    'UPDATE bookmarks SET position = position + 1 WHERE category_id = ? AND position >= ? AND position < ?',
-                    (category_id, position, old_position)
-                )
-        else:
-            # 跨分类移动
-            print(f"跨分类移动: {old_category_id} -> {category_id}")
-            # 1. 原分类中的后续书签向前移
-            cursor.execute(
-                'UPDATE bookmarks SET position = position - 1 WHERE category_id = ? AND position > ?',
-                (old_category_id, old_position)
-            )
-            
-            # 2. 目标分类中的书签为新书签腾出位置
-            cursor.execute(
-                'UPDATE bookmarks SET position = position + 1 WHERE category_id = ? AND position >= ?',
-                (category_id, position)
-            )
-        
-        # 更新书签位置
-        cursor.execute(
-            'UPDATE bookmarks SET position = ?, category_id = ? WHERE id = ?',
-            (position, category_id, id)
-        )
+        if find_missing_ids(db, 'categories', [category_id]):
+            db.rollback()
+            return jsonify({'error': '分类不存在'}), 404
         
-        # 规范化位置值，确保连续
-        print(f"规范化分类 {category_id} 的书签位置")
-        cursor.execute('''
-            UPDATE bookmarks SET position = (
-                SELECT COUNT(*) 
-                FROM bookmarks AS b 
-                WHERE b.category_id = bookmarks.category_id AND b.position <= bookmarks.position
-            )
-            WHERE category_id = ?
-        ''', (category_id,))
-        
-        # 如果是跨分类移动，还需要规范化原分类
-        if old_category_id != category_id:
-            print(f"规范化原分类 {old_category_id} 的书签位置")
-            cursor.execute('''
-                UPDATE bookmarks SET position = (
-                    SELECT COUNT(*) 
-                    FROM bookmarks AS b 
-                    WHERE b.category_id = bookmarks.category_id AND b.position <= bookmarks.position
-                )
-                WHERE category_id = ?
-            ''', (old_category_id,))
+        # 旧接口传入位置值：放到排序键不小于该值的第一个书签之前
+        if 'before_id' not in data:
+            before_id = item_at_position(db, 'bookmarks', category_id, id, position)
+        elif before_id is not None:
+            target = db.execute('SELECT category_id FROM bookmarks WHERE id = ?', (before_id,)).fetchone()
+            if not target or target['category_id'] != category_id:
+                db.rollback()
+                return jsonify({'error': '目标位置不存在'}), 404
         
-        # 提交事务
+        # 只写被移动的书签，不再移动同分类的其他书签
+        move_item_before(db, 'bookmarks', id, category_id, before_id)
         db.commit()
         
-        # 获取更新后的真实位置（可能在规范化后有变化）
-        updated_bookmark = cursor.execute(
+        updated_bookmark = db.execute(
             'SELECT id, title, url, description, category_id, position FROM bookmarks WHERE id = ?',
             (id,)
         ).fetchone()
         
-        # 获取分类内所有书签的最新位置信息，用于前端完整更新
-        category_bookmarks = cursor.execute(
-            'SELECT id, title, position FROM bookmarks WHERE category_id = ? ORDER BY position',
-            (category_id,)
-        ).fetchall()
+        log_event(
+            logging.DEBUG, 'bookmark_position_updated',
+            bookmark_id=id, position=updated_bookmark['position'], before_id=before_id, category_id=category_id
+        )
         
-        category_bookmarks_list = []
-        for b in category_bookmarks:
-            category_bookmarks_list.append({
-                'id': b['id'],
-                'title': b['title'],
-                'position': b['position']
-            })
-        
-        print(f"书签位置更新成功: id={id}, 规范化后位置={updated_bookmark['position']}, 分类={category_id}")
-        
-        # 使用两步格式化避免嵌套f-string
-        bookmark_positions = []
-        for b in category_bookmarks_list:
-            bookmark_positions.append(f"{b['title']}:{b['position']}")
-        print(f"分类 {category_id} 中所有书签位置: {', '.join(bookmark_positions)}")
-        
-        # 转换为字典
-        if updated_bookmark:
-            result = {
-                'id': updated_bookmark['id'],
-                'title': updated_bookmark['title'],
-                'url': updated_bookmark['url'],
-                'description': updated_bookmark['description'],
-                'category_id': updated_bookmark['category_id'],
-                'position': updated_bookmark['position'],
-                'category_bookmarks': category_bookmarks_list,
-                'success': True
-            }
-        else:
-            result = {'success': True}
-            
+        result = dict(updated_bookmark)
+        result['success'] = True
         return jsonify(result)
         
     except sqlite3.Error as e:
         db.rollback()
-        print(f"更新书签位置错误: {str(e)}")
+        log_event(logging.ERROR, 'bookmark_position_update_failed', bookmark_id=id, error=str(e))
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/bookmarks/export', methods=['POST'])
+# 重复书签
+# 报告：对规范化URL索引做一次分组扫描找出重复的网址，按规范化URL分页（after 为上一页最后一组的 canonical_url）。
+# 合并：每组保留最早（keep=oldest）或最新（keep=newest）的书签，保留的书签没有描述时使用被合并书签的描述，
+# 其余书签删除。可以用 canonical_urls 只合并指定的组。
+def find_duplicate_groups(db, after='', limit=None, canonical_urls=None):
+    query = 'SELECT canonical_url, json_group_array(id) AS ids FROM bookmarks WHERE canonical_url > ?'
+    params = [after]
+    if canonical_urls is not None:
+        query += ' AND canonical_url IN (SELECT value FROM json_each(?))'
+        params.append(json.dumps(canonical_urls))
+    query += ' GROUP BY canonical_url HAVING COUNT(*) > 1 ORDER BY canonical_url'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return [(row['canonical_url'], sorted(json.loads(row['ids']))) for row in db.execute(query, params)]
+
+def fetch_bookmarks_by_ids(db, ids):
+    rows = db.execute(
+        f'SELECT {BOOKMARK_COLUMNS} FROM bookmarks WHERE id IN (SELECT value FROM json_each(?))',
+        (json.dumps(ids),)
+    )
+    return {row['id']: dict(row) for row in rows}
+
+@app.route('/api/bookmarks/duplicates', methods=['GET'])
 @login_required
-def export_bookmarks():
+@conditional_get
+def get_duplicate_bookmarks():
+    limit = request.args.get('limit', app.config['DUPLICATES_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['DUPLICATES_PAGE_SIZE']))
+    after = request.args.get('after', '')
+    
+    db = get_db()
+    db.execute('BEGIN')
+    try:
+        # 多取一组用于判断是否还有下一页
+        groups = find_duplicate_groups(db, after, limit + 1)
+        has_more = len(groups) > limit
+        groups = groups[:limit]
+        bookmarks = fetch_bookmarks_by_ids(db, [bookmark_id for _, ids in groups for bookmark_id in ids])
+    finally:
+        db.rollback()
+    
+    return jsonify({
+        'groups': [
+            {'canonical_url': canonical_url, 'bookmarks': [bookmarks[bookmark_id] for bookmark_id in ids]}
+            for canonical_url, ids in groups
+        ],
+        'next': groups[-1][0] if has_more else None
+    })
+
+@app.route('/api/bookmarks/duplicates/merge', methods=['POST'])
+@login_required
+def merge_duplicate_bookmarks():
+    data = request.get_json(silent=True) or {}
+    keep = data.get('keep', 'oldest')
+    if keep not in ('oldest', 'newest'):
+        return jsonify({'error': 'keep 只能是 oldest 或 newest'}), 400
+    canonical_urls = data.get('canonical_urls')
+    if canonical_urls is not None:
+        if not isinstance(canonical_urls, list) or not canonical_urls \
+                or not all(isinstance(url, str) for url in canonical_urls):
+            return jsonify({'error': 'canonical_urls 必须是非空的字符串列表'}), 400
+        if len(canonical_urls) > app.config['BATCH_MAX_ITEMS']:
+            return jsonify({'error': f"一次最多处理 {app.config['BATCH_MAX_ITEMS']} 项"}), 400
+    
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        groups = find_duplicate_groups(db, canonical_urls=canonical_urls)
+        descriptions = {
+            row['id']: row['description'] for row in db.execute(
+                'SELECT id, description FROM bookmarks WHERE id IN (SELECT value FROM json_each(?))',
+                (json.dumps([bookmark_id for _, ids in groups for bookmark_id in ids]),)
+            )
+        }
+        
+        updates = []
+        removed = []
+        for _, ids in groups:
+            kept = ids[0] if keep == 'oldest' else ids[-1]
+            others = [bookmark_id for bookmark_id in ids if bookmark_id != kept]
+            if not descriptions[kept]:
+                description = next((descriptions[other] for other in others if descriptions[other]), None)
+                if description:
+                    updates.append((description, kept))
+            removed.extend(others)
+        
+        db.executemany('UPDATE bookmarks SET description = ? WHERE id = ?', updates)
+        db.execute('DELETE FROM bookmarks WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(removed),))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    
+    log_event(logging.INFO, 'duplicates_merged', groups=len(groups), removed=len(removed))
+    return jsonify({'success': True, 'groups': len(groups), 'removed': len(removed)})
+
+# 访问书签网址的HTTP客户端，死链检查和网页信息抓取共用。
+# 同一主机最多 LINK_CHECK_PER_HOST 个并发请求，两次请求至少间隔 LINK_CHECK_HOST_INTERVAL 秒，
+# 请求结束后连接按主机保留复用。
+# 书签网址由用户填写，服务器不能替用户访问内网：默认在建立连接时检查域名解析出的地址，
+# 本机、私有网段、链路本地（如 169.254.169.254）和保留地址一律拒绝。重定向后的每个请求都重新建立连接，同样会检查。
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+def is_public_address(ip):
+    address = ipaddress.ip_address(ip.split('%', 1)[0])
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+# 替代 socket.create_connection：只连接公网地址。连接的就是检查过的地址，域名解析结果在检查后变化也无效
+def create_public_connection(address, timeout, source_address=None):
+    host, port = address
+    addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    for *_, sockaddr in addresses:
+        if not is_public_address(sockaddr[0]):
+            raise ConnectionRefusedError(f'拒绝访问非公网地址 {sockaddr[0]}')
+    error = None
+    for family, socktype, proto, _, sockaddr in addresses:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error
+
+class HostThrottledClient:
+    def __init__(self):
+        self.per_host = app.config['LINK_CHECK_PER_HOST']
+        self.host_interval = app.config['LINK_CHECK_HOST_INTERVAL']
+        self.timeout = app.config['LINK_CHECK_TIMEOUT']
+        self.max_redirects = app.config['LINK_CHECK_MAX_REDIRECTS']
+        self.headers = {'User-Agent': app.config['LINK_CHECK_USER_AGENT'], 'Accept': '*/*'}
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._next_request_at = {}
+        self._idle = {}
+    
+    @contextmanager
+    def _host_slot(self, host):
+        with self._lock:
+            slot = self._host_slots.setdefault(host, threading.Semaphore(self.per_host))
+        with slot:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_request_at.get(host, 0))
+                self._next_request_at[host] = start + self.host_interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+    
+    def _connection(self, host):
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle:
+                return idle.pop(), True
+        scheme, hostname, port = host
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(hostname, port, timeout=self.timeout)
+        if app.config['LINK_CHECK_BLOCK_PRIVATE_ADDRESSES']:
+            connection._create_connection = create_public_connection
+        return connection, False
+    
+    def _release(self, host, connection):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.per_host:
+                idle.append(connection)
+                return
+        connection.close()
+    
+    # 返回 (状态码, 响应头, 最多 body_limit 字节的响应体)
+    def request(self, method, url, body_limit):
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.hostname, parts.port)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        with self._host_slot(host):
+            while True:
+                connection, reused = self._connection(host)
+                try:
+                    connection.request(method, target, headers=self.headers)
+                    response = connection.getresponse()
+                    body = response.read(body_limit)
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    connection.close()
+                    # 复用的空闲连接可能已被服务器关闭，换新连接重试
+                    if reused:
+                        continue
+                    raise
+                except Exception:
+                    connection.close()
+                    raise
+                # 响应体读完且服务器没有要求关闭时连接才能复用
+                if response.isclosed() and not response.will_close:
+                    self._release(host, connection)
+                else:
+                    connection.close()
+                return response.status, response.headers, body
+    
+    # 跟随重定向发出 GET 请求，返回 (状态码, 最终网址, 响应头, 响应体)
+    def get(self, url, body_limit):
+        for _ in range(self.max_redirects + 1):
+            status, headers, body = self.request('GET', url, body_limit)
+            location = headers.get('Location')
+            if status not in REDIRECT_STATUSES or not location:
+                return status, url, headers, body
+            url = urljoin(url, location)
+        raise http.client.HTTPException('重定向次数过多')
+    
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+# 死链检查
+# 按 next_check_at 分批领取到期的书签，领取时写入租约，多个进程不会同时检查同一个书签。
+# 线程池并发探测，先发 HEAD，返回错误状态或响应无效时改用 GET（只读取响应体开头）。
+# 正常的链接 LINK_CHECK_RECHECK_INTERVAL 后复查，失败的从 LINK_CHECK_RETRY_INTERVAL 开始按失败次数加倍退避。
+LINK_CHECK_BODY_LIMIT = 64 * 1024
+
+class LinkChecker(HostThrottledClient):
+    def check(self, url):
+        current = url.strip()
+        if urlsplit(current).scheme.lower() not in ('http', 'https'):
+            return {'status': 'skipped', 'http_status': None, 'final_url': None, 'error': None}
+        try:
+            for _ in range(self.max_redirects + 1):
+                try:
+                    status, headers, _ = self.request('HEAD', current, 0)
+                except http.client.HTTPException:
+                    status, headers = None, {}
+                # 不少服务器不支持 HEAD（405、501、404等），用 GET 再确认一次
+                if status is None or status >= 400:
+                    status, headers, _ = self.request('GET', current, LINK_CHECK_BODY_LIMIT)
+                location = headers.get('Location')
+                if status in REDIRECT_STATUSES and location:
+                    current = urljoin(current, location)
+                    continue
+                break
+            else:
+                return {'status': 'error', 'http_status': status, 'final_url': current, 'error': '重定向次数过多'}
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            return {'status': 'error', 'http_status': None, 'final_url': None, 'error': str(e) or type(e).__name__}
+        
+        if 200 <= status < 300:
+            result = 'ok'
+        elif status in (408, 429) or status >= 500:
+            result = 'error'
+        else:
+            result = 'broken'
+        return {'status': result, 'http_status': status, 'final_url': current if current != url else None, 'error': None}
+
+def claim_link_checks(db, limit):
+    now = int(time.time())
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        rows = db.execute('''
+            SELECT link_checks.bookmark_id, link_checks.failures, bookmarks.url
+            FROM link_checks JOIN bookmarks ON bookmarks.id = link_checks.bookmark_id
+            WHERE link_checks.next_check_at <= ?
+            ORDER BY link_checks.next_check_at LIMIT ?
+        ''', (now, limit)).fetchall()
+        db.execute(
+            'UPDATE link_checks SET next_check_at = ? WHERE bookmark_id IN (SELECT value FROM json_each(?))',
+            (now + app.config['LINK_CHECK_LEASE'], json.dumps([row['bookmark_id'] for row in rows]))
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rows
+
+def interleave_by_host(rows):
+    # 按主机轮流排列，避免同一主机的请求集中在一起而被限速拖慢整批
+    by_host = {}
+    for row in rows:
+        by_host.setdefault(urlsplit(row['url']).netloc.lower(), []).append(row)
+    queues = list(by_host.values())
+    result = []
+    for index in range(max((len(queue) for queue in queues), default=0)):
+        result.extend(queue[index] for queue in queues if index < len(queue))
+    return result
+
+def next_link_check_at(now, result, failures):
+    if result['status'] in ('ok', 'skipped'):
+        interval = app.config['LINK_CHECK_RECHECK_INTERVAL']
+    else:
+        interval = min(app.config['LINK_CHECK_RETRY_INTERVAL'] * 2 ** failures, app.config['LINK_CHECK_RECHECK_INTERVAL'])
+    # 加入随机偏移，避免同一批书签总在同一时刻到期
+    return now + int(interval * (1 + 0.1 * random.random()))
+
+def check_due_links(db, limit=None, deadline=None):
+    stats = {'checked': 0, 'ok': 0, 'broken': 0, 'error': 0, 'skipped': 0}
+    checker = LinkChecker()
+    try:
+        with ThreadPoolExecutor(app.config['LINK_CHECK_CONCURRENCY'], thread_name_prefix='link-check') as pool:
+            while limit is None or stats['checked'] < limit:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                batch_size = app.config['LINK_CHECK_BATCH_SIZE']
+                if limit is not None:
+                    batch_size = min(batch_size, limit - stats['checked'])
+                rows = interleave_by_host(claim_link_checks(db, batch_size))
+                if not rows:
+                    break
+                
+                results = list(pool.map(checker.check, [row['url'] for row in rows]))
+                now = int(time.time())
+                updates = []
+                for row, result in zip(rows, results):
+                    failures = 0 if result['status'] in ('ok', 'skipped') else row['failures'] + 1
+                    updates.append((
+                        result['status'], result['http_status'], result['final_url'], result['error'], failures, now,
+                        next_link_check_at(now, result, row['failures']), row['bookmark_id'], row['url']
+                    ))
+                    stats[result['status']] += 1
+                stats['checked'] += len(rows)
+                # 检查期间网址被修改的书签已由触发器重置为待检查，不写入旧网址的结果
+                db.executemany('''
+                    UPDATE link_checks SET status = ?, http_status = ?, final_url = ?, error = ?, failures = ?,
+                        checked_at = ?, next_check_at = ?
+                    WHERE bookmark_id = ? AND EXISTS (SELECT 1 FROM bookmarks WHERE id = link_checks.bookmark_id AND url = ?)
+                ''', updates)
+                db.commit()
+    finally:
+        checker.close()
+    return stats
+
+# 死链：4xx，或连续出错达到 LINK_CHECK_BROKEN_AFTER 次
+BROKEN_LINK_CONDITION = "(link_checks.status = 'broken' OR (link_checks.status = 'error' AND link_checks.failures >= ?))"
+
+@app.route('/api/links/broken', methods=['GET'])
+@login_required
+def get_broken_links():
+    limit = request.args.get('limit', app.config['BOOKMARKS_MAX_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['BOOKMARKS_MAX_PAGE_SIZE']))
+    after = request.args.get('after', 0, type=int)
+    
+    rows = get_db().execute(f'''
+        SELECT {BOOKMARK_COLUMNS}, link_checks.status, link_checks.http_status, link_checks.final_url,
+               link_checks.error, link_checks.failures, link_checks.checked_at
+        FROM link_checks JOIN bookmarks ON bookmarks.id = link_checks.bookmark_id
+        WHERE {BROKEN_LINK_CONDITION} AND link_checks.bookmark_id > ?
+        ORDER BY link_checks.bookmark_id LIMIT ?
+    ''', (app.config['LINK_CHECK_BROKEN_AFTER'], after, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    links = []
+    for row in rows:
+        link = {field: row[field] for field in BOOKMARK_FIELDS}
+        link['link'] = {
+            field: row[field] for field in ('status', 'http_status', 'final_url', 'error', 'failures', 'checked_at')
+        }
+        links.append(link)
+    return jsonify({'links': links, 'next': rows[-1]['id'] if has_more else None})
+
+@app.route('/api/links/summary', methods=['GET'])
+@login_required
+def get_link_summary():
+    db = get_db()
+    counts = {row['status']: row['total'] for row in db.execute(
+        'SELECT status, COUNT(*) AS total FROM link_checks GROUP BY status'
+    )}
+    broken = db.execute(
+        f'SELECT COUNT(*) FROM link_checks WHERE {BROKEN_LINK_CONDITION}', (app.config['LINK_CHECK_BROKEN_AFTER'],)
+    ).fetchone()[0]
+    due = db.execute(
+        'SELECT COUNT(*) FROM link_checks WHERE next_check_at <= ?', (int(time.time()),)
+    ).fetchone()[0]
+    last_checked = db.execute('SELECT MAX(checked_at) FROM link_checks').fetchone()[0]
+    return jsonify({
+        'counts': counts,
+        'broken': broken,
+        'due': due,
+        'last_checked_at': last_checked,
+        'enabled': bool(app.config['LINK_CHECK_INTERVAL'])
+    })
+
+# 让指定书签（或全部书签）在下一轮立即重新检查
+@app.route('/api/links/recheck', methods=['POST'])
+@login_required
+def recheck_links():
+    data = request.get_json(silent=True) or {}
+    db = get_db()
+    if data.get('all') is True:
+        count = db.execute('UPDATE link_checks SET next_check_at = 0').rowcount
+    else:
+        ids = data.get('bookmark_ids')
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+            return jsonify({'error': '请提供 bookmark_ids 或 all'}), 400
+        if len(ids) > app.config['BATCH_MAX_ITEMS']:
+            return jsonify({'error': f"一次最多处理 {app.config['BATCH_MAX_ITEMS']} 项"}), 400
+        count = db.execute(
+            'UPDATE link_checks SET next_check_at = 0 WHERE bookmark_id IN (SELECT value FROM json_each(?))',
+            (json.dumps(ids),)
+        ).rowcount
+    db.commit()
+    return jsonify({'success': True, 'scheduled': count})
+
+@app.cli.command('check-links')
+@click.option('--limit', type=int, help='最多检查的书签数，默认检查全部到期的书签')
+@click.option('--all', 'recheck_all', is_flag=True, help='忽略复查时间，重新检查所有书签')
+@click.option('--user', 'username', help='只检查指定用户的书签，默认检查所有用户')
+def check_links_command(limit, recheck_all, username):
+    """检查书签中的死链"""
+    for user_id, name in resolve_users(username):
+        with use_user_db(user_id) as db:
+            if recheck_all:
+                db.execute('UPDATE link_checks SET next_check_at = 0')
+                db.commit()
+            start = time.time()
+            stats = check_due_links(db, limit=limit)
+        click.echo(
+            f"{name}: 检查 {stats['checked']} 个链接：正常 {stats['ok']}，死链 {stats['broken']}，"
+            f"出错 {stats['error']}，跳过 {stats['skipped']}，用时 {time.time() - start:.2f} 秒"
+        )
+
+# 网页信息和网站图标
+# 抓取新增或修改了网址的书签的网页开头，解析 <title>、描述和 <link rel="icon">，与死链检查一样分批领取、并发抓取。
+# 图标按主机去重，每个主机只下载一次，ICON_REFRESH_INTERVAL 后刷新。图标文件以内容的SHA-256命名保存在
+# ICON_CACHE_DIR，不同主机的相同图标只存一份，由 /icons/<hash> 提供并让浏览器长期缓存；
+# 总大小超过 ICON_CACHE_MAX_BYTES 时按最近使用时间（文件修改时间，访问时更新）淘汰。
+ICON_TYPES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\x00\x00\x01\x00', 'image/x-icon'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+)
+ICON_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+ICON_SIZE_PATTERN = re.compile(r'(\d+)x\d+')
+ICON_CANDIDATES = 3  # 每个主机最多尝试的图标地址数
+ICON_TOUCH_INTERVAL = 86400  # 图标被访问后最多这么久更新一次最近使用时间
+HTML_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def sniff_icon_type(data):
+    # 只接受位图格式；SVG可能包含脚本，不从本站提供
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    for magic, mimetype in ICON_TYPES:
+        if data.startswith(magic):
+            return mimetype
+    return None
+
+def site_host(url):
+    # 与浏览器中 new URL(url).host 一致：小写、国际化域名转为 punycode、省略默认端口
+    try:
+        parts = urlsplit(url.strip())
+        scheme, hostname, port = parts.scheme.lower(), parts.hostname, parts.port
+    except ValueError:
+        return None
+    if scheme not in ('http', 'https') or not hostname:
+        return None
+    try:
+        hostname = hostname.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    if ':' in hostname:
+        hostname = f'[{hostname}]'
+    if port is not None and f':{port}' != DEFAULT_PORTS[scheme]:
+        return f'{hostname}:{port}'
+    return hostname
+
+def clean_text(text, limit):
+    if not text:
+        return None
+    return WHITESPACE_PATTERN.sub(' ', text).strip()[:limit] or None
+
+def decode_html(body, charset):
+    if not charset:
+        match = HTML_CHARSET_PATTERN.search(body[:2048])
+        charset = match.group(1).decode('ascii') if match else 'utf-8'
+    try:
+        return body.decode(charset, errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
+
+# 只解析 <head>，遇到 <body> 后忽略其余内容
+class PageMetadataParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.title = None
+        self.meta = {}
+        self.icons = []  # (rel, href, sizes, type)
+        self.title_parts = None
+        self.done = False
+    
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = {name: value or '' for name, value in attrs}
+        if tag == 'title' and self.title is None:
+            self.title_parts = []
+        elif tag == 'meta':
+            key = (attrs.get('name') or attrs.get('property') or '').lower()
+            if key in ('description', 'og:description', 'og:title'):
+                self.meta.setdefault(key, attrs.get('content'))
+        elif tag == 'link':
+            rel = attrs.get('rel', '').lower().split()
+            if attrs.get('href') and ('icon' in rel or 'apple-touch-icon' in rel):
+                self.icons.append((rel, attrs['href'], attrs.get('sizes', '').lower(), attrs.get('type', '').lower()))
+        elif tag == 'body':
+            self.done = True
+    
+    def handle_endtag(self, tag):
+        if tag == 'title' and self.title_parts is not None:
+            self.title = ''.join(self.title_parts)
+            self.title_parts = None
+        elif tag == 'head':
+            self.done = True
+    
+    def handle_data(self, data):
+        if self.title_parts is not None:
+            self.title_parts.append(data)
+
+def icon_candidates(page_url, icons):
+    # 优先 rel="icon"，其中尺寸最接近32像素的排在前面，最后是 /favicon.ico
+    ranked = []
+    for rel, href, sizes, mimetype in icons:
+        if 'svg' in mimetype or urlsplit(href).path.lower().endswith('.svg'):
+            continue
+        size = max((int(n) for n in ICON_SIZE_PATTERN.findall(sizes)), default=32)
+        ranked.append(('icon' not in rel, abs(size - 32), len(ranked), href))
+    urls = []
+    for *_, href in sorted(ranked) + [(None, None, None, '/favicon.ico')]:
+        url = urljoin(page_url, href)
+        if url not in urls and urlsplit(url).scheme in ('http', 'https'):
+            urls.append(url)
+    return urls[:ICON_CANDIDATES]
+
+class MetadataFetcher(HostThrottledClient):
+    def fetch_page(self, url):
+        url = url.strip()
+        result = {'status': 'ok', 'title': None, 'description': None, 'error': None, 'icon_urls': []}
+        if urlsplit(url).scheme.lower() not in ('http', 'https'):
+            return dict(result, status='skipped')
+        # 网页取不到时仍然尝试 /favicon.ico
+        result['icon_urls'] = icon_candidates(url, [])
+        try:
+            status, final_url, headers, body = self.get(url, app.config['METADATA_PAGE_LIMIT'])
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            return dict(result, status='error', error=str(e) or type(e).__name__)
+        if not 200 <= status < 300:
+            return dict(result, status='error', error=f'HTTP {status}')
+        if headers.get_content_type() not in ('text/html', 'application/xhtml+xml'):
+            result['icon_urls'] = icon_candidates(final_url, [])
+            return result
+        
+        parser = PageMetadataParser()
+        parser.feed(decode_html(body, headers.get_content_charset()))
+        result['title'] = clean_text(parser.title or parser.meta.get('og:title'), 500)
+        result['description'] = clean_text(parser.meta.get('description') or parser.meta.get('og:description'), 1000)
+        result['icon_urls'] = icon_candidates(final_url, parser.icons)
+        return result
+    
+    # 依次尝试候选地址，返回 (图标内容, 图标地址)，都失败时返回 None
+    def fetch_icon(self, urls):
+        limit = app.config['ICON_MAX_BYTES']
+        for url in urls:
+            try:
+                status, _, _, body = self.get(url, limit + 1)
+            except (OSError, http.client.HTTPException, ValueError):
+                continue
+            if 200 <= status < 300 and len(body) <= limit and sniff_icon_type(body):
+                return body, url
+        return None
+
+def icon_path(icon_hash):
+    return os.path.join(app.config['ICON_CACHE_DIR'], icon_hash)
+
+def store_icon(data):
+    icon_hash = hashlib.sha256(data).hexdigest()
+    path = icon_path(icon_hash)
+    if os.path.exists(path):
+        os.utime(path)
+        return icon_hash
+    os.makedirs(app.config['ICON_CACHE_DIR'], exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=app.config['ICON_CACHE_DIR'], suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return icon_hash
+
+def evict_icon_cache():
+    limit = app.config['ICON_CACHE_MAX_BYTES']
+    now = time.time()
+    files = []
+    total = 0
+    try:
+        with os.scandir(app.config['ICON_CACHE_DIR']) as entries:
+            for entry in entries:
+                stat = entry.stat()
+                if ICON_HASH_PATTERN.match(entry.name):
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+                elif entry.name.endswith('.tmp') and stat.st_mtime < now - 3600:
+                    # 写入中途退出留下的临时文件
+                    os.remove(entry.path)
+    except FileNotFoundError:
+        return 0
+    if total <= limit:
+        return 0
+    
+    # 淘汰到上限的90%，避免之后每存一个图标都要淘汰
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= limit * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+def claim_page_metadata(db, limit):
+    now = int(time.time())
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        rows = db.execute('''
+            SELECT page_metadata.bookmark_id, page_metadata.failures, bookmarks.url
+            FROM page_metadata JOIN bookmarks ON bookmarks.id = page_metadata.bookmark_id
+            WHERE page_metadata.next_fetch_at <= ?
+            ORDER BY page_metadata.next_fetch_at LIMIT ?
+        ''', (now, limit)).fetchall()
+        db.execute(
+            'UPDATE page_metadata SET next_fetch_at = ? WHERE bookmark_id IN (SELECT value FROM json_each(?))',
+            (now + app.config['LINK_CHECK_LEASE'], json.dumps([row['bookmark_id'] for row in rows]))
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rows
+
+def claim_site_icons(db, limit):
+    now = int(time.time())
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        rows = db.execute(
+            'SELECT host, icon_url FROM site_icons WHERE next_fetch_at <= ? ORDER BY next_fetch_at LIMIT ?', (now, limit)
+        ).fetchall()
+        db.execute(
+            'UPDATE site_icons SET next_fetch_at = ? WHERE host IN (SELECT value FROM json_each(?))',
+            (now + app.config['LINK_CHECK_LEASE'], json.dumps([row['host'] for row in rows]))
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rows
+
+# 返回需要（重新）下载图标的主机：还没有记录、已到刷新时间，或者图标已被淘汰
+def hosts_needing_icons(db, hosts):
+    known = {row['host']: row for row in db.execute(
+        'SELECT host, icon_hash, next_fetch_at FROM site_icons WHERE host IN (SELECT value FROM json_each(?))',
+        (json.dumps(hosts),)
+    )}
+    now = int(time.time())
+    return [
+        host for host in hosts
+        if host not in known or known[host]['next_fetch_at'] <= now
+        or (known[host]['icon_hash'] and not os.path.exists(icon_path(known[host]['icon_hash'])))
+    ]
+
+def save_site_icons(db, hosts, results):
+    now = int(time.time())
+    stored = 0
+    rows = []
+    for host, result in zip(hosts, results):
+        if result is None:
+            # 没有取到图标时保留原有的图标
+            rows.append((host, None, None, now, now + app.config['ICON_RETRY_INTERVAL']))
+            continue
+        data, icon_url = result
+        rows.append((host, store_icon(data), icon_url, now, now + app.config['ICON_REFRESH_INTERVAL']))
+        stored += 1
+    db.executemany('''
+        INSERT INTO site_icons (host, icon_hash, icon_url, fetched_at, next_fetch_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (host) DO UPDATE SET
+            icon_hash = COALESCE(excluded.icon_hash, icon_hash),
+            icon_url = COALESCE(excluded.icon_url, icon_url),
+            fetched_at = excluded.fetched_at,
+            next_fetch_at = excluded.next_fetch_at
+    ''', rows)
+    return stored
+
+def fetch_due_metadata(db, limit=None, deadline=None):
+    stats = {'fetched': 0, 'ok': 0, 'error': 0, 'skipped': 0, 'icons_refreshed': 0, 'icons': 0, 'icons_evicted': 0}
+    fetcher = MetadataFetcher()
+    
+    def remaining():
+        if deadline is not None and time.monotonic() >= deadline:
+            return 0
+        batch_size = app.config['METADATA_BATCH_SIZE']
+        return batch_size if limit is None else min(batch_size, limit - stats['fetched'] - stats['icons_refreshed'])
+    
     try:
-        bookmark_ids = request.json.get('bookmark_ids', [])
-        if not bookmark_ids:
-            return jsonify({'error': '未选择书签'}), 400
+        with ThreadPoolExecutor(app.config['LINK_CHECK_CONCURRENCY'], thread_name_prefix='metadata-fetch') as pool:
+            while remaining() > 0:
+                rows = interleave_by_host(claim_page_metadata(db, remaining()))
+                if not rows:
+                    break
+                
+                pages = list(pool.map(fetcher.fetch_page, [row['url'] for row in rows]))
+                # 同一主机只取一次图标，候选地址来自该主机第一个抓取成功的网页
+                candidates = {}
+                for row, page in sorted(zip(rows, pages), key=lambda item: item[1]['status'] != 'ok'):
+                    host = site_host(row['url'])
+                    if host and page['icon_urls']:
+                        candidates.setdefault(host, page['icon_urls'])
+                hosts = hosts_needing_icons(db, list(candidates))
+                icons = list(pool.map(fetcher.fetch_icon, [candidates[host] for host in hosts]))
+                
+                now = int(time.time())
+                updates = []
+                for row, page in zip(rows, pages):
+                    if page['status'] == 'error':
+                        failures = row['failures'] + 1
+                        next_fetch_at = None
+                        if failures < app.config['METADATA_MAX_FAILURES']:
+                            next_fetch_at = now + app.config['METADATA_RETRY_INTERVAL'] * 2 ** row['failures']
+                    else:
+                        failures, next_fetch_at = 0, None
+                    updates.append((
+                        page['status'], page['title'], page['description'], page['error'], failures, now,
+                        next_fetch_at, row['bookmark_id'], row['url']
+                    ))
+                    stats[page['status']] += 1
+                stats['fetched'] += len(rows)
+                stats['icons'] += save_site_icons(db, hosts, icons)
+                # 抓取期间网址被修改的书签已由触发器重置为待抓取，不写入旧网址的结果
+                db.executemany('''
+                    UPDATE page_metadata SET status = ?, title = ?, description = ?, error = ?, failures = ?,
+                        fetched_at = ?, next_fetch_at = ?
+                    WHERE bookmark_id = ? AND EXISTS (SELECT 1 FROM bookmarks WHERE id = page_metadata.bookmark_id AND url = ?)
+                ''', updates)
+                db.commit()
             
-        db = get_db()
-        placeholders = ','.join(['?' for _ in bookmark_ids])
-        bookmarks = db.execute(
-            f'SELECT title, url, description FROM bookmarks WHERE id IN ({placeholders})',
-            bookmark_ids
+            # 刷新到期的网站图标，直接请求上次取到的图标地址
+            while remaining() > 0:
+                rows = claim_site_icons(db, remaining())
+                if not rows:
+                    break
+                hosts = [row['host'] for row in rows]
+                urls = [
+                    list(dict.fromkeys(filter(None, (row['icon_url'], f"https://{row['host']}/favicon.ico"))))
+                    for row in rows
+                ]
+                stats['icons'] += save_site_icons(db, hosts, pool.map(fetcher.fetch_icon, urls))
+                stats['icons_refreshed'] += len(rows)
+                db.commit()
+    finally:
+        fetcher.close()
+    if stats['icons']:
+        stats['icons_evicted'] = evict_icon_cache()
+    return stats
+
+@app.route('/icons/<icon_hash>')
+@login_required
+def site_icon(icon_hash):
+    if not ICON_HASH_PATTERN.match(icon_hash):
+        return jsonify({'error': '图标不存在'}), 404
+    path = icon_path(icon_hash)
+    try:
+        with open(path, 'rb') as f:
+            mimetype = sniff_icon_type(f.read(16))
+        # 记录最近使用时间，供缓存淘汰参考
+        if os.path.getmtime(path) < time.time() - ICON_TOUCH_INTERVAL:
+            os.utime(path)
+    except FileNotFoundError:
+        return jsonify({'error': '图标不存在'}), 404
+    # 地址包含内容哈希，内容不会变化
+    response = send_from_directory(
+        app.config['ICON_CACHE_DIR'], icon_hash, mimetype=mimetype, max_age=app.config['STATIC_ASSET_MAX_AGE']
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+# 主机 -> 图标哈希，前端按书签网址的主机查找图标
+@app.route('/api/site-icons', methods=['GET'])
+@login_required
+def get_site_icons():
+    db = get_db()
+    # 图标不影响数据版本号，用图标数量和最近抓取时间作为ETag
+    count, last_fetched = db.execute('SELECT COUNT(*), MAX(fetched_at) FROM site_icons').fetchone()
+    etag = f'icons-{count}-{last_fetched}-{etag_variant()}'
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify({'icons': {
+            row['host']: row['icon_hash']
+            for row in db.execute('SELECT host, icon_hash FROM site_icons WHERE icon_hash IS NOT NULL')
+        }})
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+@app.route('/api/bookmarks/<int:bookmark_id>/metadata', methods=['GET'])
+@login_required
+def get_bookmark_metadata(bookmark_id):
+    db = get_db()
+    row = db.execute('''
+        SELECT bookmarks.url, page_metadata.status, page_metadata.title, page_metadata.description,
+               page_metadata.error, page_metadata.fetched_at
+        FROM bookmarks LEFT JOIN page_metadata ON page_metadata.bookmark_id = bookmarks.id
+        WHERE bookmarks.id = ?
+    ''', (bookmark_id,)).fetchone()
+    if row is None:
+        return jsonify({'error': '书签不存在'}), 404
+    
+    host = site_host(row['url'])
+    icon = db.execute('SELECT icon_hash FROM site_icons WHERE host = ?', (host,)).fetchone() if host else None
+    return jsonify({
+        'status': row['status'],
+        'title': row['title'],
+        'description': row['description'],
+        'error': row['error'],
+        'fetched_at': row['fetched_at'],
+        'icon': url_for('site_icon', icon_hash=icon['icon_hash']) if icon and icon['icon_hash'] else None
+    })
+
+@app.cli.command('fetch-metadata')
+@click.option('--limit', type=int, help='最多抓取的书签数，默认抓取全部待抓取的书签')
+@click.option('--all', 'refetch_all', is_flag=True, help='重新抓取所有书签的网页信息')
+@click.option('--user', 'username', help='只抓取指定用户的书签，默认抓取所有用户')
+def fetch_metadata_command(limit, refetch_all, username):
+    """抓取书签的网页标题、描述和网站图标"""
+    for user_id, name in resolve_users(username):
+        with use_user_db(user_id) as db:
+            if refetch_all:
+                db.execute('UPDATE page_metadata SET next_fetch_at = 0, failures = 0')
+                db.commit()
+            start = time.time()
+            stats = fetch_due_metadata(db, limit=limit)
+        click.echo(
+            f"{name}: 抓取 {stats['fetched']} 项：成功 {stats['ok']}，失败 {stats['error']}，跳过 {stats['skipped']}，"
+            f"刷新图标 {stats['icons_refreshed']} 个网站，保存图标 {stats['icons']}，淘汰图标 {stats['icons_evicted']}，"
+            f"用时 {time.time() - start:.2f} 秒"
+        )
+
+# 变更记录
+# 客户端先不带 since 请求得到当前 revision，之后用 since=<revision> 只获取这之后的变化。
+# 同一对象在一页中的多次变化只返回最后一次，并附带对象的当前数据；对象已不存在时返回 delete。
+# 响应中 reset 为 true 表示 since 早于已压缩的日志，客户端需要重新获取全部数据。
+# 有书签变化时附带 category_counts（分类ID -> 直接包含的书签数），客户端据此更新分类计数，不必重新获取分类树。
+CHANGE_ENTITIES = {
+    'bookmark': 'SELECT id, title, url, description, category_id, position FROM bookmarks',
+    'category': 'SELECT id, name, parent_id, position FROM categories',
+}
+
+# 使用自增序列而不是 MAX(revision)，压缩删除了最新的记录后 revision 也不会倒退
+def get_current_revision(db):
+    row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return row[0] if row else 0
+
+@app.route('/api/changes', methods=['GET'])
+@login_required
+def get_changes():
+    since = request.args.get('since')
+    limit = request.args.get('limit', app.config['CHANGES_PAGE_SIZE'], type=int)
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'error': 'since 参数无效'}), 400
+        if since < 0:
+            return jsonify({'error': 'since 参数无效'}), 400
+    limit = max(1, min(limit, app.config['CHANGES_PAGE_SIZE']))
+    
+    db = get_db()
+    # 在同一个读事务中读取日志和对象数据，保证结果是一致的快照
+    db.execute('BEGIN')
+    try:
+        revision = get_current_revision(db)
+        if since is None:
+            return jsonify({'revision': revision, 'changes': [], 'has_more': False, 'reset': False})
+        
+        horizon = db.execute('SELECT horizon FROM change_log_state WHERE id = 1').fetchone()[0]
+        if since < horizon:
+            return jsonify({'revision': revision, 'changes': [], 'has_more': False, 'reset': True})
+        
+        rows = db.execute(
+            'SELECT revision, entity, entity_id FROM changes WHERE revision > ? ORDER BY revision LIMIT ?',
+            (since, limit + 1)
         ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
-        # 创建DataFrame
-        df = pd.DataFrame(bookmarks, columns=['名称', 'URL', '描述'])
+        # 每个对象只保留最后一次变化
+        latest = {}
+        for row in rows:
+            latest[(row['entity'], row['entity_id'])] = row['revision']
         
-        # 创建Excel文件
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='书签')
-            
-            # 获取工作表对象
-            worksheet = writer.sheets['书签']
+        current = {}
+        for entity, query in CHANGE_ENTITIES.items():
+            ids = [entity_id for (changed_entity, entity_id) in latest if changed_entity == entity]
+            if ids:
+                for item in db.execute(f'{query} WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids),)):
+                    current[(entity, item['id'])] = dict(item)
+        
+        category_counts = None
+        if any(entity == 'bookmark' for entity, _ in latest):
+            category_counts = {
+                row['category_id']: row['bookmark_count']
+                for row in db.execute('SELECT category_id, bookmark_count FROM category_counts WHERE bookmark_count > 0')
+            }
+    finally:
+        db.rollback()
+    
+    changes = []
+    for (entity, entity_id), change_revision in sorted(latest.items(), key=lambda item: item[1]):
+        data = current.get((entity, entity_id))
+        changes.append({
+            'revision': change_revision,
+            'type': entity,
+            'id': entity_id,
+            'action': 'upsert' if data else 'delete',
+            'data': data
+        })
+    
+    return jsonify({
+        'revision': rows[-1]['revision'] if has_more else max(revision, since),
+        'changes': changes,
+        'category_counts': category_counts,
+        'has_more': has_more,
+        'reset': False
+    })
+
+# 压缩变更日志：删除已被同一对象后续变化覆盖的记录，以及超过保留时间的删除记录
+def compact_change_log(db):
+    result = {}
+    result['superseded_deleted'] = delete_in_batches(
+        db, 'changes', 'revision',
+        'revision < (SELECT MAX(later.revision) FROM changes AS later '
+        'WHERE later.entity = changes.entity AND later.entity_id = changes.entity_id)',
+        ()
+    )
+    
+    cutoff = int(time.time()) - app.config['CHANGE_LOG_RETENTION']
+    # 先推进 horizon 再删除，中途失败也只会让客户端多做一次全量同步
+    db.execute(
+        'UPDATE change_log_state SET horizon = MAX(horizon, '
+        "(SELECT COALESCE(MAX(revision), 0) FROM changes WHERE action = 'delete' AND changed_at < ?)) "
+        'WHERE id = 1',
+        (cutoff,)
+    )
+    db.commit()
+    result['tombstones_deleted'] = delete_in_batches(
+        db, 'changes', 'revision', "action = 'delete' AND changed_at < ?", (cutoff,)
+    )
+    result['horizon'] = db.execute('SELECT horizon FROM change_log_state WHERE id = 1').fetchone()[0]
+    result['remaining'] = db.execute('SELECT COUNT(*) FROM changes').fetchone()[0]
+    return result
+
+@app.cli.command('compact-changes')
+@click.option('--user', 'username', help='只处理指定用户，默认处理所有用户')
+def compact_changes_command(username):
+    """立即压缩书签和分类的变更日志"""
+    for user_id, name in resolve_users(username):
+        with use_user_db(user_id) as db:
+            result = compact_change_log(db)
+        click.echo(f'{name}:')
+        for key, value in result.items():
+            click.echo(f'  {key}: {value}')
+
+# 数据库连接池统计，用户数据库的连接池合并为一项
+POOL_STATS_MAX_FIELDS = ('max_wait_time',)
+POOL_STATS_DERIVED_FIELDS = ('hit_rate', 'avg_wait_time')
+
+def merge_pool_snapshots(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for key, value in snapshot.items():
+            if key in POOL_STATS_MAX_FIELDS:
+                merged[key] = max(merged.get(key, 0), value)
+            elif key not in POOL_STATS_DERIVED_FIELDS:
+                merged[key] = merged.get(key, 0) + value
+    merged['hit_rate'] = merged['reused'] / merged['acquired'] if merged.get('acquired') else 0.0
+    merged['avg_wait_time'] = merged['wait_time'] / merged['waits'] if merged.get('waits') else 0.0
+    return merged
+
+@app.route('/api/pool-stats', methods=['GET'])
+@login_required
+def get_pool_stats():
+    stats = {
+        os.path.basename(path): pool.snapshot()
+        for path, pool in db_pools.items()
+    }
+    user_pools = list(user_db_pools.values())
+    if user_pools:
+        stats['users'] = dict(merge_pool_snapshots(pool.snapshot() for pool in user_pools), databases=len(user_pools))
+    return jsonify(stats)
+
+# API路由部分 - 搜索相关
+# trigram分词器只能匹配至少3个字符的词
+FTS_MIN_TERM_LENGTH = 3
+SNIPPET_CONTEXT = 30
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# 高亮匹配的关键词，返回已转义的HTML片段
+def highlight_text(text, terms, context=None):
+    if not text:
+        return ''
+    
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    
+    # 截取第一个匹配附近的文本作为摘要
+    prefix = suffix = ''
+    if context is not None:
+        match = pattern.search(text)
+        start = max((match.start() if match else 0) - context, 0)
+        end = min(start + context * 3, len(text))
+        prefix = '…' if start > 0 else ''
+        suffix = '…' if end < len(text) else ''
+        text = text[start:end]
+    
+    parts = []
+    last_end = 0
+    for match in pattern.finditer(text):
+        parts.append(str(escape(text[last_end:match.start()])))
+        parts.append(f'<mark>{escape(match.group())}</mark>')
+        last_end = match.end()
+    parts.append(str(escape(text[last_end:])))
+    
+    return prefix + ''.join(parts) + suffix
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_bookmarks():
+    query = request.args.get('q', '').strip()
+    
+    try:
+        limit = int(request.args.get('limit', app.config['SEARCH_DEFAULT_LIMIT']))
+    except ValueError:
+        return jsonify({'error': 'limit必须是整数'}), 400
+    limit = max(1, min(limit, app.config['SEARCH_MAX_LIMIT']))
+    
+    terms = query.split()
+    if not terms:
+        return jsonify({'query': query, 'results': [], 'limit': limit})
+    
+    # 长词走FTS索引并按相关度排序，短词退化为LIKE匹配
+    match_terms = [term for term in terms if len(term) >= FTS_MIN_TERM_LENGTH]
+    like_terms = [term for term in terms if len(term) < FTS_MIN_TERM_LENGTH]
+    
+    conditions = []
+    params = []
+    
+    if match_terms:
+        conditions.append('bookmarks_fts MATCH ?')
+        params.append(' '.join('"{}"'.format(term.replace('"', '""')) for term in match_terms))
+    
+    for term in like_terms:
+        conditions.append(
+            "(bookmarks_fts.title LIKE ? ESCAPE '\\' OR bookmarks_fts.url LIKE ? ESCAPE '\\' "
+            "OR bookmarks_fts.description LIKE ? ESCAPE '\\')"
+        )
+        pattern = f'%{escape_like(term)}%'
+        params.extend([pattern, pattern, pattern])
+    
+    # 标题权重最高，其次是URL
+    if match_terms:
+        order_by = 'bm25(bookmarks_fts, 10.0, 5.0, 1.0)'
+    else:
+        order_by = 'b.category_id, b.position'
+    
+    db = get_db()
+    rows = db.execute(
+        'SELECT b.id, b.title, b.url, b.description, b.category_id, b.position '
+        'FROM bookmarks_fts JOIN bookmarks AS b ON b.id = bookmarks_fts.rowid '
+        f'WHERE {" AND ".join(conditions)} ORDER BY {order_by} LIMIT ?',
+        params + [limit]
+    ).fetchall()
+    
+    results = []
+    for row in rows:
+        bookmark = dict(row)
+        bookmark['highlight'] = {
+            'title': highlight_text(row['title'], terms),
+            'url': highlight_text(row['url'], terms),
+            'description': highlight_text(row['description'], terms, context=SNIPPET_CONTEXT)
+        }
+        results.append(bookmark)
+    
+    return jsonify({'query': query, 'results': results, 'limit': limit})
+
+# 书签导出
+# 按ID列表、分类子树或整个书签库导出，从游标逐块读取并直接写入响应，内存占用与书签数量无关。
+# ID列表通过 json_each 传入，不受绑定变量数量的限制。
+# xlsx 需要在最后打包成zip，使用 xlsxwriter 的 constant_memory 模式逐行写入临时文件后再发送。
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+    'html': ('text/html; charset=utf-8', 'html'),
+}
+EXPORT_FILENAME = '书签导出'
+
+# 返回 (WHERE子句, 参数)，bookmark_ids 和 category_id 都为空时导出全部书签
+def export_filter(bookmark_ids=None, category_id=None):
+    if bookmark_ids:
+        return 'bookmarks.id IN (SELECT value FROM json_each(?))', (json.dumps(bookmark_ids),)
+    if category_id is not None:
+        return (
+            'bookmarks.category_id IN (SELECT descendant_id FROM category_tree WHERE ancestor_id = ?)',
+            (category_id,)
+        )
+    return '1', ()
+
+def iter_export_rows(db, where, params):
+    cursor = db.execute(
+        'SELECT id, title, url, description, category_id, position FROM bookmarks '
+        f'WHERE {where} ORDER BY category_id, position, id',
+        params
+    )
+    while True:
+        rows = cursor.fetchmany(app.config['STREAM_CHUNK_SIZE'])
+        if not rows:
+            break
+        yield from rows
+
+# 分类数量远小于书签数量，一次读入用于生成分类路径和文件夹结构
+def load_category_paths(db):
+    categories = {row['id']: row for row in db.execute('SELECT id, name, parent_id FROM categories')}
+    paths = {}
+    
+    def path(category_id):
+        if category_id not in paths:
+            category = categories.get(category_id)
+            if category is None:
+                paths[category_id] = ''
+            elif category['parent_id'] is None:
+                paths[category_id] = category['name']
+            else:
+                paths[category_id] = path(category['parent_id']) + '/' + category['name']
+        return paths[category_id]
+    
+    return path
+
+def export_csv(db, where, params):
+    category_path = load_category_paths(db)
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    # 带BOM，Excel才能正确识别UTF-8中文
+    buffer.write('\ufeff')
+    writer.writerow(['名称', 'URL', '描述', '分类'])
+    for count, row in enumerate(iter_export_rows(db, where, params), 1):
+        writer.writerow([row['title'], row['url'], row['description'] or '', category_path(row['category_id'])])
+        if count % app.config['STREAM_CHUNK_SIZE'] == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_jsonl(db, where, params):
+    category_path = load_category_paths(db)
+    for row in iter_export_rows(db, where, params):
+        yield json.dumps({
+            'id': row['id'],
+            'title': row['title'],
+            'url': row['url'],
+            'description': row['description'],
+            'category': category_path(row['category_id']),
+        }, ensure_ascii=False) + '\n'
+
+# Netscape书签格式，分类按层级输出为文件夹，可直接导入浏览器
+def export_html(db, where, params, root_id=None, prune=False):
+    children = {}
+    names = {}
+    for row in db.execute('SELECT id, name, parent_id FROM categories ORDER BY position, id'):
+        children.setdefault(row['parent_id'], []).append(row['id'])
+        names[row['id']] = row['name']
+    
+    # 按ID导出时省略不包含所选书签的文件夹
+    included = None
+    if prune:
+        included = {row[0] for row in db.execute(
+            'SELECT DISTINCT ancestor_id FROM category_tree WHERE descendant_id IN '
+            f'(SELECT DISTINCT category_id FROM bookmarks WHERE {where})',
+            params
+        )}
+    
+    yield (
+        '<!DOCTYPE NETSCAPE-Bookmark-file-1>\n'
+        '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">\n'
+        '<TITLE>Bookmarks</TITLE>\n<H1>Bookmarks</H1>\n<DL><p>\n'
+    )
+    
+    # 用显式栈做深度优先遍历，避免分类层级过深时递归溢出
+    stack = [('open', category_id) for category_id in reversed([root_id] if root_id else children.get(None, []))]
+    while stack:
+        action, category_id = stack.pop()
+        if action == 'close':
+            yield '</DL><p>\n'
+            continue
+        if included is not None and category_id not in included:
+            continue
+        
+        yield f'<DT><H3>{escape(names[category_id])}</H3>\n<DL><p>\n'
+        cursor = db.execute(
+            f'SELECT title, url, description FROM bookmarks WHERE category_id = ? AND {where} ORDER BY position, id',
+            (category_id, *params)
+        )
+        while True:
+            rows = cursor.fetchmany(app.config['STREAM_CHUNK_SIZE'])
+            if not rows:
+                break
+            chunk = []
+            for row in rows:
+                chunk.append(f'<DT><A HREF="{escape(row["url"])}">{escape(row["title"])}</A>\n')
+                if row['description']:
+                    chunk.append(f'<DD>{escape(row["description"])}\n')
+            yield ''.join(chunk)
+        
+        stack.append(('close', category_id))
+        stack.extend(('open', child) for child in reversed(children.get(category_id, [])))
+    
+    yield '</DL><p>\n'
+
+def export_xlsx(db, where, params, output):
+    from xlsxwriter import Workbook
+    
+    category_path = load_category_paths(db)
+    workbook = Workbook(output, {'constant_memory': True, 'in_memory': False})
+    worksheet = workbook.add_worksheet('书签')
+    
+    # 设置列宽
+    worksheet.set_column('A:A', 30)  # 名称列
+    worksheet.set_column('B:B', 50)  # URL列
+    worksheet.set_column('C:C', 40)  # 描述列
+    worksheet.set_column('D:D', 20)  # 分类列
+    
+    bold = workbook.add_format({'bold': True})
+    worksheet.write_row(0, 0, ['名称', 'URL', '描述', '分类'], bold)
+    for row_number, row in enumerate(iter_export_rows(db, where, params), 1):
+        # 使用 write_string，避免URL被自动转换为超链接（每个工作表最多65530个）
+        worksheet.write_string(row_number, 0, row['title'])
+        worksheet.write_string(row_number, 1, row['url'])
+        worksheet.write_string(row_number, 2, row['description'] or '')
+        worksheet.write_string(row_number, 3, category_path(row['category_id']))
+    workbook.close()
+
+@app.route('/api/bookmarks/export', methods=['GET', 'POST'])
+@login_required
+def export_bookmarks():
+    # POST 使用JSON请求体，GET 使用查询参数（便于直接作为下载链接）
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+    else:
+        data = request.args.to_dict()
+        if data.get('bookmark_ids'):
+            data['bookmark_ids'] = data['bookmark_ids'].split(',')
+    
+    export_format = str(data.get('format', 'xlsx')).lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"不支持的导出格式，可选: {', '.join(EXPORT_FORMATS)}"}), 400
+    
+    bookmark_ids = data.get('bookmark_ids') or []
+    category_id = data.get('category_id')
+    export_all = str(data.get('all', '')).lower() in ('1', 'true')
+    try:
+        bookmark_ids = [int(bookmark_id) for bookmark_id in bookmark_ids]
+        category_id = int(category_id) if category_id not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': '书签ID或分类ID无效'}), 400
+    if not bookmark_ids and category_id is None and not export_all:
+        return jsonify({'error': '未选择书签'}), 400
+    
+    db = get_db()
+    if category_id is not None and find_missing_ids(db, 'categories', [category_id]):
+        return jsonify({'error': '分类不存在'}), 404
+    
+    where, params = export_filter(bookmark_ids, category_id)
+    content_type, extension = EXPORT_FORMATS[export_format]
+    download_name = f'{EXPORT_FILENAME}.{extension}'
+    
+    if export_format == 'xlsx':
+        output = tempfile.TemporaryFile()
+        try:
+            export_xlsx(db, where, params, output)
+        except Exception as e:
+            output.close()
+            return jsonify({'error': str(e)}), 500
+        output.seek(0)
+        return send_file(output, mimetype=content_type, as_attachment=True, download_name=download_name)
+    
+    if export_format == 'html':
+        chunks = export_html(db, where, params, root_id=category_id, prune=bool(bookmark_ids))
+    elif export_format == 'csv':
+        chunks = export_csv(db, where, params)
+    else:
+        chunks = export_jsonl(db, where, params)
+    
+    # 格式表中已经带有字符集，用 content_type 原样使用，mimetype 会再追加一次 charset
+    response = Response(stream_with_context(chunks), content_type=content_type)
+    response.headers['Content-Disposition'] = (
+        f"attachment; filename=bookmarks.{extension}; filename*=UTF-8''{quote(download_name)}"
+    )
+    return response
+
+# 书签导入
+# 逐块解析浏览器导出的书签HTML（Netscape格式）、CSV和XLSX，每条记录为 (文件夹路径, 标题, URL, 描述)。
+# 文件夹映射为分类（同名分类直接复用），记录按 IMPORT_BATCH_SIZE 分批在一个事务中写入，
+# 内存占用只与批大小有关。每批写完后产生一次进度。
+IMPORT_FORMATS = {'.html': 'html', '.htm': 'html', '.csv': 'csv', '.xlsx': 'xlsx'}
+IMPORT_DEFAULT_CATEGORY = '导入的书签'
+IMPORT_READ_SIZE = 64 * 1024
+
+# CSV/XLSX表头的可选名称，导出文件的中文表头也能直接导入
+IMPORT_COLUMNS = {
+    'title': ('title', 'name', '名称', '标题'),
+    'url': ('url', 'href', 'link', '链接'),
+    'description': ('description', 'desc', '描述'),
+    'category': ('category', 'folder', '分类', '文件夹'),
+}
+
+class NetscapeBookmarkParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.folders = []  # 每层<DL>对应的文件夹名，根层为None
+        self.pending_folder = None
+        self.bookmark = None  # 尚未输出的书签，后面可能还有<DD>描述
+        self.text = None
+        self.text_target = None
+    
+    def path(self):
+        return tuple(name for name in self.folders if name)
+    
+    def flush_bookmark(self):
+        if self.bookmark:
+            path, title, url, description = self.bookmark
+            self.records.append((path, title.strip(), url, description.strip()))
+            self.bookmark = None
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in ('dt', 'dl', 'h3', 'a'):
+            self.end_text()
+        if tag == 'dl':
+            self.flush_bookmark()
+            self.folders.append(self.pending_folder)
+            self.pending_folder = None
+        elif tag == 'h3':
+            self.flush_bookmark()
+            self.start_text('folder')
+        elif tag == 'a':
+            self.flush_bookmark()
+            self.bookmark = [self.path(), '', dict(attrs).get('href') or '', '']
+            self.start_text('title')
+        elif tag == 'dd' and self.bookmark:
+            self.start_text('description')
+    
+    def handle_endtag(self, tag):
+        if tag in ('h3', 'a'):
+            self.end_text()
+        elif tag == 'dl':
+            self.end_text()
+            self.flush_bookmark()
+            if self.folders:
+                self.folders.pop()
+    
+    def handle_data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+    
+    def start_text(self, target):
+        self.text = []
+        self.text_target = target
+    
+    def end_text(self):
+        if self.text is None:
+            return
+        text = ''.join(self.text)
+        if self.text_target == 'folder':
+            self.pending_folder = text.strip()
+        elif self.text_target == 'title' and self.bookmark:
+            self.bookmark[1] = text
+        elif self.text_target == 'description' and self.bookmark:
+            self.bookmark[3] = text
+        self.text = None
+        self.text_target = None
+
+def iter_html_records(stream):
+    parser = NetscapeBookmarkParser()
+    text = TextIOWrapper(stream, encoding='utf-8', errors='replace')
+    while True:
+        chunk = text.read(IMPORT_READ_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        yield from parser.records
+        parser.records = []
+    parser.close()
+    parser.end_text()
+    parser.flush_bookmark()
+    yield from parser.records
+
+# 根据表头找到各字段所在的列
+def map_import_columns(header):
+    names = [str(name).strip().lower() if name is not None else '' for name in header]
+    columns = {}
+    for field, aliases in IMPORT_COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                columns[field] = names.index(alias)
+                break
+    if 'url' not in columns:
+        raise ValueError('找不到URL列')
+    return columns
+
+def iter_table_records(rows):
+    columns = None
+    for row in rows:
+        if columns is None:
+            columns = map_import_columns(row)
+            continue
+        
+        def value(field):
+            index = columns.get(field)
+            if index is None or index >= len(row) or row[index] is None:
+                return ''
+            return str(row[index]).strip()
+        
+        # 多级分类用 / 分隔，例如 "工作/文档"
+        path = tuple(name.strip() for name in value('category').split('/') if name.strip())
+        yield path, value('title'), value('url'), value('description')
+
+def iter_csv_records(stream):
+    text = TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    yield from iter_table_records(csv.reader(text))
+
+def iter_xlsx_records(stream):
+    from openpyxl import load_workbook
+    
+    # 只读模式按行读取，不把整个工作簿载入内存
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from iter_table_records(workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+IMPORT_READERS = {
+    'html': iter_html_records,
+    'csv': iter_csv_records,
+    'xlsx': iter_xlsx_records,
+}
+
+def detect_import_format(filename, import_format=None):
+    if import_format:
+        return import_format.lower() if import_format.lower() in IMPORT_READERS else None
+    return IMPORT_FORMATS.get(os.path.splitext(filename or '')[1].lower())
+
+# 按名称查找或创建分类，结果缓存在 categories 中
+def resolve_import_category(db, path, root_id, categories, stats):
+    category_id = root_id
+    for name in path:
+        key = (category_id, name)
+        if key not in categories:
+            row = db.execute(
+                'SELECT id FROM categories WHERE parent_id IS ? AND name = ? ORDER BY position LIMIT 1',
+                (category_id, name)
+            ).fetchone()
+            if row:
+                categories[key] = row['id']
+            else:
+                cursor = db.execute(
+                    'INSERT INTO categories (name, parent_id, position) '
+                    'SELECT ?, ?, COALESCE(MAX(position), 0) + ? FROM categories WHERE parent_id IS ?',
+                    (name, category_id, POSITION_GAP, category_id)
+                )
+                categories[key] = cursor.lastrowid
+                stats['categories'] += 1
+        category_id = categories[key]
+    return category_id
+
+def import_bookmarks(db, records, category_id=None, dedupe=True):
+    stats = {'processed': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'categories': 0}
+    categories = {}
+    records = iter(records)
+    
+    while True:
+        batch = list(islice(records, app.config['IMPORT_BATCH_SIZE']))
+        if not batch:
+            break
+        
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            canonical_urls = [normalize_url(url) if url else None for _, _, url, _ in batch]
+            existing = set()
+            if dedupe:
+                existing = {row[0] for row in db.execute(
+                    'SELECT canonical_url FROM bookmarks WHERE canonical_url IN (SELECT value FROM json_each(?))',
+                    (json.dumps([url for url in canonical_urls if url]),)
+                )}
             
-            # 设置列宽
-            worksheet.set_column('A:A', 30)  # 名称列
-            worksheet.set_column('B:B', 50)  # URL列
-            worksheet.set_column('C:C', 40)  # 描述列
+            next_positions = {}
+            rows = []
+            for (path, title, url, description), canonical_url in zip(batch, canonical_urls):
+                stats['processed'] += 1
+                if not url:
+                    stats['invalid'] += 1
+                    continue
+                if canonical_url in existing:
+                    stats['duplicates'] += 1
+                    continue
+                if dedupe:
+                    existing.add(canonical_url)
+                
+                # 不在任何文件夹中的书签放入目标分类，未指定时放入默认分类
+                if not path and category_id is None:
+                    path = (IMPORT_DEFAULT_CATEGORY,)
+                target_id = resolve_import_category(db, path, category_id, categories, stats)
+                
+                if target_id not in next_positions:
+                    next_positions[target_id] = db.execute(
+                        'SELECT COALESCE(MAX(position), 0) FROM bookmarks WHERE category_id = ?',
+                        (target_id,)
+                    ).fetchone()[0]
+                next_positions[target_id] += POSITION_GAP
+                rows.append((
+                    title or url, url, description or None, target_id, next_positions[target_id], canonical_url
+                ))
             
-        output.seek(0)
+            db.executemany(
+                'INSERT INTO bookmarks (title, url, description, category_id, position, canonical_url) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
         
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name='书签导出.xlsx'
-        )
+        stats['imported'] += len(rows)
+        yield dict(stats)
+
+@app.route('/api/bookmarks/import', methods=['POST'])
+@login_required
+def import_bookmarks_file():
+    file = request.files.get('file')
+    if not file:
+        return jsonify({'error': '未选择文件'}), 400
+    
+    import_format = detect_import_format(file.filename, request.form.get('format'))
+    if not import_format:
+        return jsonify({'error': '不支持的文件格式，请上传HTML、CSV或XLSX文件'}), 400
+    
+    category_id = request.form.get('category_id', type=int)
+    if category_id is not None and find_missing_ids(get_db(), 'categories', [category_id]):
+        return jsonify({'error': '目标分类不存在'}), 404
+    
+    dedupe = request.form.get('dedupe', 'true').lower() != 'false'
+    progress = import_bookmarks(
+        get_db(), IMPORT_READERS[import_format](file.stream), category_id=category_id, dedupe=dedupe
+    )
+    
+    # progress=true 时每写完一批输出一行JSON进度
+    if request.form.get('progress', 'false').lower() == 'true':
+        def generate():
+            stats = None
+            try:
+                for stats in progress:
+                    yield json.dumps(stats) + '\n'
+            except Exception as e:
+                yield json.dumps({'error': str(e)}, ensure_ascii=False) + '\n'
+                return
+            yield json.dumps(dict(stats or {}, done=True)) + '\n'
         
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    stats = {'processed': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'categories': 0}
+    try:
+        for stats in progress:
+            pass
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        # 文件内容无效（缺少URL列、不是有效的XLSX等），已写入的批次保留
+        return jsonify({'error': str(e), **stats}), 400
+    
+    log_event(logging.INFO, 'bookmarks_imported', format=import_format, **stats)
+    return jsonify({'success': True, **stats})
+
+@app.cli.command('import-bookmarks')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'import_format', type=click.Choice(sorted(IMPORT_READERS)), help='文件格式，默认按扩展名判断')
+@click.option('--category-id', type=int, help='导入到指定分类下')
+@click.option('--no-dedupe', is_flag=True, help='不跳过URL已存在的书签')
+@click.option('--user', 'username', help='导入到指定用户，默认为第一个用户（管理员）')
+def import_bookmarks_command(path, import_format, category_id, no_dedupe, username):
+    """从浏览器导出的书签HTML、CSV或XLSX文件导入书签"""
+    import_format = detect_import_format(path, import_format)
+    if not import_format:
+        raise click.UsageError('不支持的文件格式，请使用 --format 指定')
+    users = resolve_users(username)
+    if not users:
+        raise click.UsageError('还没有用户，请先注册或用 flask create-user 创建')
+    user_id = users[0][0]
+    
+    start = time.time()
+    with use_user_db(user_id) as db, open(path, 'rb') as stream:
+        if category_id is not None and find_missing_ids(db, 'categories', [category_id]):
+            raise click.UsageError('目标分类不存在')
+        progress = import_bookmarks(
+            db, IMPORT_READERS[import_format](stream), category_id=category_id, dedupe=not no_dedupe
+        )
+        for stats in progress:
+            click.echo(
+                f"已处理 {stats['processed']} 条，导入 {stats['imported']} 条，"
+                f"重复 {stats['duplicates']} 条，无效 {stats['invalid']} 条，新建分类 {stats['categories']} 个"
+            )
+    click.echo(f'完成，用时 {time.time() - start:.2f} 秒')
+
+CSS_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+def minify_asset(path, content):
+    import rcssmin
+    import rjsmin
+    if path.endswith('.css'):
+        return rcssmin.cssmin(content.decode('utf-8')).encode('utf-8')
+    if path.endswith('.js'):
+        return rjsmin.jsmin(content.decode('utf-8')).encode('utf-8')
+    return content
+
+def rewrite_css_urls(path, content, manifest):
+    # CSS中引用的字体等资源换成构建后的文件名，保持相对路径
+    base = posixpath.dirname(path)
+    def replace(match):
+        reference = match.group(2)
+        target = posixpath.normpath(posixpath.join(base, reference.split('?')[0].split('#')[0]))
+        if target not in manifest:
+            return match.group(0)
+        return f'url("{posixpath.relpath(manifest[target], base or ".")}")'
+    return CSS_URL_PATTERN.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+def build_assets(static_folder):
+    dist = os.path.join(static_folder, ASSET_DIST_DIR)
+    sources = []
+    for directory, subdirectories, files in os.walk(static_folder):
+        if directory == static_folder and ASSET_DIST_DIR in subdirectories:
+            subdirectories.remove(ASSET_DIST_DIR)
+        for name in files:
+            if name.endswith(ASSET_EXTENSIONS):
+                sources.append(os.path.relpath(os.path.join(directory, name), static_folder).replace(os.sep, '/'))
+    # 先处理被CSS引用的字体，再处理CSS和JS
+    sources.sort(key=lambda path: (not path.endswith('.woff2'), path))
+    
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+    stats = []
+    for path in sources:
+        with open(os.path.join(static_folder, path), 'rb') as f:
+            original = f.read()
+        content = minify_asset(path, original)
+        if path.endswith('.css'):
+            content = rewrite_css_urls(path, content, manifest)
+        
+        stem, extension = posixpath.splitext(path)
+        built = f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+        target = os.path.join(dist, built)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(content)
+        
+        # woff2 本身已经压缩，不再生成gzip副本
+        compressed_size = None
+        if not path.endswith('.woff2'):
+            compressed = gzip.compress(content, 9, mtime=0)
+            if len(compressed) < len(content):
+                with open(target + '.gz', 'wb') as f:
+                    f.write(compressed)
+                compressed_size = len(compressed)
+        manifest[path] = built
+        stats.append((path, built, len(original), len(content), compressed_size))
+    
+    # 清单最后写入，构建中途失败时不会引用不完整的文件
+    with open(os.path.join(dist, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return stats
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """压缩静态资源，生成带内容哈希的文件、gzip副本和清单"""
+    for path, built, original, minified, compressed in build_assets(app.static_folder):
+        click.echo(
+            f'{path} -> {ASSET_DIST_DIR}/{built}: {original} -> {minified} 字节'
+            + (f'，gzip {compressed} 字节' if compressed else '')
+        )
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False) 
\ No newline at end of file
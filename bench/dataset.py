@@ -0,0 +1,214 @@
+"""生成用于基准测试的合成书签库
+
+同样的参数和随机种子总是生成完全相同的数据。分类按层级随机嵌套（保证至少有一条链达到指定深度），
+书签在分类之间按长尾分布，少数分类很大，便于测量大分类中的拖拽排序和分页；约2%的书签是已有网址的变体，
+约5%的书签带有死链或出错的检查结果，每个网站都有缓存的图标。
+
+    python bench/dataset.py --bookmarks 100000 --categories 5000 --depth 6 --output /tmp/bookmarks.sqlite
+"""
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {
+    'small': {'bookmarks': 10000, 'categories': 500, 'depth': 4},
+    'large': {'bookmarks': 100000, 'categories': 5000, 'depth': 6},
+}
+
+WORDS = [
+    'python', 'flask', 'sqlite', 'docker', 'linux', 'rust', 'golang', 'react', 'design', 'database',
+    'network', 'security', 'cloud', 'search', 'cache', 'index', 'music', 'travel', 'recipe', 'finance',
+    '文档', '教程', '工具', '新闻', '博客', '设计', '学习', '开发', '视频', '音乐',
+]
+INSERT_BATCH = 10000
+# 一小部分书签重复收藏已有的网址，只在协议、www.、末尾斜杠或跟踪参数上不同
+DUPLICATE_RATE = 0.02
+DUPLICATE_VARIANTS = [
+    lambda url: url + '/',
+    lambda url: url.replace('https://', 'http://www.', 1),
+    lambda url: url + '?utm_source=newsletter',
+]
+# 模拟已经检查过一轮的死链检查结果：(状态, HTTP状态码, 连续失败次数, 占比)
+LINK_CHECK_RESULTS = [
+    ('broken', 404, 1, 0.03),
+    ('error', 503, 2, 0.01),
+    ('error', None, 1, 0.01),
+]
+
+def dataset_name(app_module, bookmarks, categories, depth, seed):
+    # 数据库结构升级后重新生成，避免每次复制后都在副本上执行迁移
+    version = len(app_module.BOOKMARKS_MIGRATIONS)
+    return f'bookmarks-{bookmarks}-{categories}-{depth}-{seed}-v{version}.sqlite'
+
+def generate_categories(rng, count, depth):
+    # 返回 (id, parent_id, depth) 列表，父分类总是排在子分类之前
+    categories = []
+    for category_id in range(1, count + 1):
+        if category_id <= depth:
+            # 先建一条达到最大深度的链
+            parent = categories[-1] if categories else None
+        elif rng.random() < 0.1:
+            parent = None
+        else:
+            parent = rng.choice(categories)
+            if parent[2] >= depth - 1:
+                parent = None
+        level = parent[2] + 1 if parent else 0
+        categories.append((category_id, parent[0] if parent else None, level))
+    return categories
+
+def text(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+def build_dataset(app_module, path, bookmarks, categories, depth, seed=42):
+    """用应用自身的建表和迁移逻辑创建 path，并写入合成数据"""
+    rng = random.Random(seed)
+    app = app_module.app
+    original_path = app.config['DATABASE']
+    app.config['DATABASE'] = path
+    try:
+        with app.app_context():
+            db = app_module.get_db()
+            gap = app_module.POSITION_GAP
+
+            category_rows = generate_categories(rng, categories, depth)
+            positions = {}
+            db.execute('BEGIN IMMEDIATE')
+            for category_id, parent_id, _ in category_rows:
+                positions[parent_id] = positions.get(parent_id, 0) + gap
+                db.execute(
+                    'INSERT INTO categories (id, name, parent_id, position) VALUES (?, ?, ?, ?)',
+                    (category_id, f'{text(rng, 1)} {category_id}', parent_id, positions[parent_id])
+                )
+            db.commit()
+
+            # 长尾分布：排名第 k 的分类权重为 1 / k
+            category_ids = [row[0] for row in category_rows]
+            rng.shuffle(category_ids)
+            weights = [1 / rank for rank in range(1, len(category_ids) + 1)]
+
+            positions = {}
+            urls = []
+            for start in range(0, bookmarks, INSERT_BATCH):
+                size = min(INSERT_BATCH, bookmarks - start)
+                rows = []
+                for offset, category_id in enumerate(rng.choices(category_ids, weights, k=size)):
+                    bookmark_id = start + offset + 1
+                    positions[category_id] = positions.get(category_id, 0) + gap
+                    if urls and rng.random() < DUPLICATE_RATE:
+                        url = rng.choice(DUPLICATE_VARIANTS)(rng.choice(urls))
+                    else:
+                        url = f'https://site{rng.randrange(2000)}.example.com/{rng.choice(WORDS)}/{bookmark_id}'
+                    urls.append(url)
+                    rows.append((
+                        bookmark_id,
+                        f'{text(rng, 3)} {bookmark_id}',
+                        url,
+                        text(rng, rng.randrange(0, 12)) or None,
+                        category_id,
+                        positions[category_id],
+                        app_module.normalize_url(url),
+                    ))
+                db.execute('BEGIN IMMEDIATE')
+                db.executemany(
+                    'INSERT INTO bookmarks (id, title, url, description, category_id, position, canonical_url) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+                db.commit()
+
+            checked_at = 1700000000
+            link_rows = []
+            for bookmark_id in range(1, bookmarks + 1):
+                roll = rng.random()
+                status, http_status, failures = 'ok', 200, 0
+                for candidate, candidate_status, candidate_failures, rate in LINK_CHECK_RESULTS:
+                    if roll < rate:
+                        status, http_status, failures = candidate, candidate_status, candidate_failures
+                        break
+                    roll -= rate
+                link_rows.append((status, http_status, failures, checked_at, checked_at + rng.randrange(7 * 86400), bookmark_id))
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany(
+                'UPDATE link_checks SET status = ?, http_status = ?, failures = ?, checked_at = ?, next_check_at = ? '
+                'WHERE bookmark_id = ?',
+                link_rows
+            )
+            db.commit()
+
+            # 网页信息都已抓取，每个主机都有图标
+            db.execute('BEGIN IMMEDIATE')
+            db.execute("UPDATE page_metadata SET status = 'ok', fetched_at = ?, next_fetch_at = NULL", (checked_at,))
+            hosts = sorted({app_module.site_host(url) for url in urls})
+            db.executemany(
+                'INSERT INTO site_icons (host, icon_hash, icon_url, fetched_at, next_fetch_at) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (host, hashlib.sha256(host.encode()).hexdigest(), f'https://{host}/favicon.ico',
+                     checked_at, checked_at + 30 * 86400)
+                    for host in hosts
+                ]
+            )
+            db.commit()
+
+            # 生成过程中的变化不算作历史记录
+            db.execute('DELETE FROM changes')
+            db.commit()
+            db.execute('VACUUM')
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        app.config['DATABASE'] = original_path
+        pool = app_module.db_pools.pop(path, None)
+        if pool is not None:
+            pool.close_all()
+
+def ensure_dataset(app_module, cache_dir, bookmarks, categories, depth, seed=42):
+    """返回缓存的数据集路径，不存在时生成"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, dataset_name(app_module, bookmarks, categories, depth, seed))
+    if not os.path.exists(path):
+        partial = path + '.partial'
+        for leftover in (partial, partial + '-wal', partial + '-shm'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        build_dataset(app_module, partial, bookmarks, categories, depth, seed)
+        os.replace(partial, path)
+    return path
+
+def copy_dataset(source, target):
+    """用SQLite备份接口复制数据集，得到一个可以随意修改的副本"""
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), help='使用预设的数据规模')
+    parser.add_argument('--bookmarks', type=int, default=PROFILES['large']['bookmarks'])
+    parser.add_argument('--categories', type=int, default=PROFILES['large']['categories'])
+    parser.add_argument('--depth', type=int, default=PROFILES['large']['depth'])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', required=True, help='输出的数据库文件')
+    args = parser.parse_args()
+    if args.profile:
+        vars(args).update(PROFILES[args.profile])
+
+    # 导入应用时不要在实例目录中建库
+    os.environ.setdefault('FLASK_DATABASE', os.path.join(tempfile.gettempdir(), 'bench-unused.sqlite'))
+    os.environ.setdefault('FLASK_AUTH_MAINTENANCE_INTERVAL', '0')
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    if os.path.exists(args.output):
+        parser.error(f'{args.output} 已存在')
+    build_dataset(app_module, args.output, args.bookmarks, args.categories, args.depth, args.seed)
+    print(f'已生成 {args.output}: {args.bookmarks} 个书签，{args.categories} 个分类，最大深度 {args.depth}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,550 @@
+"""书签管理器基准测试
+
+在合成书签库（见 dataset.py）的副本上，通过 Flask 测试客户端依次调用每个 /api/* 接口以及登录限流，
+输出每个场景的 p50/p95/p99 延迟、吞吐量和单次请求的内存峰值。
+指定 --http 时还会启动本地 Gunicorn 服务，用多个并发连接对只读接口施压。
+
+    python bench/run.py                          # small 规模，与 bench/baselines.json 对比
+    python bench/run.py --profile large          # 10万书签、5000个分类、6层嵌套
+    python bench/run.py --http --concurrency 16  # 追加并发HTTP压测
+    python bench/run.py --save-baseline          # 用本次结果更新基准
+
+任何场景的 p95 比基准慢超过 --tolerance（默认50%）时返回非零退出码。
+"""
+import argparse
+import csv
+import http.cookiejar
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+from dataset import PROFILES, copy_dataset, ensure_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'bookmark-bench-datasets')
+USERNAME = 'bench'
+PASSWORD = 'Bench-Passw0rd'
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(latencies, elapsed):
+    values = sorted(latencies)
+    return {
+        'iterations': len(values),
+        'p50_ms': percentile(values, 0.50) * 1000,
+        'p95_ms': percentile(values, 0.95) * 1000,
+        'p99_ms': percentile(values, 0.99) * 1000,
+        'mean_ms': statistics.fmean(values) * 1000,
+        'throughput': len(values) / elapsed if elapsed else 0.0,
+    }
+
+class Context:
+    """场景共享的状态：数据集中的ID、随机数生成器，以及场景自己创建的对象"""
+
+    def __init__(self, app_module, seed):
+        self.app_module = app_module
+        self.rng = random.Random(seed)
+        with app_module.app.app_context():
+            db = app_module.get_db()
+            self.categories = [tuple(row) for row in db.execute('SELECT id, parent_id FROM categories')]
+            self.roots = [category_id for category_id, parent_id in self.categories if parent_id is None]
+            self.category_ids = [category_id for category_id, _ in self.categories]
+            self.max_bookmark_id = db.execute('SELECT MAX(id) FROM bookmarks').fetchone()[0]
+            # 书签最多的分类，用于测量大分类中的拖拽排序
+            self.big_category, self.big_category_size = db.execute(
+                'SELECT category_id, COUNT(*) FROM bookmarks GROUP BY category_id ORDER BY 2 DESC LIMIT 1'
+            ).fetchone()
+            # 有兄弟分类的分类，用于测量分类移动
+            self.sibling_groups = [
+                [row[0] for row in db.execute(
+                    'SELECT id FROM categories WHERE parent_id IS ? ORDER BY position', (parent_id,)
+                )]
+                for parent_id in {parent_id for _, parent_id in self.categories}
+            ]
+            self.sibling_groups = [group for group in self.sibling_groups if len(group) > 1]
+            self.big_category_ids = [row[0] for row in db.execute(
+                'SELECT id FROM bookmarks WHERE category_id = ?', (self.big_category,)
+            )]
+        self.created_bookmarks = []
+        self.created_categories = []
+        self.etags = {}
+        self.next_ip = 0
+
+    def bookmark_id(self):
+        return self.rng.randint(1, self.max_bookmark_id)
+
+    def category_id(self):
+        return self.rng.choice(self.category_ids)
+
+    def new_ip(self):
+        self.next_ip += 1
+        return f'10.{self.next_ip // 65536 % 256}.{self.next_ip // 256 % 256}.{self.next_ip % 256}'
+
+# 场景：名称 -> (函数, 迭代次数系数)。函数返回测试客户端的响应，结果会被完整读取
+SCENARIOS = {}
+
+def scenario(name, weight=1.0, expect=(200,)):
+    def register(f):
+        SCENARIOS[name] = (f, weight, expect)
+        return f
+    return register
+
+@scenario('categories_list')
+def categories_list(client, ctx):
+    return client.get('/api/categories')
+
+@scenario('categories_list_304', expect=(304,))
+def categories_list_304(client, ctx):
+    if 'categories' not in ctx.etags:
+        ctx.etags['categories'] = client.get('/api/categories').headers['ETag']
+    return client.get('/api/categories', headers={'If-None-Match': ctx.etags['categories']})
+
+@scenario('tree')
+def tree(client, ctx):
+    return client.get('/api/tree')
+
+@scenario('tree_with_bookmarks', weight=0.2)
+def tree_with_bookmarks(client, ctx):
+    return client.get('/api/tree?bookmarks=5')
+
+@scenario('bookmarks_page')
+def bookmarks_page(client, ctx):
+    return client.get(f'/api/bookmarks?category_id={ctx.category_id()}&limit=100')
+
+@scenario('bookmarks_subtree_page')
+def bookmarks_subtree_page(client, ctx):
+    root = ctx.rng.choice(ctx.roots)
+    return client.get(f'/api/bookmarks?category_id={root}&include_subcategories=true&limit=200')
+
+@scenario('bookmarks_stream_all', weight=0.05)
+def bookmarks_stream_all(client, ctx):
+    return client.get('/api/bookmarks')
+
+@scenario('bookmarks_stream_columnar', weight=0.05)
+def bookmarks_stream_columnar(client, ctx):
+    return client.get('/api/bookmarks?format=columnar&hosts=true', headers={'Accept-Encoding': 'gzip'})
+
+@scenario('search')
+def search(client, ctx):
+    from dataset import WORDS
+    return client.get(f'/api/search?q={ctx.rng.choice(WORDS)}')
+
+@scenario('search_short_term')
+def search_short_term(client, ctx):
+    return client.get(f'/api/search?q={ctx.rng.choice(["py", "学习", "io", "设计"])}')
+
+@scenario('changes')
+def changes(client, ctx):
+    revision = client.get('/api/changes').get_json()['revision']
+    return client.get(f'/api/changes?since={max(0, revision - 50)}')
+
+@scenario('duplicates_report')
+def duplicates_report(client, ctx):
+    return client.get('/api/bookmarks/duplicates')
+
+@scenario('links_broken')
+def links_broken(client, ctx):
+    return client.get('/api/links/broken')
+
+@scenario('links_summary')
+def links_summary(client, ctx):
+    return client.get('/api/links/summary')
+
+@scenario('site_icons')
+def site_icons(client, ctx):
+    return client.get('/api/site-icons')
+
+@scenario('bookmark_metadata', expect=(200, 404))
+def bookmark_metadata(client, ctx):
+    return client.get(f'/api/bookmarks/{ctx.bookmark_id()}/metadata')
+
+@scenario('pool_stats')
+def pool_stats(client, ctx):
+    return client.get('/api/pool-stats')
+
+@scenario('metrics')
+def metrics(client, ctx):
+    return client.get('/metrics')
+
+@scenario('create_bookmark', expect=(201,))
+def create_bookmark(client, ctx):
+    response = client.post('/api/bookmarks', json={
+        'title': f'bench {ctx.rng.random()}',
+        'url': f'https://bench.example.com/{ctx.rng.random()}',
+        'category_id': ctx.category_id(),
+    })
+    ctx.created_bookmarks.append(response.get_json()['id'])
+    return response
+
+@scenario('update_bookmark')
+def update_bookmark(client, ctx):
+    bookmark_id = ctx.bookmark_id()
+    return client.put(f'/api/bookmarks/{bookmark_id}', json={
+        'title': f'updated {bookmark_id}',
+        'url': f'https://updated.example.com/{bookmark_id}',
+        'category_id': ctx.category_id(),
+    })
+
+@scenario('delete_bookmark', expect=(200, 404))
+def delete_bookmark(client, ctx):
+    bookmark_id = ctx.created_bookmarks.pop() if ctx.created_bookmarks else ctx.bookmark_id()
+    return client.delete(f'/api/bookmarks/{bookmark_id}')
+
+@scenario('update_bookmark_position')
+def update_bookmark_position(client, ctx):
+    # 在最大的分类中随机拖拽
+    bookmark_id, before_id = ctx.rng.sample(ctx.big_category_ids, 2)
+    return client.put(f'/api/bookmarks/{bookmark_id}/position', json={
+        'before_id': before_id,
+        'category_id': ctx.big_category,
+    })
+
+@scenario('reorder_bookmarks')
+def reorder_bookmarks(client, ctx):
+    ids = ctx.rng.sample(ctx.big_category_ids, 20)
+    return client.post('/api/bookmarks/reorder', json={'bookmarks': [
+        {'id': bookmark_id, 'position': (index + 1) * 1024, 'category_id': ctx.big_category}
+        for index, bookmark_id in enumerate(ids)
+    ]})
+
+@scenario('move_bookmarks')
+def move_bookmarks(client, ctx):
+    ids = {ctx.bookmark_id() for _ in range(50)}
+    # 不移动最大分类中的书签，保持拖拽场景的数据稳定
+    ids -= set(ctx.big_category_ids)
+    return client.post('/api/bookmarks/move', json={
+        'bookmark_ids': sorted(ids),
+        'target_category_id': ctx.category_id(),
+    })
+
+@scenario('create_category', expect=(201,))
+def create_category(client, ctx):
+    response = client.post('/api/categories', json={
+        'name': f'bench {ctx.rng.random()}',
+        'parent_id': ctx.rng.choice(ctx.roots),
+    })
+    ctx.created_categories.append(response.get_json()['id'])
+    return response
+
+@scenario('update_category')
+def update_category(client, ctx):
+    category_id = ctx.category_id()
+    return client.put(f'/api/categories/{category_id}', json={'name': f'renamed {category_id}'})
+
+@scenario('move_category')
+def move_category(client, ctx):
+    group = ctx.rng.choice(ctx.sibling_groups)
+    category_id, target_id = ctx.rng.sample(group, 2)
+    with ctx.app_module.app.app_context():
+        parent_id, position = ctx.app_module.get_db().execute(
+            'SELECT parent_id, position FROM categories WHERE id = ?', (target_id,)
+        ).fetchone()
+    return client.post(f'/api/categories/{category_id}/move', json={'parent_id': parent_id, 'position': position})
+
+@scenario('reorder_categories')
+def reorder_categories(client, ctx):
+    group = ctx.rng.choice(ctx.sibling_groups)
+    parent_id = next(parent for category_id, parent in ctx.categories if category_id == group[0])
+    order = ctx.rng.sample(group, len(group))
+    return client.post('/api/categories/reorder', json={'categories': [
+        {'id': category_id, 'position': (index + 1) * 1024, 'parent_id': parent_id}
+        for index, category_id in enumerate(order)
+    ]})
+
+@scenario('delete_category', expect=(200, 400))
+def delete_category(client, ctx):
+    if not ctx.created_categories:
+        create_category(client, ctx)
+    return client.delete(f'/api/categories/{ctx.created_categories.pop()}')
+
+@scenario('export_csv_subtree', weight=0.2)
+def export_csv_subtree(client, ctx):
+    return client.get(f'/api/bookmarks/export?category_id={ctx.rng.choice(ctx.roots)}&format=csv')
+
+@scenario('export_xlsx_selection', weight=0.2)
+def export_xlsx_selection(client, ctx):
+    ids = [ctx.bookmark_id() for _ in range(2000)]
+    return client.post('/api/bookmarks/export', json={'bookmark_ids': ids, 'format': 'xlsx'})
+
+@scenario('export_html_all', weight=0.05)
+def export_html_all(client, ctx):
+    return client.post('/api/bookmarks/export', json={'all': True, 'format': 'html'})
+
+@scenario('import_csv', weight=0.2)
+def import_csv(client, ctx):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['title', 'url', 'category'])
+    batch = ctx.rng.random()
+    for index in range(500):
+        writer.writerow([f'imported {index}', f'https://import.example.com/{batch}/{index}', f'导入/{index % 10}'])
+    data = {'file': (io.BytesIO(buffer.getvalue().encode()), 'bench.csv')}
+    return client.post('/api/bookmarks/import', data=data, content_type='multipart/form-data')
+
+@scenario('login_failure')
+def login_failure(client, ctx):
+    # 每次使用新的IP，测量未被限流时的登录失败路径
+    return client.post(
+        '/login', data={'username': 'nobody', 'password': 'wrong'},
+        environ_base={'REMOTE_ADDR': ctx.new_ip()}
+    )
+
+@scenario('login_throttled', expect=(200, 429))
+def login_throttled(client, ctx):
+    # 同一个IP反复失败，大部分请求会被限流直接拒绝
+    return client.post(
+        '/login', data={'username': 'nobody', 'password': 'wrong'},
+        environ_base={'REMOTE_ADDR': '192.0.2.1'}
+    )
+
+def run_scenarios(app_module, client, names, iterations, seed):
+    ctx = Context(app_module, seed)
+    results = {}
+    for name in names:
+        f, weight, expect = SCENARIOS[name]
+        count = max(10, int(iterations * weight))
+
+        # 预热一次，不计入结果
+        f(client, ctx).get_data()
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(count):
+            request_started = time.perf_counter()
+            response = f(client, ctx)
+            response.get_data()
+            latencies.append(time.perf_counter() - request_started)
+            if response.status_code not in expect:
+                raise RuntimeError(f'{name}: 意外的状态码 {response.status_code}: {response.get_data()[:200]!r}')
+        result = summarize(latencies, time.perf_counter() - started)
+
+        # 单独执行一次测量内存峰值，避免 tracemalloc 影响计时
+        tracemalloc.start()
+        f(client, ctx).get_data()
+        result['peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+        results[name] = result
+        print(format_result(name, result), flush=True)
+    return results
+
+def format_result(name, result):
+    return (
+        f"  {name:<28} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+        f"p99 {result['p99_ms']:8.2f} ms  {result['throughput']:8.1f} 次/秒"
+        + (f"  峰值 {result['peak_kb']:8.0f} KB" if 'peak_kb' in result else '')
+    )
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def run_http_load(env, names, concurrency, duration, seed):
+    """启动本地 Gunicorn，用 concurrency 个线程在 duration 秒内并发请求只读接口"""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=ROOT, env=dict(env, BIND=f'127.0.0.1:{port}', WEB_ACCESS_LOG='/dev/null'),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                urllib.request.urlopen(f'{base}/login', timeout=1).read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError('Gunicorn 未能启动')
+                time.sleep(0.2)
+
+        cookies = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+        opener.open(f'{base}/login', data=f'username={USERNAME}&password={PASSWORD}'.encode()).read()
+        cookie = '; '.join(f'{c.name}={c.value}' for c in cookies)
+
+        with urllib.request.urlopen(urllib.request.Request(f'{base}/api/categories', headers={'Cookie': cookie})) as r:
+            category_ids = [category['id'] for category in json.load(r)]
+        paths = {
+            'categories_list': lambda rng: '/api/categories',
+            'tree': lambda rng: '/api/tree',
+            'bookmarks_page': lambda rng: f'/api/bookmarks?category_id={rng.choice(category_ids)}&limit=100',
+            'search': lambda rng: f'/api/search?q={quote(rng.choice(["python", "文档", "cache", "学习"]))}',
+        }
+        names = [name for name in names if name in paths] or list(paths)
+
+        results = {}
+        for name in names:
+            latencies = []
+            errors = []
+            lock = threading.Lock()
+            stop_at = time.monotonic() + duration
+
+            def worker(worker_seed):
+                rng = random.Random(worker_seed)
+                local = []
+                while time.monotonic() < stop_at:
+                    request = urllib.request.Request(base + paths[name](rng), headers={'Cookie': cookie})
+                    started = time.perf_counter()
+                    try:
+                        with urllib.request.urlopen(request, timeout=30) as response:
+                            response.read()
+                    except Exception as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    local.append(time.perf_counter() - started)
+                with lock:
+                    latencies.extend(local)
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=worker, args=(seed + i,)) for i in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if not latencies:
+                raise RuntimeError(f'http_{name}: 全部请求失败: {errors[:3]}')
+            result = summarize(latencies, time.perf_counter() - started)
+            result['errors'] = len(errors)
+            results[f'http_{name}'] = result
+            print(format_result(f'http_{name}', result) + (f'  错误 {len(errors)}' if errors else ''), flush=True)
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        # 亚毫秒级的场景抖动很大，同时要求超出一个绝对值
+        limit = max(expected['p95_ms'] * (1 + tolerance), expected['p95_ms'] + min_delta_ms)
+        if result['p95_ms'] > limit:
+            regressions.append(f"{name}: p95 {result['p95_ms']:.2f} ms，基准 {expected['p95_ms']:.2f} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small', help='数据规模')
+    parser.add_argument('--iterations', type=int, default=50, help='每个场景的基本迭代次数')
+    parser.add_argument('--scenario', action='append', help='只运行指定场景，可重复')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--http', action='store_true', help='追加针对本地 Gunicorn 的并发HTTP压测')
+    parser.add_argument('--concurrency', type=int, default=8, help='HTTP压测的并发连接数')
+    parser.add_argument('--duration', type=float, default=5, help='每个HTTP压测场景的持续时间（秒）')
+    parser.add_argument('--baseline', default=BASELINES, help='基准文件')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='p95 允许比基准慢的比例')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help='p95 至少比基准慢多少毫秒才算回归')
+    parser.add_argument('--save-baseline', action='store_true', help='用本次结果更新基准文件')
+    parser.add_argument('--output', help='把结果以JSON写入该文件')
+    args = parser.parse_args()
+
+    names = args.scenario or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}；可选: {', '.join(SCENARIOS)}")
+
+    work_dir = tempfile.mkdtemp(prefix='bookmark-bench-')
+    env = {
+        'FLASK_DATABASE': os.path.join(work_dir, 'bookmarks.sqlite'),
+        'FLASK_AUTH_DATABASE': os.path.join(work_dir, 'auth.sqlite'),
+        'FLASK_METRICS_DIR': os.path.join(work_dir, 'metrics'),
+        'FLASK_AUTH_MAINTENANCE_INTERVAL': '0',
+        'FLASK_LOG_LEVEL': 'WARNING',
+        'FLASK_SECRET_KEY': 'bench',
+    }
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from werkzeug.security import generate_password_hash
+
+    try:
+        profile = PROFILES[args.profile]
+        started = time.perf_counter()
+        dataset = ensure_dataset(
+            app_module, CACHE_DIR, profile['bookmarks'], profile['categories'], profile['depth'], args.seed
+        )
+        copy_dataset(dataset, env['FLASK_DATABASE'])
+        print(
+            f"数据集: {profile['bookmarks']} 个书签，{profile['categories']} 个分类，{profile['depth']} 层"
+            f"（准备用时 {time.perf_counter() - started:.1f} 秒）"
+        )
+
+        app = app_module.app
+        with app.app_context():
+            auth_db = app_module.get_auth_db()
+            auth_db.execute(
+                'INSERT INTO users (username, password) VALUES (?, ?)',
+                (USERNAME, generate_password_hash(PASSWORD))
+            )
+            auth_db.commit()
+            user_id = auth_db.execute('SELECT id FROM users WHERE username = ?', (USERNAME,)).fetchone()[0]
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+
+        print(f'场景（基本迭代次数 {args.iterations}）:')
+        results = run_scenarios(app_module, client, names, args.iterations, args.seed)
+        if args.http:
+            print(f'HTTP压测（{args.concurrency} 个并发连接，每个场景 {args.duration} 秒）:')
+            results.update(run_http_load(env, args.scenario or [], args.concurrency, args.duration, args.seed))
+        peak_rss_mb = peak_rss()
+        print(f'进程内存峰值: {peak_rss_mb:.1f} MB')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'profile': args.profile, 'peak_rss_mb': peak_rss_mb, 'results': results}, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baseline = baselines.setdefault(args.profile, {})
+        for name, result in results.items():
+            baseline[name] = {'p50_ms': round(result['p50_ms'], 3), 'p95_ms': round(result['p95_ms'], 3)}
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write('\n')
+        print(f'已更新基准: {args.baseline}')
+        return 0
+
+    regressions = compare(results, baselines.get(args.profile, {}), args.tolerance, args.min_delta_ms)
+    for regression in regressions:
+        print(f'回归: {regression}', file=sys.stderr)
+    if not baselines.get(args.profile):
+        print(f'没有 {args.profile} 规模的基准，使用 --save-baseline 生成')
+    return 1 if regressions else 0
+
+def peak_rss():
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / 1024 if sys.platform == 'darwin' else maxrss / 1024
+
+if __name__ == '__main__':
+    sys.exit(main())
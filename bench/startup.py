@@ -0,0 +1,119 @@
+"""测量冷启动：导入应用耗时、处理第一个请求的耗时和常驻内存
+
+每次在新的Python进程中导入 app.py 并用测试客户端发出第一个请求，重复多次后输出中位数。
+默认复用同一个已初始化的数据库（模拟容器重启、增加工作进程），--fresh 则每次使用空数据库。
+
+    python bench/startup.py --runs 10
+    python bench/startup.py --max-first-request-ms 500 --max-rss-mb 80  # 超过阈值时返回非零退出码
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行，输出一行JSON
+PROBE = '''
+import json
+import os
+import sys
+import time
+
+start = time.perf_counter()
+sys.path.insert(0, os.environ['BENCH_ROOT'])
+import app as bookmark_app
+imported = time.perf_counter()
+
+response = bookmark_app.app.test_client().get('/login')
+first_request = time.perf_counter()
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / 1024 if sys.platform == 'darwin' else maxrss / 1024
+
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (first_request - imported) * 1000,
+    'rss_mb': rss_mb(),
+    'modules': len(sys.modules),
+    'status': response.status_code,
+}))
+'''
+
+def run_probe(instance_dir):
+    env = dict(
+        os.environ,
+        BENCH_ROOT=ROOT,
+        FLASK_DATABASE=os.path.join(instance_dir, 'bookmarks.sqlite'),
+        FLASK_AUTH_DATABASE=os.path.join(instance_dir, 'auth.sqlite'),
+        FLASK_AUTH_MAINTENANCE_INTERVAL='0',
+    )
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE], env=env, cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    # 包含解释器自身启动的总耗时，即进程启动到第一个请求完成
+    result['process_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='重复次数')
+    parser.add_argument('--fresh', action='store_true', help='每次使用空数据库，包含建表和迁移的耗时')
+    parser.add_argument('--max-first-request-ms', type=float, help='进程启动到第一个请求完成的耗时上限')
+    parser.add_argument('--max-rss-mb', type=float, help='常驻内存上限')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+    
+    results = []
+    with tempfile.TemporaryDirectory() as shared_dir:
+        if not args.fresh:
+            # 先初始化一次数据库，之后的每次启动都是对已有数据库的“重启”
+            run_probe(shared_dir)
+        for _ in range(args.runs):
+            if args.fresh:
+                with tempfile.TemporaryDirectory() as instance_dir:
+                    results.append(run_probe(instance_dir))
+            else:
+                results.append(run_probe(shared_dir))
+    
+    summary = {
+        key: statistics.median(result[key] for result in results)
+        for key in ('import_ms', 'first_request_ms', 'process_ms', 'rss_mb', 'modules')
+    }
+    
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"运行次数: {args.runs}（{'空数据库' if args.fresh else '已有数据库'}），以下为中位数")
+        print(f"  导入应用:           {summary['import_ms']:8.1f} ms")
+        print(f"  第一个请求:         {summary['first_request_ms']:8.1f} ms")
+        print(f"  进程启动到首个响应: {summary['process_ms']:8.1f} ms")
+        print(f"  常驻内存:           {summary['rss_mb']:8.1f} MB")
+        print(f"  已加载模块:         {summary['modules']:8.0f}")
+    
+    failures = []
+    if args.max_first_request_ms is not None and summary['process_ms'] > args.max_first_request_ms:
+        failures.append(f"首个响应耗时 {summary['process_ms']:.1f} ms 超过 {args.max_first_request_ms} ms")
+    if args.max_rss_mb is not None and summary['rss_mb'] > args.max_rss_mb:
+        failures.append(f"常驻内存 {summary['rss_mb']:.1f} MB 超过 {args.max_rss_mb} MB")
+    for failure in failures:
+        print(f'回归: {failure}', file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# Gunicorn 生产环境配置
+# 所有参数都可以通过环境变量调整，见 docker-compose.yml
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# 监听地址
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# 预先fork的工作进程数，以及每个进程内处理请求的线程数
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+
+# 请求超时：工作进程超过该时间无响应会被重启
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+
+# 收到 SIGTERM / SIGHUP 后，等待正在处理的请求完成的时间
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+
+# HTTP keep-alive 连接保持时间
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+
+# 处理一定数量的请求后重启工作进程，0表示不重启
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0))
+
+# 不在主进程中预加载应用：每个工作进程各自导入应用并打开自己的SQLite连接，
+# 避免fork后多个进程共用同一个数据库连接。
+# 数据库迁移在启动工作进程之前由主进程（在子进程中执行 flask migrate）完成一次，工作进程启动时只检查版本；
+# 之后新建的用户数据库由工作进程在第一次访问时迁移，每一步都在写锁下的同一个事务中执行。
+preload_app = False
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('WEB_LOG_LEVEL', 'info')
+
+# 各工作进程的请求指标快照目录（与应用的 METRICS_DIR 配置一致），启动时清空上次运行留下的快照
+metrics_dir = os.environ.get(
+    'FLASK_METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics')
+)
+
+def on_starting(server):
+    # 设置 FLASK_AUTO_MIGRATE=false 时跳过，由管理员手动执行 flask migrate
+    if os.environ.get('FLASK_AUTO_MIGRATE', 'true').lower() not in ('false', '0'):
+        subprocess.run(
+            [sys.executable, '-m', 'flask', '--app', 'app', 'migrate'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        )
+    
+    if not os.path.isdir(metrics_dir):
+        return
+    for filename in os.listdir(metrics_dir):
+        if filename.endswith(('.json', '.tmp')):
+            try:
+                os.remove(os.path.join(metrics_dir, filename))
+            except OSError:
+                pass
+
+# 工作进程退出（max_requests 重启、HUP 重载或崩溃）后，把它最后的快照并入 exited.json 并删除快照文件，
+# 快照文件数不随重启次数增长，/metrics 中的计数也不会因为进程退出而减少。child_exit 在主进程中依次调用，不会并发写入
+def merge_snapshot(total, snapshot):
+    for name, series in snapshot.items():
+        merged = {tuple(labels): value for labels, value in total.get(name, [])}
+        for labels, value in series:
+            labels = tuple(labels)
+            current = merged.get(labels)
+            if current is None:
+                merged[labels] = value
+            elif isinstance(value, list):
+                merged[labels] = [a + b for a, b in zip(current, value)]
+            else:
+                merged[labels] = current + value
+        total[name] = [[list(labels), value] for labels, value in merged.items()]
+    return total
+
+def child_exit(server, worker):
+    path = os.path.join(metrics_dir, f'{worker.pid}.json')
+    aggregate_path = os.path.join(metrics_dir, 'exited.json')
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        server.log.warning('无法读取工作进程 %s 的指标快照: %s', worker.pid, e)
+        snapshot = {}
+    
+    try:
+        with open(aggregate_path) as f:
+            total = json.load(f)
+    except FileNotFoundError:
+        total = {}
+    except (OSError, ValueError) as e:
+        server.log.warning('无法读取已退出进程的指标: %s', e)
+        total = {}
+    
+    try:
+        with open(aggregate_path + '.tmp', 'w') as f:
+            json.dump(merge_snapshot(total, snapshot), f)
+        os.replace(aggregate_path + '.tmp', aggregate_path)
+        os.remove(path)
+    except OSError as e:
+        server.log.warning('合并工作进程 %s 的指标快照失败: %s', worker.pid, e)
@@ -2,14 +2,18 @@
 const state = {
     categories: [],
     bookmarks: [],
-    allBookmarks: [],  // 存储所有书签的全局列表(用于搜索)
     currentCategory: null,
     selectedBookmarks: new Set(),
     draggedCategory: null,
     draggedBookmark: null,
     searchMode: false,
     searchResults: [],
+    searchQuery: '',
+    searchTimer: null,
+    searchLimit: 200,
     categoryToMove: null,
+    revision: null,  // 已同步到的变更记录版本
+    siteIcons: {},  // 主机 -> 网站图标哈希
     expandedCategories: new Set(),  // 存储展开的分类ID
     pagination: {
         currentPage: 1,
@@ -44,6 +48,8 @@ const elements = {
     // 按钮
     addCategoryBtn: document.getElementById('add-category-btn'),
     addBookmarkHeaderBtn: document.getElementById('add-bookmark-header-btn'),
+    importBookmarksBtn: document.getElementById('import-bookmarks-btn'),
+    importFileInput: document.getElementById('import-file-input'),
     openSelectedBtn: document.getElementById('open-selected-btn'),
     moveSelectedBtn: document.getElementById('move-selected-btn'),
     deleteSelectedBtn: document.getElementById('delete-selected-btn'),
@@ -73,14 +79,13 @@ document.addEventListener('DOMContentLoaded', async () => {
         // 初始化事件监听
         initEventListeners();
         
+        // 先记录当前版本再获取数据，之后的修改通过增量同步获取
+        await Promise.all([fetchRevision(), fetchSiteIcons()]);
+        
         // 首先获取所有分类
         await fetchCategories();
         console.log('已获取所有分类');
         
-        // 获取所有书签用于全局搜索
-        await fetchAllBookmarks();
-        console.log('已获取所有书签用于搜索');
-        
         // 隐藏所有上下文菜单的事件
         document.addEventListener('click', hideContextMenus);
         
@@ -103,6 +108,18 @@ function initEventListeners() {
         showBookmarkModal();
     });
     
+    // 导入书签
+    elements.importBookmarksBtn.addEventListener('click', () => {
+        elements.importFileInput.click();
+    });
+    elements.importFileInput.addEventListener('change', (e) => {
+        const file = e.target.files[0];
+        e.target.value = '';
+        if (file) {
+            importBookmarks(file);
+        }
+    });
+    
     // 搜索相关
     elements.searchInput.addEventListener('input', handleSearchInput);
     elements.searchBtn.addEventListener('click', handleExternalSearch);
@@ -192,6 +209,13 @@ function initEventListeners() {
         hideContextMenus();
     });
     
+    document.getElementById('export-category').addEventListener('click', () => {
+        const categoryId = elements.categoryContextMenu.dataset.categoryId;
+        // 导出为浏览器书签文件（含子目录），由浏览器直接下载
+        window.location.href = `/api/bookmarks/export?category_id=${categoryId}&format=html`;
+        hideContextMenus();
+    });
+    
     document.getElementById('delete-category').addEventListener('click', () => {
         const categoryId = elements.categoryContextMenu.dataset.categoryId;
         const category = state.categories.find(c => c.id == categoryId);
@@ -298,21 +322,11 @@ function handleSearchInput(e) {
     
     // 进入搜索模式
     state.searchMode = true;
+    state.searchQuery = query;
     
-    // 确保先获取所有书签，再进行搜索
-    (async () => {
-        // 如果没有全局书签列表，先获取全部书签
-        if (!state.allBookmarks || state.allBookmarks.length === 0) {
-            await fetchAllBookmarks();
-        }
-        
-        // 全局搜索所有书签，无论当前选中的是哪个分类
-        const results = searchBookmarks(query);
-        state.searchResults = results;
-        
-        // 渲染搜索结果
-        renderSearchResults();
-    })();
+    // 输入停顿后再请求服务端搜索，避免每次按键都发请求
+    clearTimeout(state.searchTimer);
+    state.searchTimer = setTimeout(() => searchBookmarks(query), 200);
 }
 
 function handleExternalSearch() {
@@ -323,19 +337,35 @@ function handleExternalSearch() {
     }
 }
 
-function searchBookmarks(query) {
-    // 确保使用全局书签列表进行搜索
-    if (!state.allBookmarks || state.allBookmarks.length === 0) {
-        console.warn('全局书签列表为空，无法进行搜索');
-        return [];
+async function searchBookmarks(query) {
+    try {
+        const url = new URL('/api/search', window.location.origin);
+        url.searchParams.append('q', query);
+        url.searchParams.append('limit', state.searchLimit);
+        
+        const response = await fetch(url);
+        if (!response.ok) throw new Error('搜索书签失败');
+        
+        const data = await response.json();
+        
+        // 忽略过期的搜索结果
+        if (!state.searchMode || data.query !== state.searchQuery) {
+            return;
+        }
+        
+        state.searchResults = data.results;
+        renderSearchResults();
+    } catch (error) {
+        console.error('搜索书签失败:', error);
+        showError('搜索书签失败');
+    }
+}
+
+// 书签变化后刷新当前的搜索结果
+function refreshSearchResults() {
+    if (state.searchMode && state.searchQuery) {
+        searchBookmarks(state.searchQuery);
     }
-    
-    // 在全局书签列表中搜索匹配项
-    return state.allBookmarks.filter(bookmark => 
-        bookmark.title.toLowerCase().includes(query) || 
-        bookmark.url.toLowerCase().includes(query) || 
-        (bookmark.description && bookmark.description.toLowerCase().includes(query))
-    );
 }
 
 function renderSearchResults() {
@@ -395,6 +425,14 @@ function renderSearchResults() {
         
         for (const bookmark of groupedResults[categoryId]) {
             const bookmarkElement = createBookmarkElement(bookmark);
+            
+            // 显示服务端返回的高亮片段（已转义）
+            if (bookmark.highlight) {
+                bookmarkElement.querySelector('.bookmark-title-text').innerHTML = bookmark.highlight.title;
+                bookmarkElement.querySelector('.bookmark-description').innerHTML =
+                    bookmark.highlight.description || bookmark.highlight.url;
+            }
+            
             bookmarkGrid.appendChild(bookmarkElement);
         }
         
@@ -416,35 +454,30 @@ function getCurrentSearchEngineName() {
 
 function exitSearchMode() {
     state.searchMode = false;
+    state.searchQuery = '';
+    clearTimeout(state.searchTimer);
     elements.searchResultsContainer.classList.remove('active');
     elements.bookmarksContainer.style.display = 'flex';
     elements.searchInput.value = '';
 }
 
-// 获取所有书签（用于搜索）
-async function fetchAllBookmarks() {
-    try {
-        // 使用不带分类筛选的API调用，获取所有书签
-        const response = await fetch('/api/bookmarks');
-        if (!response.ok) throw new Error('获取书签失败');
-        
-        // 保存到全局书签列表
-        state.allBookmarks = await response.json();
-        console.log(`成功获取所有书签，共 ${state.allBookmarks.length} 个`);
-    } catch (error) {
-        console.error('获取全部书签失败:', error);
-        showError('获取书签失败');
-    }
-}
-
 // API 请求函数
 async function fetchCategories() {
     try {
-        const response = await fetch('/api/categories');
+        const response = await fetch('/api/tree');
         if (!response.ok) {
             throw new Error('获取分类失败');
         }
-        const categories = await response.json();
+        const data = await response.json();
+        
+        // 把嵌套的分类树展开为列表，同级分类保持服务器返回的顺序
+        const categories = [];
+        const pending = [...data.tree];
+        while (pending.length > 0) {
+            const { children, ...category } = pending.shift();
+            categories.push(category);
+            pending.push(...children);
+        }
         state.categories = categories;
         
         // 移除自动折叠的代码，保持原有的展开状态
@@ -455,9 +488,169 @@ async function fetchCategories() {
     }
 }
 
+async function fetchRevision() {
+    try {
+        const response = await fetch('/api/changes');
+        if (response.ok) {
+            state.revision = (await response.json()).revision;
+        }
+    } catch (error) {
+        console.error('获取版本失败:', error);
+    }
+}
+
+// 网站图标由服务端抓取并缓存，按书签网址的主机查找
+async function fetchSiteIcons() {
+    try {
+        const response = await fetch('/api/site-icons');
+        if (response.ok) {
+            state.siteIcons = (await response.json()).icons;
+        }
+    } catch (error) {
+        console.error('获取网站图标失败:', error);
+    }
+}
+
+function siteIconUrl(url) {
+    try {
+        const hash = state.siteIcons[new URL(url).host];
+        return hash ? `/icons/${hash}` : null;
+    } catch (error) {
+        return null;
+    }
+}
+
+// 增量同步：只获取上次同步之后变化的书签和分类，更新本地状态
+async function syncChanges() {
+    try {
+        if (state.revision === null) {
+            return await reloadAll();
+        }
+        
+        let hasMore = true;
+        let categoriesChanged = false;
+        let categoryCounts = null;
+        while (hasMore) {
+            const response = await fetch(`/api/changes?since=${state.revision}`);
+            if (!response.ok) {
+                throw new Error('获取变更失败');
+            }
+            const data = await response.json();
+            if (data.reset) {
+                return await reloadAll();
+            }
+            data.changes.forEach(applyChange);
+            categoriesChanged = categoriesChanged || data.changes.some(change => change.type === 'category');
+            categoryCounts = data.category_counts || categoryCounts;
+            state.revision = data.revision;
+            hasMore = data.has_more;
+        }
+        
+        state.categories.sort((a, b) => a.position - b.position);
+        state.bookmarks.sort((a, b) => a.category_id - b.category_id || a.position - b.position || a.id - b.id);
+        if (state.currentCategory && !state.categories.some(c => c.id == state.currentCategory)) {
+            state.currentCategory = null;
+            renderCategoryTitle();
+        }
+        renderBookmarks();
+        
+        // 只有分类本身变化时才重新获取分类树；书签变化只影响计数，用变更中附带的各分类书签数更新
+        if (categoriesChanged) {
+            await fetchCategories();
+        } else if (categoryCounts) {
+            applyCategoryCounts(categoryCounts);
+            renderCategories();
+        }
+    } catch (error) {
+        console.error('同步失败:', error);
+        await reloadAll();
+    }
+}
+
+async function reloadAll() {
+    await fetchRevision();
+    await fetchCategories();
+    if (state.currentCategory) {
+        await fetchBookmarks(state.currentCategory);
+    }
+}
+
+function applyChange(change) {
+    const list = change.type === 'category' ? state.categories : state.bookmarks;
+    const index = list.findIndex(item => item.id == change.id);
+    
+    // 书签只保留属于当前分类（主目录包括其子目录）的
+    const visible = change.action === 'upsert' &&
+        (change.type === 'category' || isInCurrentCategory(change.data.category_id));
+    
+    if (!visible) {
+        if (index !== -1) {
+            list.splice(index, 1);
+        }
+        if (change.type === 'bookmark') {
+            state.selectedBookmarks.delete(change.id);
+        }
+    } else if (index !== -1) {
+        list[index] = change.data;
+    } else {
+        list.push(change.data);
+    }
+}
+
+// counts 是各分类直接包含的书签数，子树的总数沿父分类向上累加
+function applyCategoryCounts(counts) {
+    const byId = new Map(state.categories.map(category => [category.id, category]));
+    state.categories.forEach(category => {
+        category.bookmark_count = counts[category.id] || 0;
+        category.total_count = 0;
+    });
+    state.categories.forEach(category => {
+        for (let node = category; node; node = byId.get(node.parent_id)) {
+            node.total_count += category.bookmark_count;
+        }
+    });
+}
+
+function isInCurrentCategory(categoryId) {
+    if (!state.currentCategory) {
+        return false;
+    }
+    if (categoryId == state.currentCategory) {
+        return true;
+    }
+    const current = state.categories.find(c => c.id == state.currentCategory);
+    if (!current || current.parent_id) {
+        return false;
+    }
+    const category = state.categories.find(c => c.id == categoryId);
+    return Boolean(category && category.parent_id == current.id);
+}
+
+// 把列式响应还原为对象数组；URL 按主机做了字典编码时拼回完整地址
+function decodeColumnar(data) {
+    const { url_host: urlHosts, ...columns } = data.columns;
+    const fields = Object.keys(columns);
+    const count = fields.length > 0 ? columns[fields[0]].length : 0;
+    const items = new Array(count);
+    for (let i = 0; i < count; i++) {
+        const item = {};
+        for (const field of fields) {
+            item[field] = columns[field][i];
+        }
+        if (urlHosts && urlHosts[i] !== null) {
+            item.url = data.hosts[urlHosts[i]] + item.url;
+        }
+        items[i] = item;
+    }
+    return items;
+}
+
 async function fetchBookmarks(categoryId = null) {
     try {
         const url = new URL('/api/bookmarks', window.location.origin);
+        // 使用列式格式，省去每个书签重复的字段名和URL主机
+        url.searchParams.append('format', 'columnar');
+        url.searchParams.append('hosts', 'true');
         if (categoryId) {
             url.searchParams.append('category_id', categoryId);
             // 如果是主目录，则包含子目录的书签
@@ -472,7 +665,7 @@ async function fetchBookmarks(categoryId = null) {
             throw new Error('获取书签失败');
         }
         
-        state.bookmarks = await response.json();
+        state.bookmarks = decodeColumnar(await response.json());
         renderBookmarks();
     } catch (error) {
         console.error('获取书签失败:', error);
@@ -608,7 +801,10 @@ async function createBookmark(title, url, description, categoryId) {
             throw new Error(data.error || '创建书签失败');
         }
         
-        const newBookmark = await response.json();
+        const { duplicate, ...newBookmark } = await response.json();
+        if (duplicate) {
+            showToast(`已存在相同网址的书签：${duplicate.title}`, 'warning');
+        }
         
         // 如果新书签属于当前分类，添加到本地状态
         if (state.currentCategory == categoryId) {
@@ -644,6 +840,11 @@ async function updateBookmark(id, title, url, description, categoryId) {
             throw new Error(data.error || '更新书签失败');
         }
         
+        const { duplicate } = await response.json();
+        if (duplicate) {
+            showToast(`已存在相同网址的书签：${duplicate.title}`, 'warning');
+        }
+        
         // 更新本地状态
         const bookmark = state.bookmarks.find(b => b.id == id);
         if (bookmark) {
@@ -655,8 +856,8 @@ async function updateBookmark(id, title, url, description, categoryId) {
             if (bookmark.category_id != categoryId) {
                 bookmark.category_id = categoryId;
                 
-                // 重新获取当前分类的书签
-                fetchBookmarks(state.currentCategory);
+                // 同步变化的书签
+                await syncChanges();
             } else {
                 renderBookmarks();
             }
@@ -716,8 +917,8 @@ async function moveBookmarks(bookmarkIds, targetCategoryId) {
             throw new Error(data.error || '移动书签失败');
         }
         
-        // 重新获取当前分类的书签
-        fetchBookmarks(state.currentCategory);
+        // 同步变化的书签
+        await syncChanges();
         
         // 清除选择
         clearSelection();
@@ -758,16 +959,25 @@ function renderCategories() {
     const container = elements.categoriesTree;
     container.innerHTML = '';
     
+    // 一次遍历按父分类分组
+    const childrenByParent = new Map();
+    state.categories.forEach(category => {
+        const parentId = category.parent_id ?? null;
+        if (!childrenByParent.has(parentId)) {
+            childrenByParent.set(parentId, []);
+        }
+        childrenByParent.get(parentId).push(category);
+    });
+    const byPosition = (a, b) => a.position - b.position;
+    
     // 获取所有主目录
-    const mainCategories = state.categories.filter(c => c.parent_id === null)
-        .sort((a, b) => a.position - b.position);
+    const mainCategories = (childrenByParent.get(null) || []).sort(byPosition);
     
     mainCategories.forEach(mainCategory => {
         const mainCategoryElement = createCategoryElement(mainCategory, false);
         
         // 获取该主目录下的所有子目录
-        const subCategories = state.categories.filter(c => c.parent_id === mainCategory.id)
-            .sort((a, b) => a.position - b.position);
+        const subCategories = (childrenByParent.get(mainCategory.id) || []).sort(byPosition);
         
         const subcategoriesContainer = mainCategoryElement.querySelector('.subcategories-container');
         
@@ -817,6 +1027,14 @@ function createCategoryElement(category, isSubcategory = false) {
     name.textContent = category.name;
     iconNameContainer.appendChild(name);
     
+    // 书签数量（主目录包括其子目录）
+    if (category.total_count !== undefined) {
+        const count = document.createElement('span');
+        count.className = 'category-count';
+        count.textContent = category.total_count;
+        iconNameContainer.appendChild(count);
+    }
+    
     // 将点击事件添加到iconNameContainer而不是整个div
     iconNameContainer.addEventListener('click', (e) => {
         e.stopPropagation();
@@ -949,8 +1167,8 @@ async function handleDrop(e) {
             throw new Error(data.error || '移动分类失败');
         }
         
-        // 重新加载分类列表
-        await fetchCategories();
+        // 同步变化的分类
+        await syncChanges();
         
         // 恢复展开状态
         state.expandedCategories = expandedState;
@@ -1150,7 +1368,23 @@ function createBookmarkElement(bookmark) {
     
     const title = document.createElement('div');
     title.className = 'bookmark-title';
-    title.textContent = bookmark.title;
+    
+    const iconUrl = siteIconUrl(bookmark.url);
+    if (iconUrl) {
+        const icon = document.createElement('img');
+        icon.className = 'bookmark-icon';
+        icon.src = iconUrl;
+        icon.alt = '';
+        icon.loading = 'lazy';
+        // 图标可能已从缓存中淘汰
+        icon.addEventListener('error', () => icon.remove());
+        title.appendChild(icon);
+    }
+    
+    const titleText = document.createElement('span');
+    titleText.className = 'bookmark-title-text';
+    titleText.textContent = bookmark.title;
+    title.appendChild(titleText);
     
     const description = document.createElement('div');
     description.className = 'bookmark-description';
@@ -1270,15 +1504,13 @@ function createBookmarkElement(bookmark) {
                 }
                 
                 // 本地更新
-                await fetchBookmarks(state.currentCategory);
+                await syncChanges();
                 if (container) {
                     container.classList.remove('loading');
                 }
                 
-                // 异步更新全局书签
-                setTimeout(() => {
-                    fetchAllBookmarks();
-                }, 200);
+                // 异步更新搜索结果
+                refreshSearchResults();
                 
             } catch (error) {
                 console.error(error);
@@ -1629,8 +1861,8 @@ function submitBookmarkForm() {
         updateBookmark(id, title, url, description, categoryId).then(success => {
             if (success) {
                 closeModal(elements.bookmarkModal);
-                // 刷新所有书签以便搜索
-                fetchAllBookmarks();
+                // 刷新搜索结果
+                refreshSearchResults();
             }
         });
     } else {
@@ -1638,8 +1870,8 @@ function submitBookmarkForm() {
         createBookmark(title, url, description, categoryId).then(newBookmark => {
             if (newBookmark) {
                 closeModal(elements.bookmarkModal);
-                // 刷新所有书签以便搜索
-                fetchAllBookmarks();
+                // 刷新搜索结果
+                refreshSearchResults();
             }
         });
     }
@@ -1870,8 +2102,8 @@ async function moveCategoryToParent() {
             throw new Error(error.message || '移动分类失败');
         }
         
-        // 刷新分类列表
-        await fetchCategories();
+        // 同步变化的分类
+        await syncChanges();
         
         closeModal(elements.categoryMoveModal);
         state.categoryToMove = null;
@@ -1932,6 +2164,56 @@ async function exportSelectedBookmarks() {
     }
 }
 
+// 导入书签文件，服务器每写完一批返回一行进度
+async function importBookmarks(file) {
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('progress', 'true');
+    
+    elements.importBookmarksBtn.disabled = true;
+    try {
+        const response = await fetch('/api/bookmarks/import', {
+            method: 'POST',
+            body: formData
+        });
+        
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || '导入失败');
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let stats = null;
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (!line) continue;
+                stats = JSON.parse(line);
+                if (stats.error) {
+                    throw new Error(stats.error);
+                }
+                elements.importBookmarksBtn.innerHTML = `<i class="fas fa-spinner fa-spin"></i> 已处理 ${stats.processed}`;
+            }
+        }
+        
+        // 导入的数据量可能很大，直接重新获取全部数据
+        await reloadAll();
+        showSuccess(`导入完成：新增 ${stats.imported} 条，跳过重复 ${stats.duplicates} 条`);
+    } catch (error) {
+        showError(error.message || '导入失败');
+        await fetchCategories();
+    } finally {
+        elements.importBookmarksBtn.disabled = false;
+        elements.importBookmarksBtn.innerHTML = '<i class="fas fa-file-import"></i> 导入';
+    }
+}
+
 function renderPagination() {
     const container = document.createElement('div');
     container.className = 'pagination';
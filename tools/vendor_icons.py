@@ -0,0 +1,127 @@
+"""生成本地托管的 Font Awesome 图标字体子集
+
+扫描模板和前端脚本中用到的 fa-* 图标，从 Font Awesome Free 发行包中裁剪出只包含这些图标的 woff2 字体，
+连同对应的CSS写入 static/vendor/fontawesome。页面新增图标后重新运行：
+
+    pip install fonttools brotli
+    pip download fontawesomefree==6.0.0 --no-deps -d /tmp/fa && unzip -q /tmp/fa/*.whl -d /tmp/fa
+    python tools/vendor_icons.py --source /tmp/fa/fontawesomefree/static/fontawesomefree
+"""
+import argparse
+import glob
+import os
+import re
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCANNED = ['templates/*.html', 'static/js/*.js']
+OUTPUT = os.path.join(ROOT, 'static', 'vendor', 'fontawesome')
+
+# 字体文件 -> (font-family, font-weight, 使用它的样式类)
+FONTS = {
+    'fa-solid-900': ('Font Awesome 6 Free', 900, ('fas', 'fa-solid')),
+    'fa-brands-400': ('Font Awesome 6 Brands', 400, ('fab', 'fa-brands')),
+}
+# 不是图标的工具类，由下面的CSS模板直接提供
+UTILITIES = {'fa-spin'}
+
+BASE_CSS = '''/*!
+ * Font Awesome Free {version} by @fontawesome - https://fontawesome.com
+ * License - https://fontawesome.com/license/free (Icons: CC BY 4.0, Fonts: SIL OFL 1.1, Code: MIT License)
+ * 本文件由 tools/vendor_icons.py 生成，只包含页面用到的图标，不要手工修改
+ */
+.fa, .fas, .fa-solid, .fab, .fa-brands {{
+  -moz-osx-font-smoothing: grayscale;
+  -webkit-font-smoothing: antialiased;
+  display: inline-block;
+  font-style: normal;
+  font-variant: normal;
+  line-height: 1;
+  text-rendering: auto; }}
+
+.fa-spin {{
+  animation: fa-spin 2s infinite linear; }}
+
+@keyframes fa-spin {{
+  0% {{ transform: rotate(0deg); }}
+  100% {{ transform: rotate(360deg); }} }}
+'''
+
+FONT_FACE_CSS = '''@font-face {{
+  font-family: '{family}';
+  font-style: normal;
+  font-weight: {weight};
+  font-display: block;
+  src: url("{filename}.woff2") format("woff2"); }}
+
+{selectors} {{
+  font-family: '{family}';
+  font-weight: {weight}; }}
+'''
+
+def find_used_icons():
+    icons = set()
+    for pattern in SCANNED:
+        for path in glob.glob(os.path.join(ROOT, pattern)):
+            with open(path, encoding='utf-8') as f:
+                icons.update(re.findall(r'\bfa-[a-z0-9-]+', f.read()))
+    return icons - UTILITIES - {style for _, _, styles in FONTS.values() for style in styles}
+
+def parse_codepoints(css):
+    # .fa-name::before { content: "\f123"; }，同一个图标的别名各有一条规则
+    return {
+        name: int(codepoint, 16)
+        for name, codepoint in re.findall(r'\.(fa-[a-z0-9-]+):{1,2}before\s*\{\s*content:\s*"\\([0-9a-f]+)"', css)
+    }
+
+def subset_font(source, target, codepoints):
+    from fontTools import subset
+    options = subset.Options()
+    options.flavor = 'woff2'
+    options.layout_features = []
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    font = subset.load_font(source, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+    subset.save_font(font, target, options)
+    return {codepoint for table in font['cmap'].tables for codepoint in table.cmap}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', required=True, help='Font Awesome Free 发行包目录（包含 css/ 和 webfonts/）')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.source, 'css', 'all.css'), encoding='utf-8') as f:
+        css = f.read()
+    version = re.search(r'Font Awesome Free ([\d.]+)', css).group(1)
+    codepoints = parse_codepoints(css)
+
+    icons = find_used_icons()
+    unknown = sorted(icons - set(codepoints))
+    if unknown:
+        sys.exit(f"Font Awesome {version} 中没有这些图标: {', '.join(unknown)}")
+
+    os.makedirs(OUTPUT, exist_ok=True)
+    parts = [BASE_CSS.format(version=version)]
+    for filename, (family, weight, styles) in FONTS.items():
+        wanted = {codepoints[icon] for icon in icons}
+        covered = subset_font(os.path.join(args.source, 'webfonts', f'{filename}.ttf'),
+                              os.path.join(OUTPUT, f'{filename}.woff2'), wanted)
+        selectors = ', '.join(f'.{style}' for style in styles)
+        parts.append(FONT_FACE_CSS.format(family=family, weight=weight, filename=filename, selectors=selectors))
+        print(f'{filename}.woff2: {len(covered & wanted)} 个图标')
+
+    parts.append('')
+    for icon in sorted(icons):
+        parts.append(f'.{icon}::before {{\n  content: "\\{codepoints[icon]:x}"; }}\n')
+
+    with open(os.path.join(OUTPUT, 'icons.css'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(parts))
+    shutil.copy(os.path.join(args.source, 'LICENSE.txt'), os.path.join(OUTPUT, 'LICENSE.txt'))
+    print(f'已写入 {os.path.relpath(OUTPUT, ROOT)}: {len(icons)} 个图标')
+
+if __name__ == '__main__':
+    main()